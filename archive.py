@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""Cold archive of old device_readings in columnar files.
+
+Readings older than ``--older-than`` days are moved out of MariaDB into
+NumPy column files, one directory per device and day:
+
+    archive/<device>/<YYYY-MM-DD>/<first_id>-<last_id>/
+        ts.npy      datetime64[s]
+        code.npy    uint16, index into meta.json "codes"
+        value.npy   float64
+        meta.json   {"codes": [...], "units": [...], "rows": n}
+
+or, with ``--compress``, a single columns.npz (np.savez_compressed) instead of
+the three .npy files.
+
+The export walks device_readings in id order in chunks of ``--chunk`` rows,
+so memory stays bounded. Each chunk's parts are written first and then, in
+one transaction, the rows are deleted and the parts recorded in
+archive_parts; parts on disk that are not in that table are leftovers of an
+interrupted run and are removed on the next start, so every row ends up in
+the archive exactly once.
+
+After a successful export the raw JSON history in device_status is pruned
+to the same cutoff, so the hot database stays small: on a partitioned table
+the partitions entirely older than the cutoff are dropped (partitions.py),
+on a legacy unpartitioned one the rows are deleted in chunks. Only the
+decoded readings are archived; ``--keep-status`` keeps device_status whole.
+
+The .npy files are deliberately left uncompressed by default so they can be
+memory-mapped: load() maps only the columns it needs for the days in range,
+which is what makes year-long queries fast (a row takes 18 bytes instead of a
+JSON document). Compressed parts (usually 3-5x smaller, since ts and code
+repeat a lot) cannot be mapped and are read whole into memory; load() handles
+both kinds, so a tree can mix them.
+
+Usage:
+    python archive.py export --older-than 365
+    python archive.py export --older-than 365 --compress
+    python archive.py export --older-than 365 --keep-status
+    python archive.py query termometro_salon va_temperature --start 2025-01-01 --end 2025-12-31
+
+    from archive import load
+    data = load('termometro_salon', 'va_temperature', start, end)   # {'ts': array, 'value': array}
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+try:
+    import numpy as np
+except ImportError:  # numpy es opcional salvo para el archivo
+    np = None
+
+from db_mariadb import ensure_readings_table, ensure_table_once, get_pool
+from partitions import drop_expired_partitions, list_partitions
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+READINGS_TABLE = 'device_readings'
+PARTS_TABLE = 'archive_parts'
+STATUS_TABLE = 'device_status'
+# Partes en un .npz comprimido (ocupan menos pero no se pueden leer con memory-map)
+COMPRESS = os.getenv('ARCHIVE_COMPRESS', '0') == '1'
+
+
+def ensure_parts_table(conn, table_name=PARTS_TABLE):
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table_name} (
+                part VARCHAR(255) PRIMARY KEY,
+                rows_count INT NOT NULL,
+                created_at DATETIME
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+            """
+        )
+    conn.commit()
+
+
+def _safe(name):
+    """Device name usable as a directory name."""
+    return "".join(c if c.isalnum() or c in '-_.' else '_' for c in name) or '_'
+
+
+def write_part(root, device_name, day, rows, compress=False):
+    """Write (id, ts, code, value, unit) rows of one device and day; returns the part path relative to root."""
+    codes = sorted({r[2] for r in rows})
+    index = {c: i for i, c in enumerate(codes)}
+    units = {r[2]: r[4] for r in rows}
+    part = os.path.join(_safe(device_name), day.isoformat(), f"{rows[0][0]}-{rows[-1][0]}")
+    final = os.path.join(root, part)
+    tmp = final + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    columns = {
+        'ts': np.array([r[1] for r in rows], dtype='datetime64[s]'),
+        'code': np.array([index[r[2]] for r in rows], dtype=np.uint16),
+        'value': np.array([np.nan if r[3] is None else r[3] for r in rows], dtype=np.float64),
+    }
+    if compress:
+        np.savez_compressed(os.path.join(tmp, 'columns.npz'), **columns)
+    else:
+        for name, array in columns.items():
+            np.save(os.path.join(tmp, f'{name}.npy'), array)
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump({'device_name': device_name, 'codes': codes, 'units': [units[c] for c in codes],
+                   'rows': len(rows)}, f)
+    os.rename(tmp, final)
+    return part
+
+
+def _part_dirs(root):
+    """Relative paths of every part directory under root (device/day/part)."""
+    if not os.path.isdir(root):
+        return
+    for device in os.listdir(root):
+        device_dir = os.path.join(root, device)
+        if not os.path.isdir(device_dir):
+            continue
+        for day in os.listdir(device_dir):
+            day_dir = os.path.join(device_dir, day)
+            if os.path.isdir(day_dir):
+                for part in os.listdir(day_dir):
+                    yield os.path.join(device, day, part)
+
+
+def remove_orphans(conn, root):
+    """Delete parts left on disk by a run that did not commit them."""
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT part FROM {PARTS_TABLE}")
+        committed = {row[0] for row in cur.fetchall()}
+    conn.commit()
+    removed = 0
+    for part in list(_part_dirs(root)):
+        if part not in committed:
+            shutil.rmtree(os.path.join(root, part), ignore_errors=True)
+            removed += 1
+    if removed:
+        logger.info(f"Archivo: eliminadas {removed} partes sin confirmar de una ejecución interrumpida")
+    return removed
+
+
+def export_chunk(conn, root, cutoff, after_id, chunk_rows, compress=False):
+    """Archive the next chunk of readings older than cutoff; returns (rows, last id) or (0, None)."""
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT id, device_name, ts, code, value, unit FROM {READINGS_TABLE} "
+                    f"WHERE id > %s AND ts < %s ORDER BY id LIMIT %s", (after_id, cutoff, chunk_rows))
+        rows = cur.fetchall()
+    conn.commit()
+    if not rows:
+        return 0, None
+    groups = defaultdict(list)
+    for id_, device_name, ts, code, value, unit in rows:
+        groups[(device_name, ts.date())].append((id_, ts, code, value, unit))
+    parts = [(write_part(root, device_name, day, group, compress), len(group))
+             for (device_name, day), group in groups.items()]
+    ids = [r[0] for r in rows]
+    with conn.cursor() as cur:
+        for i in range(0, len(ids), 1000):
+            batch = ids[i:i + 1000]
+            cur.execute(f"DELETE FROM {READINGS_TABLE} WHERE id IN ({', '.join(['%s'] * len(batch))})", batch)
+        cur.executemany(f"INSERT INTO {PARTS_TABLE} (part, rows_count, created_at) VALUES (%s, %s, NOW())", parts)
+    conn.commit()
+    return len(rows), ids[-1]
+
+
+def prune_status(conn, older_than_days, table_name=STATUS_TABLE, chunk_rows=50000):
+    """Remove device_status history older than the archive cutoff; returns rows or partitions removed."""
+    if list_partitions(conn, table_name):
+        # DROP PARTITION: solo las particiones enteras anteriores al corte, sin borrar fila a fila
+        return len(drop_expired_partitions(conn, table_name, older_than_days))
+    cutoff = datetime.combine(date.today() - timedelta(days=older_than_days), datetime.min.time())
+    total = 0
+    while True:
+        with conn.cursor() as cur:
+            cur.execute(f"DELETE FROM {table_name} WHERE ts < %s LIMIT %s", (cutoff, chunk_rows))
+            deleted = cur.rowcount
+        conn.commit()
+        total += deleted
+        if deleted < chunk_rows:
+            break
+    if total:
+        logger.info(f"Archivo: borradas {total} filas de {table_name} anteriores a {cutoff:%Y-%m-%d}")
+    return total
+
+
+def run_export(older_than_days, root=ARCHIVE_DIR, chunk_rows=50000, compress=COMPRESS, prune=True):
+    if np is None:
+        raise RuntimeError("El archivo necesita numpy (pip install numpy)")
+    cutoff = datetime.combine(date.today() - timedelta(days=older_than_days), datetime.min.time())
+    total = 0
+    with get_pool().connection() as conn:
+        ensure_table_once(conn, READINGS_TABLE, ensure_readings_table)
+        ensure_table_once(conn, PARTS_TABLE, ensure_parts_table)
+        ensure_table_once(conn, STATUS_TABLE)
+        remove_orphans(conn, root)
+        last_id = 0
+        while True:
+            n, last_id = export_chunk(conn, root, cutoff, last_id, chunk_rows, compress)
+            if not n:
+                break
+            total += n
+            logger.info(f"Archivo: {total} lecturas anteriores a {cutoff:%Y-%m-%d} movidas a {root}")
+        if prune:
+            prune_status(conn, older_than_days, chunk_rows=chunk_rows)
+    return total
+
+
+def load(device_name, code=None, start=None, end=None, columns=('ts', 'value'), root=ARCHIVE_DIR):
+    """Archived readings of one device as {column: array}, optionally for one code and [start, end).
+
+    Only the day directories in range are opened and only the requested
+    columns (plus ts/code when filtering) are memory-mapped; compressed
+    parts are decompressed whole.
+    """
+    if np is None:
+        raise RuntimeError("El archivo necesita numpy (pip install numpy)")
+    device_dir = os.path.join(root, _safe(device_name))
+    if not os.path.isdir(device_dir):
+        return {c: np.array([]) for c in columns}
+    start_day = start.date() if isinstance(start, datetime) else start
+    end_day = end.date() if isinstance(end, datetime) else end
+    need = set(columns) | ({'ts'} if start or end else set()) | ({'code'} if code else set())
+    chunks = defaultdict(list)
+    for day in sorted(os.listdir(device_dir)):
+        try:
+            day_date = date.fromisoformat(day)
+        except ValueError:
+            continue
+        if (start_day and day_date < start_day) or (end_day and day_date > end_day):
+            continue
+        day_dir = os.path.join(device_dir, day)
+        parts = [p for p in os.listdir(day_dir) if not p.endswith('.tmp')]
+        for part in sorted(parts, key=lambda p: int(p.split('-')[0])):
+            part_dir = os.path.join(day_dir, part)
+            with open(os.path.join(part_dir, 'meta.json')) as f:
+                meta = json.load(f)
+            if code and code not in meta['codes']:
+                continue
+            packed = os.path.join(part_dir, 'columns.npz')
+            if os.path.exists(packed):
+                with np.load(packed) as npz:
+                    arrays = {c: npz[c] for c in need}
+            else:
+                arrays = {c: np.load(os.path.join(part_dir, f'{c}.npy'), mmap_mode='r') for c in need}
+            mask = None
+            if code:
+                mask = arrays['code'] == meta['codes'].index(code)
+            if start:
+                m = arrays['ts'] >= np.datetime64(start, 's')
+                mask = m if mask is None else mask & m
+            if end:
+                m = arrays['ts'] < np.datetime64(end, 's')
+                mask = m if mask is None else mask & m
+            for c in columns:
+                chunks[c].append(arrays[c] if mask is None else arrays[c][mask])
+    result = {c: np.concatenate(chunks[c]) if chunks[c] else np.array([]) for c in columns}
+    if 'ts' in result and len(result['ts']):
+        # las filas que llegaron tarde (spool) pueden estar en una parte posterior
+        order = np.argsort(result['ts'], kind='stable')
+        result = {c: a[order] for c, a in result.items()}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archivo en columnas de las lecturas antiguas de device_readings")
+    parser.add_argument('--root', default=ARCHIVE_DIR)
+    sub = parser.add_subparsers(dest='command', required=True)
+    export = sub.add_parser('export', help="Mover a ficheros las lecturas más antiguas que N días")
+    export.add_argument('--older-than', type=int, default=int(os.getenv('ARCHIVE_DAYS', 365)), metavar='DIAS')
+    export.add_argument('--chunk', type=int, default=50000, help="Lecturas por lote")
+    export.add_argument('--compress', action='store_true', default=COMPRESS,
+                        help="Guardar cada parte en un .npz comprimido (sin memory-map al leerla)")
+    export.add_argument('--keep-status', action='store_true',
+                        help="No borrar de device_status el JSON anterior al corte")
+    query = sub.add_parser('query', help="Resumen de las lecturas archivadas de un dispositivo y código")
+    query.add_argument('device')
+    query.add_argument('code')
+    query.add_argument('--start', type=datetime.fromisoformat)
+    query.add_argument('--end', type=datetime.fromisoformat)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    started = time.monotonic()
+    if args.command == 'export':
+        n = run_export(args.older_than, args.root, args.chunk, args.compress, not args.keep_status)
+        logger.info(f"Archivo terminado: {n} lecturas en {time.monotonic() - started:.1f}s")
+        return
+    data = load(args.device, args.code, args.start, args.end, root=args.root)
+    values = data['value']
+    if not len(values):
+        print("Sin lecturas archivadas en ese rango")
+        return
+    print(f"{len(values)} lecturas de {data['ts'][0]} a {data['ts'][-1]}: "
+          f"min={np.nanmin(values):.3f} max={np.nanmax(values):.3f} media={np.nanmean(values):.3f} "
+          f"({time.monotonic() - started:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
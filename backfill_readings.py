@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""Resumable backfill of device_readings from the JSON history in device_status.
+
+Reads device_status in primary-key order through an unbuffered (server-side)
+cursor, decodes each row with the device's mapping (the same DpsDecoder used by
+the live ingest path) and writes the readings in bulk batches. Each batch is
+committed together with its checkpoint, so an interrupted run resumes from the
+last committed id without duplicating rows.
+
+The first run fixes the stop id: the last device_status row older than the
+first reading already in device_readings (i.e. written by the live ingest),
+or the current max id if the table is empty. Later rows are never touched.
+
+Usage:
+    python backfill_readings.py [--batch 2000] [--max-rows-per-sec 5000] [--workers 4]
+"""
+import argparse
+import json
+import logging
+import time
+from collections import deque
+from multiprocessing import Pool
+
+import pymysql
+import pymysql.cursors
+
+from db_mariadb import ensure_readings_table, ensure_table, ensure_table_once, get_db_config, get_pool
+from dps_utils import get_decoder, sensor_readings
+from device_registry import get_registry
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_TABLE = 'backfill_checkpoint'
+READINGS_TABLE = 'device_readings'
+
+
+def ensure_checkpoint_table(conn, table_name=CHECKPOINT_TABLE):
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table_name} (
+                name VARCHAR(100) PRIMARY KEY,
+                last_id BIGINT NOT NULL DEFAULT 0,
+                stop_id BIGINT NOT NULL DEFAULT 0,
+                rows_done BIGINT NOT NULL DEFAULT 0,
+                updated_at DATETIME
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+            """
+        )
+    conn.commit()
+
+
+def _device_info(device_name):
+    """Mapping for a device name, from devices.json or devices.monitor.json."""
+    return get_registry('devices.json').by_name(device_name) \
+        or get_registry('devices.monitor.json').by_name(device_name)
+
+
+def decode_rows(rows):
+    """Decode (id, device_name, ts, origin, status_json) rows into device_readings tuples.
+
+    Top-level so it can run in a worker process.
+    """
+    readings = []
+    for _, device_name, ts, origin, status_json in rows:
+        try:
+            status = json.loads(status_json)
+        except (TypeError, ValueError):
+            continue
+        if origin == 'ariston_daemon':
+            decoded = sensor_readings(status)
+        else:
+            decoded = get_decoder(_device_info(device_name)).readings(status)
+        readings.extend((device_name, ts) + tuple(r) for r in decoded)
+    return readings
+
+
+def load_checkpoint(conn, name):
+    """Return (last_id, stop_id, rows_done), creating the checkpoint on first run."""
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT last_id, stop_id, rows_done FROM {CHECKPOINT_TABLE} WHERE name = %s", (name,))
+        row = cur.fetchone()
+        if row:
+            return row
+        cur.execute(f"SELECT MIN(ts) FROM {READINGS_TABLE}")
+        first_live = cur.fetchone()[0]
+        if first_live is None:
+            cur.execute("SELECT COALESCE(MAX(id), 0) FROM device_status")
+        else:
+            cur.execute("SELECT COALESCE(MAX(id), 0) FROM device_status WHERE ts < %s", (first_live,))
+        stop_id = cur.fetchone()[0]
+        cur.execute(f"INSERT INTO {CHECKPOINT_TABLE} (name, last_id, stop_id, rows_done, updated_at) "
+                    f"VALUES (%s, 0, %s, 0, NOW())", (name, stop_id))
+    conn.commit()
+    return 0, stop_id, 0
+
+
+def write_batch(conn, name, readings, last_id, rows_done):
+    """Insert a batch of readings and advance the checkpoint in one transaction."""
+    with conn.cursor() as cur:
+        if readings:
+            cur.executemany(f"INSERT INTO {READINGS_TABLE} (device_name, ts, dps_key, code, value, unit) "
+                            f"VALUES (%s, %s, %s, %s, %s, %s)", readings)
+        cur.execute(f"UPDATE {CHECKPOINT_TABLE} SET last_id = %s, rows_done = %s, updated_at = NOW() "
+                    f"WHERE name = %s", (last_id, rows_done, name))
+    conn.commit()
+
+
+def stream_rows(last_id, stop_id, batch_size):
+    """Yield batches of device_status rows in id order from an unbuffered cursor."""
+    db_conf = get_db_config()
+    conn = pymysql.connect(host=db_conf['host'], user=db_conf['user'], password=db_conf['password'],
+                           database=db_conf['db'], port=int(db_conf['port']), charset=db_conf.get('charset', 'utf8mb4'),
+                           cursorclass=pymysql.cursors.SSCursor)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, device_name, ts, origin, status_json FROM device_status "
+                        "WHERE id > %s AND id <= %s ORDER BY id", (last_id, stop_id))
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+    finally:
+        conn.close()
+
+
+def run_backfill(batch_size=2000, max_rows_per_sec=0, workers=0, name='device_readings'):
+    with get_pool().connection() as conn:
+        ensure_table_once(conn, 'device_status', ensure_table)
+        ensure_table_once(conn, READINGS_TABLE, ensure_readings_table)
+        ensure_table_once(conn, CHECKPOINT_TABLE, ensure_checkpoint_table)
+        last_id, stop_id, rows_done = load_checkpoint(conn, name)
+        if last_id >= stop_id:
+            logger.info(f"Backfill ya completo (stop_id={stop_id})")
+            return rows_done
+        logger.info(f"Backfill desde id {last_id} hasta {stop_id}")
+
+        pool = Pool(workers) if workers > 1 else None
+        started = time.monotonic()
+        try:
+            batches = stream_rows(last_id, stop_id, batch_size)
+            if pool is not None:
+                decoded = _decode_in_pool(pool, batches, max_pending=workers * 2)
+            else:
+                decoded = map(_decode_with_last_id, batches)
+            done_this_run = 0
+            for batch_last_id, n_rows, readings in decoded:
+                rows_done += n_rows
+                done_this_run += n_rows
+                write_batch(conn, name, readings, batch_last_id, rows_done)
+                if max_rows_per_sec:
+                    # limitar el ritmo para no quitarle MariaDB a la ingesta en vivo
+                    expected = done_this_run / max_rows_per_sec
+                    elapsed = time.monotonic() - started
+                    if expected > elapsed:
+                        time.sleep(min(expected - elapsed, 5.0))
+                logger.info(f"Backfill: id {batch_last_id}/{stop_id}, {rows_done} filas")
+        finally:
+            if pool is not None:
+                pool.terminate()
+    return rows_done
+
+
+def _decode_with_last_id(rows):
+    return rows[-1][0], len(rows), decode_rows(rows)
+
+
+def _decode_in_pool(pool, batches, max_pending):
+    """Decode batches in worker processes, in order, with at most max_pending in flight.
+
+    Pool.imap would read the whole cursor ahead into memory; this keeps memory
+    bounded and results ordered, so the checkpoint is always the highest id written.
+    """
+    pending = deque()
+    for rows in batches:
+        pending.append(pool.apply_async(_decode_with_last_id, (rows,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rellena device_readings a partir del histórico de device_status")
+    parser.add_argument('--batch', type=int, default=2000, help="Filas de device_status por lote")
+    parser.add_argument('--max-rows-per-sec', type=int, default=0, help="Límite de filas/s (0 = sin límite)")
+    parser.add_argument('--workers', type=int, default=0, help="Procesos para decodificar (0 = en este proceso)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    started = time.monotonic()
+    rows = run_backfill(args.batch, args.max_rows_per_sec, args.workers)
+    logger.info(f"Backfill terminado: {rows} filas en {time.monotonic() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+"""Benchmarks for the decode and ingest hot paths.
+
+Usage:
+    python -m benchmarks.run --target sqlite --output bench.json
+    python -m benchmarks.run --target mariadb
+    python -m benchmarks.fake_devices --devices 50      # dispositivos Tuya simulados
+    python -m benchmarks.load --devices 100 --rates 0.5,1,2
+"""
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Micro-benchmark: compiled DpsDecoder vs the per-key dps_utils helpers.
+
+Builds one payload per device in new/tuya-raw.json (its cloud 'status' mapped
+back to DPS keys) and times decoding them the way print_dps used to do it
+against DpsDecoder.decode().
+
+Usage: python benchmarks/bench_dps_decoder.py [--repeat N]
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from dps_utils import (DpsDecoder, dps_sort_key, get_code_for, get_type_for,  # noqa: E402
+                       get_unit_for, scale_value)
+
+
+def load_payloads(path=os.path.join(ROOT, 'new', 'tuya-raw.json')):
+    """Return [(device_info, dps)] built from the cloud status of each device."""
+    with open(path, 'r') as f:
+        devices = json.load(f)['result']
+    payloads = []
+    for device in devices:
+        mapping = device.get('mapping') or {}
+        key_by_code = {entry.get('code'): k for k, entry in mapping.items()}
+        dps = {key_by_code[s['code']]: s['value'] for s in device.get('status', []) if s['code'] in key_by_code}
+        if dps:
+            payloads.append((device, dps))
+    return payloads
+
+
+def decode_legacy(dps, mapping):
+    """Decoding as print_dps did before DpsDecoder (JSON parsing per key)."""
+    out = []
+    for k, v in sorted(dps.items(), key=dps_sort_key):
+        out.append((get_code_for(k, mapping), get_type_for(k, mapping), get_unit_for(k, mapping),
+                    scale_value(k, v, mapping)))
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    payloads = load_payloads()
+    decoders = [(DpsDecoder(device.get('mapping')), dps) for device, dps in payloads]
+    n_keys = sum(len(dps) for _, dps in payloads)
+
+    legacy = timeit.timeit(lambda: [decode_legacy(dps, device.get('mapping') or {}) for device, dps in payloads],
+                           number=args.repeat)
+    compiled = timeit.timeit(lambda: [decoder.decode(dps) for decoder, dps in decoders], number=args.repeat)
+
+    total = args.repeat * len(payloads)
+    print(f"{len(payloads)} payloads, {n_keys} DPS keys, {args.repeat} repeticiones")
+    print(f"legacy helpers : {legacy / total * 1e6:8.2f} us/payload")
+    print(f"DpsDecoder     : {compiled / total * 1e6:8.2f} us/payload")
+    print(f"speedup        : {legacy / compiled:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
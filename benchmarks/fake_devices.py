@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""Fake Tuya devices for end-to-end load tests of the monitor daemons.
+
+Each virtual device listens on its own loopback address (127.1.x.y) on the
+Tuya TCP port 6668 and speaks the local protocol the way tinytuya expects it:
+3.3 (AES-ECB with the device key, CRC32 frames) or 3.4 (session key
+negotiation and HMAC-SHA256 frames). It answers status (DP_QUERY /
+DP_QUERY_NEW), heartbeats and control commands, pushes a STATUS frame to its
+open connections every 1/rate seconds and announces itself with encrypted UDP
+broadcasts on 6667.
+
+The DPS streams start from the cloud status of the devices in
+new/tuya-raw.json and drift within each DP's min/max (random walks for
+integers, new phase_a/b/c blobs for the energy meters). DP "250" carries the
+generation time in ms, so the load driver can measure ingest lag from
+device_status.
+
+A devices file in devices.json format (names sim_NNNN_*, with ip, key and
+version) is written for the daemons: tuya_async_monitor --devices-file, or
+TUYA_DEVICES_FILE for the broadcast monitor.
+
+Linux routes all of 127.0.0.0/8 to the loopback, so no setup is needed there;
+on other systems add the addresses as loopback aliases first.
+
+Usage:
+    python -m benchmarks.fake_devices --devices 50 --rate 0.5 --version 3.4
+    python -m benchmarks.fake_devices --devices 200 --latency 0.05 --loss 0.01 --dropout 0.001
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import socket
+import struct
+import time
+
+from tinytuya.core import command_types as CT
+from tinytuya.core import header as H
+from tinytuya.core.crypto_helper import AESCipher
+from tinytuya.core.message_helper import TuyaMessage, pack_message, parse_header, unpack_message
+from tinytuya.core.udp_helper import udpkey
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TCP_PORT = 6668
+UDP_PORT = 6667
+# DP con la hora de generación (ms) para medir el lag de ingesta
+TS_DP = '250'
+RETCODE_OK = struct.pack(H.MESSAGE_RETCODE_FMT, 0)
+PHASE_CODES = ('phase_a', 'phase_b', 'phase_c')
+
+
+def load_profiles(path=os.path.join(ROOT, 'new', 'tuya-raw.json')):
+    """[(cloud device, {dps_key: value})] of the devices with a status to replay."""
+    with open(path, 'r') as f:
+        devices = json.load(f)['result']
+    profiles = []
+    for device in devices:
+        mapping = device.get('mapping') or {}
+        key_by_code = {entry.get('code'): k for k, entry in mapping.items()}
+        dps = {key_by_code[s['code']]: s['value'] for s in device.get('status', []) if s['code'] in key_by_code}
+        if dps:
+            profiles.append((device, dps))
+    return profiles
+
+
+def device_address(index, base='127.1'):
+    return f"{base}.{index // 250}.{index % 250 + 1}"
+
+
+def make_phase(voltage, current, power):
+    """phase_a blob: voltage (2 bytes, /10), current (3 bytes, /1000), power kW (3 bytes, /1000)."""
+    raw = (int(voltage * 10).to_bytes(2, 'big') + int(current * 1000).to_bytes(3, 'big')
+           + int(power * 1000).to_bytes(3, 'big'))
+    return base64.b64encode(raw).decode()
+
+
+class VirtualDevice:
+    """One fake device: DPS state, TCP server and broadcast payload."""
+
+    def __init__(self, index, profile, version=3.3, rate=0.2, latency=0.0, loss=0.0, dropout=0.0,
+                 offline_seconds=30.0, ip_base='127.1', seed=None):
+        cloud, dps = profile
+        self.rng = random.Random(seed if seed is not None else index)
+        self.index = index
+        self.cloud = cloud
+        self.name = f"sim_{index:04d}_{''.join(c if c.isalnum() else '_' for c in cloud.get('name', 'dev'))}"
+        self.dev_id = f"bfsim{index:06d}" + hashlib.md5(self.name.encode()).hexdigest()[:11]
+        self.key = ''.join(self.rng.choice('0123456789abcdef') for _ in range(16)).encode()
+        self.ip = device_address(index, ip_base)
+        self.version = version
+        self.rate = rate
+        self.latency = latency
+        self.loss = loss
+        self.dropout = dropout
+        self.offline_seconds = offline_seconds
+        self.mapping = cloud.get('mapping') or {}
+        self.dps = dict(dps)
+        self.phase = {}
+        for k, v in self.dps.items():
+            if self.mapping.get(k, {}).get('code') in PHASE_CODES:
+                self.phase[k] = [230.0, 1.0 + self.rng.random() * 4, 0.5 + self.rng.random()]
+        # writer -> sesión (clave de sesión y seqno de cada conexión)
+        self.clients = {}
+        self.server = None
+        self.offline_until = 0.0
+        self.stats = {'requests': 0, 'pushes': 0, 'lost': 0, 'dropouts': 0}
+
+    def device_entry(self):
+        """Entry for the generated devices.json."""
+        return {'name': self.name, 'id': self.dev_id, 'key': self.key.decode(), 'ip': self.ip,
+                'version': str(self.version), 'category': self.cloud.get('category'),
+                'product_name': self.cloud.get('product_name'), 'mapping': self.mapping}
+
+    def step(self):
+        """Drift a few DPs like a real device would; returns the changed ones."""
+        changed = {}
+        keys = [k for k in self.dps if k != TS_DP]
+        for k in self.rng.sample(keys, min(2, len(keys))):
+            entry = self.mapping.get(k, {})
+            value = self.dps[k]
+            if k in self.phase:
+                v, i, p = self.phase[k]
+                i = min(max(i + self.rng.uniform(-0.3, 0.3), 0.0), 40.0)
+                self.phase[k] = [min(max(v + self.rng.uniform(-1, 1), 200), 250), i, i * v / 1000]
+                value = make_phase(*self.phase[k])
+            elif isinstance(value, bool):
+                value = not value if self.rng.random() < 0.05 else value
+            elif isinstance(value, int):
+                values = entry.get('values') or {}
+                step = max(int(values.get('step', 1) or 1), 1)
+                low, high = values.get('min', value - 100), values.get('max', value + 100)
+                value = min(max(value + self.rng.choice((-step, 0, step)), low), high)
+            self.dps[k] = value
+            changed[k] = value
+        changed[TS_DP] = int(time.time() * 1000)
+        return changed
+
+    # --- protocolo ---
+
+    def _cipher(self, session):
+        return AESCipher(session['key'])
+
+    def _frame(self, session, cmd, data, header=False):
+        """Encrypted response frame (retcode 0) for ``data`` (bytes, b'' for an empty reply)."""
+        seqno = session['seqno']
+        session['seqno'] += 1
+        hmac_key = session['key'] if self.version >= 3.4 else None
+        if not data:
+            payload = RETCODE_OK
+        elif self.version >= 3.4:
+            payload = RETCODE_OK + self._cipher(session).encrypt((H.PROTOCOL_34_HEADER if header else b'') + data,
+                                                                 False)
+        else:
+            payload = RETCODE_OK + (H.PROTOCOL_33_HEADER if header else b'') + self._cipher(session).encrypt(data,
+                                                                                                            False)
+        return pack_message(TuyaMessage(seqno, cmd, 0, payload, 0, True, H.PREFIX_55AA_VALUE, False),
+                            hmac_key=hmac_key)
+
+    def _decrypt(self, session, payload):
+        if self.version < 3.4 and payload.startswith(H.PROTOCOL_VERSION_BYTES_33):
+            payload = payload[len(H.PROTOCOL_33_HEADER):]
+        data = self._cipher(session).decrypt(payload, False, decode_text=False)
+        if data.startswith(H.PROTOCOL_VERSION_BYTES_34):
+            data = data[len(H.PROTOCOL_34_HEADER):]
+        return data
+
+    def _status_json(self, dps):
+        return json.dumps({'devId': self.dev_id, 'dps': dps, 't': int(time.time())},
+                          separators=(',', ':')).encode()
+
+    def _handle(self, session, msg):
+        """Response frames for one request."""
+        cmd = msg.cmd
+        if cmd == CT.SESS_KEY_NEG_START:
+            session['local_nonce'] = self._decrypt(session, msg.payload)[:16]
+            session['remote_nonce'] = os.urandom(16)
+            data = session['remote_nonce'] + hmac.new(self.key, session['local_nonce'], hashlib.sha256).digest()
+            return [self._frame(session, CT.SESS_KEY_NEG_RESP, data)]
+        if cmd == CT.SESS_KEY_NEG_FINISH:
+            nonce = bytes(a ^ b for a, b in zip(session['local_nonce'], session['remote_nonce']))
+            session['key'] = AESCipher(self.key).encrypt(nonce, False, pad=False)
+            return []
+        if cmd == CT.HEART_BEAT:
+            return [self._frame(session, CT.HEART_BEAT, b'')]
+        if cmd in (CT.DP_QUERY, CT.DP_QUERY_NEW):
+            self.dps[TS_DP] = int(time.time() * 1000)
+            return [self._frame(session, cmd, self._status_json(self.dps))]
+        if cmd in (CT.CONTROL, CT.CONTROL_NEW):
+            request = json.loads(self._decrypt(session, msg.payload) or b'{}')
+            changed = (request.get('data') or request).get('dps') or {}
+            self.dps.update({str(k): v for k, v in changed.items()})
+            return [self._frame(session, CT.STATUS, self._status_json(changed), header=True)]
+        if cmd == CT.UPDATEDPS:
+            return [self._frame(session, CT.UPDATEDPS, b'')]
+        return []
+
+    async def _serve(self, reader, writer):
+        session = {'key': self.key, 'seqno': 1}
+        self.clients[writer] = session
+        try:
+            while True:
+                data = await reader.readexactly(struct.calcsize(H.MESSAGE_HEADER_FMT_55AA))
+                header = parse_header(data)
+                data += await reader.readexactly(header.total_length - len(data))
+                msg = unpack_message(data, hmac_key=session['key'] if self.version >= 3.4 else None,
+                                     header=header, no_retcode=True)
+                self.stats['requests'] += 1
+                if self.rng.random() < self.loss:
+                    self.stats['lost'] += 1
+                    continue
+                if self.latency:
+                    await asyncio.sleep(self.rng.uniform(0.5, 1.5) * self.latency)
+                for frame in self._handle(session, msg):
+                    writer.write(frame)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.warning(f"{self.name}: petición no válida: {e}")
+        finally:
+            self.clients.pop(writer, None)
+            writer.close()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._serve, self.ip, TCP_PORT, reuse_address=True)
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        for writer in list(self.clients):
+            writer.close()
+        self.clients.clear()
+
+    async def run(self):
+        """Start serving and push a STATUS every 1/rate seconds, with random dropouts."""
+        await self.start()
+        await asyncio.sleep(self.rng.random() / max(self.rate, 0.01))
+        while True:
+            await asyncio.sleep(self.rng.uniform(0.8, 1.2) / max(self.rate, 0.01))
+            if self.offline_until:
+                if time.monotonic() < self.offline_until:
+                    continue
+                self.offline_until = 0.0
+                await self.start()
+            if self.rng.random() < self.dropout:
+                # el dispositivo se cae (WiFi, corte de luz): cierra conexiones y no acepta nuevas
+                self.stats['dropouts'] += 1
+                self.offline_until = time.monotonic() + self.offline_seconds
+                await self.stop()
+                continue
+            changed = self.step()
+            for writer, session in list(self.clients.items()):
+                try:
+                    writer.write(self._frame(session, CT.STATUS, self._status_json(changed), header=True))
+                    self.stats['pushes'] += 1
+                except (ConnectionError, RuntimeError):
+                    self.clients.pop(writer, None)
+
+    def broadcast_packet(self):
+        data = json.dumps({'ip': self.ip, 'gwId': self.dev_id, 'active': 2, 'ability': 0, 'mode': 0,
+                           'encrypt': True, 'productKey': self.cloud.get('product_id', ''),
+                           'version': str(self.version)}).encode()
+        payload = RETCODE_OK + AESCipher(udpkey).encrypt(data, use_base64=False, pad=True)
+        return pack_message(TuyaMessage(0, CT.UDP_NEW, 0, payload, 0, True, H.PREFIX_55AA_VALUE, False))
+
+
+class Simulator:
+    """Many VirtualDevices in one event loop plus the UDP announcer."""
+
+    def __init__(self, count, version=3.3, rate=0.2, latency=0.0, loss=0.0, dropout=0.0, offline_seconds=30.0,
+                 ip_base='127.1', profiles=None):
+        profiles = profiles or load_profiles()
+        self.devices = [VirtualDevice(i, profiles[i % len(profiles)], version, rate, latency, loss, dropout,
+                                      offline_seconds, ip_base) for i in range(count)]
+
+    def set_rate(self, rate):
+        for device in self.devices:
+            device.rate = rate
+
+    def write_devices_file(self, path):
+        with open(path, 'w') as f:
+            json.dump([d.device_entry() for d in self.devices], f, indent=1)
+
+    def stats(self):
+        totals = {'requests': 0, 'pushes': 0, 'lost': 0, 'dropouts': 0, 'connections': 0}
+        for device in self.devices:
+            for k, v in device.stats.items():
+                totals[k] += v
+            totals['connections'] += len(device.clients)
+        return totals
+
+    async def _announce(self, address, interval):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.setblocking(False)
+        try:
+            while True:
+                for device in self.devices:
+                    if not device.offline_until:
+                        try:
+                            sock.sendto(device.broadcast_packet(), (address, UDP_PORT))
+                        except OSError as e:
+                            logger.debug(f"Broadcast de {device.name}: {e}")
+                    await asyncio.sleep(interval / max(len(self.devices), 1))
+        finally:
+            sock.close()
+
+    async def run(self, broadcast_address='127.255.255.255', broadcast_interval=10.0):
+        tasks = [asyncio.create_task(d.run(), name=d.name) for d in self.devices]
+        if broadcast_interval:
+            tasks.append(asyncio.create_task(self._announce(broadcast_address, broadcast_interval)))
+        logger.info(f"{len(self.devices)} dispositivos simulados en {self.devices[0].ip}..{self.devices[-1].ip}"
+                    f":{TCP_PORT}")
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            for device in self.devices:
+                await device.stop()
+
+
+def add_arguments(parser):
+    parser.add_argument('--devices', type=int, default=20, help="Número de dispositivos simulados")
+    parser.add_argument('--version', type=float, choices=(3.3, 3.4), default=3.3)
+    parser.add_argument('--rate', type=float, default=0.2, help="Actualizaciones por segundo de cada dispositivo")
+    parser.add_argument('--latency', type=float, default=0.0, help="Latencia media de respuesta (s)")
+    parser.add_argument('--loss', type=float, default=0.0, help="Probabilidad de no responder a una petición")
+    parser.add_argument('--dropout', type=float, default=0.0,
+                        help="Probabilidad por actualización de que el dispositivo se desconecte")
+    parser.add_argument('--offline-seconds', type=float, default=30.0, help="Duración de cada desconexión")
+    parser.add_argument('--ip-base', default='127.1', help="Dos primeros octetos de las IPs de loopback")
+    parser.add_argument('--broadcast-address', default='127.255.255.255')
+    parser.add_argument('--broadcast-interval', type=float, default=10.0, help="0 desactiva los broadcasts")
+    parser.add_argument('--devices-file', default='devices.sim.json',
+                        help="Fichero devices.json generado para los monitores")
+
+
+def simulator_from_args(args):
+    return Simulator(args.devices, args.version, args.rate, args.latency, args.loss, args.dropout,
+                     args.offline_seconds, args.ip_base)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dispositivos Tuya simulados para pruebas de carga")
+    add_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    sim = simulator_from_args(args)
+    sim.write_devices_file(args.devices_file)
+    logger.info(f"Dispositivos escritos en {args.devices_file}")
+    try:
+        asyncio.run(sim.run(args.broadcast_address, args.broadcast_interval))
+    except KeyboardInterrupt:
+        logger.info(f"Simulador detenido: {sim.stats()}")
+
+
+if __name__ == "__main__":
+    main()
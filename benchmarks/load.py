@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""End-to-end load test: fake devices -> monitor daemon -> MariaDB.
+
+Starts benchmarks.fake_devices in-process, optionally launches the daemon under
+test against the generated devices file, and raises the update rate of every
+device step by step. During each step it reads the new sim_* rows of
+device_status and reports:
+
+  - offered/s: STATUS pushes the fake devices sent
+  - rows/s: rows committed to device_status
+  - receive lag p50/p95: device_status.ts (when the daemon got the payload)
+    minus the generation time in DP "250" (second resolution)
+  - freshness lag: age of the newest committed reading at the end of the step
+
+The pipeline is saturated from the first step where rows/s stays clearly below
+offered/s or the freshness lag keeps growing. The pushes are what
+tuya_async_monitor ingests; the broadcast monitor only polls each device when
+it announces itself (at most every REPEAT_INTERVAL), so for it rows/s is
+bounded by the broadcasts, not by --rates.
+
+Usage:
+    python -m benchmarks.load --devices 100 --rates 0.2,0.5,1,2 --step-seconds 60
+    python -m benchmarks.load --monitor none --devices 500 --version 3.4   # daemons lanzados aparte
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.fake_devices import TS_DP, add_arguments, simulator_from_args  # noqa: E402
+from db_mariadb import get_pool  # noqa: E402
+
+MONITORS = {
+    'async': lambda devices_file: [sys.executable, 'tuya_async_monitor.py', '--devices-file', devices_file],
+    'broadcast': lambda devices_file: [sys.executable, 'tuya_brodcast_monitor.py'],
+}
+# las filas de la prueba empiezan por sim_ (LIKE con _ escapado)
+SIM_ROWS = "device_name LIKE 'sim\\_%%'"
+
+
+def _query(sql, args=()):
+    with get_pool().connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, args)
+            rows = cur.fetchall()
+        conn.commit()
+    return rows
+
+
+def new_rows(after_id):
+    """(max id, [(ts, generated ms)]) of the sim rows committed after ``after_id``."""
+    rows = _query(f"SELECT id, ts, JSON_VALUE(status_json, '$.dps.\"{TS_DP}\"') FROM device_status "
+                  f"WHERE id > %s AND {SIM_ROWS}", (after_id,))
+    last_id = max((row[0] for row in rows), default=after_id)
+    return last_id, [(ts, int(gen)) for _, ts, gen in rows if gen is not None]
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(int(len(values) * q), len(values) - 1)], 3)
+
+
+def run_step(sim, rate, seconds, last_id, sample_interval):
+    """Run one rate step; returns (result dict, last id seen)."""
+    sim.set_rate(rate)
+    pushes_before = sim.stats()['pushes']
+    started = time.time()
+    rows = 0
+    newest = None
+    lags = []
+    while time.time() - started < seconds:
+        time.sleep(min(sample_interval, max(seconds - (time.time() - started), 0)))
+        last_id, batch = new_rows(last_id)
+        rows += len(batch)
+        for ts, generated in batch:
+            lags.append(ts.timestamp() - generated / 1000)
+            newest = generated if newest is None else max(newest, generated)
+    elapsed = time.time() - started
+    stats = sim.stats()
+    offered = (stats['pushes'] - pushes_before) / elapsed
+    result = {
+        'rate': rate,
+        'devices': len(sim.devices),
+        'connections': stats['connections'],
+        'offered_per_sec': round(offered, 1),
+        'rows_per_sec': round(rows / elapsed, 1),
+        'receive_lag_p50': _percentile(lags, 0.5),
+        'receive_lag_p95': _percentile(lags, 0.95),
+        'freshness_lag': round(time.time() - newest / 1000, 2) if newest else None,
+    }
+    result['saturated'] = bool(offered and (result['rows_per_sec'] < 0.9 * offered
+                                            or (result['freshness_lag'] or 0) > 2 * sample_interval + 5))
+    return result, last_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga extremo a extremo con dispositivos simulados")
+    add_arguments(parser)
+    parser.add_argument('--monitor', choices=('async', 'broadcast', 'none'), default='async',
+                        help="Demonio a lanzar contra los dispositivos simulados (none = ya lanzado aparte)")
+    parser.add_argument('--rates', default='0.2,0.5,1,2,5',
+                        help="Actualizaciones por segundo y dispositivo de cada escalón")
+    parser.add_argument('--step-seconds', type=float, default=60)
+    parser.add_argument('--warmup', type=float, default=20, help="Segundos para que el demonio conecte")
+    parser.add_argument('--sample', type=float, default=5, help="Segundos entre lecturas de MariaDB")
+    parser.add_argument('--output', help="Fichero JSON de salida")
+    args = parser.parse_args()
+
+    sim = simulator_from_args(args)
+    sim.write_devices_file(args.devices_file)
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=lambda: loop.run_until_complete(sim.run(args.broadcast_address, args.broadcast_interval)),
+                     name='fake-devices', daemon=True).start()
+
+    daemon = None
+    if args.monitor != 'none':
+        env = dict(os.environ, TUYA_DEVICES_FILE=args.devices_file, METRICS_PORT='0')
+        daemon = subprocess.Popen(MONITORS[args.monitor](args.devices_file), cwd=ROOT, env=env,
+                                  stdout=subprocess.DEVNULL)
+    steps = []
+    try:
+        last_id = _query("SELECT COALESCE(MAX(id), 0) FROM device_status")[0][0]
+        print(f"{len(sim.devices)} dispositivos v{args.version}, esperando {args.warmup:.0f}s a que conecte el monitor",
+              file=sys.stderr)
+        time.sleep(args.warmup)
+        last_id, _ = new_rows(last_id)
+        print(f"{'rate':>6} {'offered/s':>10} {'rows/s':>8} {'lag p50':>8} {'lag p95':>8} {'fresh':>7} conex",
+              file=sys.stderr)
+        for rate in (float(r) for r in args.rates.split(',')):
+            result, last_id = run_step(sim, rate, args.step_seconds, last_id, args.sample)
+            steps.append(result)
+            print(f"{rate:6.2f} {result['offered_per_sec']:10.1f} {result['rows_per_sec']:8.1f} "
+                  f"{result['receive_lag_p50'] or 0:8.2f} {result['receive_lag_p95'] or 0:8.2f} "
+                  f"{result['freshness_lag'] or 0:7.1f} {result['connections']:5}"
+                  f"{'  SATURADO' if result['saturated'] else ''}", file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if daemon is not None:
+            daemon.terminate()
+            try:
+                daemon.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                # el monitor no sale con SIGTERM: se mata para no dejarlo corriendo y se guardan los resultados
+                print(f"El monitor no terminó en 30s, se mata (pid {daemon.pid})", file=sys.stderr)
+                daemon.kill()
+                daemon.wait()
+
+    saturated = next((s['rate'] for s in steps if s['saturated']), None)
+    results = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'monitor': args.monitor,
+        'version': args.version,
+        'devices': len(sim.devices),
+        'latency': args.latency,
+        'loss': args.loss,
+        'dropout': args.dropout,
+        'steps': steps,
+        'saturation_rate': saturated,
+        'simulator': sim.stats(),
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Synthetic DPS payloads shaped like the real device schemas.
+
+Device templates (id, name, mapping) are taken from new/tuya-raw.json; values
+are generated per DPS type within the mapping's min/max/range, and phase_a/b/c
+blobs are packed the same way the dlq power meters send them.
+
+Usage:
+    from benchmarks.payloads import load_templates, generate_payloads
+    payloads = generate_payloads(load_templates(), 1000)   # [(device_info, status)]
+"""
+import base64
+import json
+import os
+import random
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RAW_FILE = os.path.join(ROOT, 'new', 'tuya-raw.json')
+
+# Categorías de new/tuya-raw.json: wsdcg = termómetro/higrómetro, dlq = medidor con phase_a
+DEFAULT_CATEGORIES = ('wsdcg', 'tdq', 'dlq')
+
+
+def load_templates(path=RAW_FILE, categories=DEFAULT_CATEGORIES):
+    """Device entries from tuya-raw.json that have a mapping, filtered by category."""
+    with open(path, 'r') as f:
+        devices = json.load(f)['result']
+    return [d for d in devices
+            if d.get('mapping') and (not categories or d.get('category') in categories)]
+
+
+def pack_phase(voltage, current, power):
+    """Inverse of dps_utils.parse_phase: (V, A, kW) -> base64 blob."""
+    raw = (int(round(voltage * 10)).to_bytes(2, 'big')
+           + int(round(current * 1000)).to_bytes(3, 'big')
+           + int(round(power * 1000)).to_bytes(3, 'big'))
+    return base64.b64encode(raw).decode()
+
+
+def _values(entry):
+    values = entry.get('values', {})
+    if isinstance(values, str):
+        try:
+            values = json.loads(values)
+        except ValueError:
+            values = {}
+    return values if isinstance(values, dict) else {}
+
+
+def random_value(entry, rng):
+    """Random value for one mapping entry, or None for types we do not generate."""
+    code, dtype, values = entry.get('code'), entry.get('type'), _values(entry)
+    if code in ('phase_a', 'phase_b', 'phase_c'):
+        voltage = rng.uniform(215, 245)
+        current = rng.uniform(0, 15)
+        return pack_phase(voltage, current, voltage * current * rng.uniform(0.8, 1.0) / 1000)
+    if dtype == 'Integer':
+        return rng.randint(int(values.get('min', 0)), int(values.get('max', 1000)))
+    if dtype == 'Boolean':
+        return rng.random() < 0.5
+    if dtype == 'Enum' and values.get('range'):
+        return rng.choice(values['range'])
+    return None
+
+
+def make_status(device, rng, full=True):
+    """One status payload; with full=False only a random subset of DPS (like async updates)."""
+    dps = {}
+    for key, entry in device['mapping'].items():
+        if not full and rng.random() < 0.6:
+            continue
+        value = random_value(entry, rng)
+        if value is not None:
+            dps[key] = value
+    return {'dps': dps, 't': int(time.time())}
+
+
+def generate_payloads(templates, count, seed=1234, full_ratio=0.3):
+    """``count`` (device_info, status) pairs cycling over the templates."""
+    rng = random.Random(seed)
+    out = []
+    for i in range(count):
+        device = templates[i % len(templates)]
+        out.append((device, make_status(device, rng, full=rng.random() < full_ratio)))
+    return out
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""Benchmark suite for the decode and ingest hot paths.
+
+Measures, on synthetic payloads from benchmarks.payloads:
+  - decode: print_dps (stdout discarded) and decode_readings cost per payload
+  - insert: rows/s for single-row commits (insert_status_db) and batched
+    multi-row inserts (insert_status_rows, as the write-behind queue does)
+  - e2e: latency from payload received to committed row through StatusWriter
+
+The target is a local MariaDB (bench tables, dropped at the end) or an SQLite
+stand-in when no MariaDB is at hand. Results are printed as JSON so runs can be
+stored and compared.
+
+Usage:
+    python -m benchmarks.run --target sqlite --output bench.json
+    python -m benchmarks.run --target mariadb --rows 5000
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.payloads import generate_payloads, load_templates  # noqa: E402
+from db_mariadb import latest_readings  # noqa: E402
+from db_writer import StatusWriter  # noqa: E402
+from dps_utils import decode_readings, print_dps  # noqa: E402
+
+STATUS_TABLE = 'device_status_bench'
+READINGS_TABLE = 'device_readings_bench'
+LATEST_TABLE = 'device_latest_bench'
+
+
+class SqliteTarget:
+    """SQLite stand-in with the same tables and insert semantics as db_mariadb."""
+
+    name = 'sqlite'
+
+    def __init__(self, path=':memory:'):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {STATUS_TABLE} (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                          "device_name TEXT, ts TEXT, ip TEXT, origin TEXT, status_json TEXT)")
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {READINGS_TABLE} (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                          "device_name TEXT, ts TEXT, dps_key TEXT, code TEXT, value REAL, unit TEXT)")
+        self.conn.execute(f"CREATE INDEX IF NOT EXISTS idx_device_code_ts ON {READINGS_TABLE} (device_name, code, ts)")
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {LATEST_TABLE} (device_name TEXT, code TEXT, dps_key TEXT, "
+                          "value REAL, unit TEXT, ts TEXT, PRIMARY KEY (device_name, code))")
+        self.conn.commit()
+
+    def insert_one(self, device_name, status_obj, ip=None, origin='polling'):
+        with self.lock:
+            self.conn.execute(f"INSERT INTO {STATUS_TABLE} (device_name, ts, ip, origin, status_json) "
+                              "VALUES (?, datetime('now'), ?, ?, ?)", (device_name, ip, origin, json.dumps(status_obj)))
+            self.conn.commit()
+
+    def insert_rows(self, rows, table_name=STATUS_TABLE, readings=None):
+        with self.lock:
+            self.conn.executemany(f"INSERT INTO {STATUS_TABLE} (device_name, ts, ip, origin, status_json) "
+                                  "VALUES (?, ?, ?, ?, ?)",
+                                  [(d, ts.isoformat(), ip, o, json.dumps(s)) for d, ts, ip, o, s in rows])
+            if readings:
+                self.conn.executemany(f"INSERT INTO {READINGS_TABLE} (device_name, ts, dps_key, code, value, unit) "
+                                      "VALUES (?, ?, ?, ?, ?, ?)",
+                                      [(d, ts.isoformat(), k, c, v, u) for d, ts, k, c, v, u in readings])
+                self.conn.executemany(f"INSERT INTO {LATEST_TABLE} (device_name, ts, dps_key, code, value, unit) "
+                                      "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (device_name, code) DO UPDATE SET "
+                                      "dps_key = excluded.dps_key, value = excluded.value, unit = excluded.unit, "
+                                      "ts = excluded.ts WHERE excluded.ts >= ts",
+                                      [(d, ts.isoformat(), k, c, v, u) for d, ts, k, c, v, u in latest_readings(readings)])
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class MariaDBTarget:
+    """The real db_mariadb functions, writing to bench tables."""
+
+    name = 'mariadb'
+
+    def __init__(self, keep=False):
+        import db_mariadb
+        self.db = db_mariadb
+        self.keep = keep
+
+    def insert_one(self, device_name, status_obj, ip=None, origin='polling'):
+        self.db.insert_status_db(device_name, status_obj, ip=ip, origin=origin, table_name=STATUS_TABLE)
+
+    def insert_rows(self, rows, table_name=STATUS_TABLE, readings=None):
+        self.db.insert_status_rows(rows, STATUS_TABLE, readings=readings, readings_table=READINGS_TABLE,
+                                   latest_table=LATEST_TABLE)
+
+    def close(self):
+        if not self.keep:
+            with self.db.get_pool().connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(f"DROP TABLE IF EXISTS {STATUS_TABLE}")
+                    cur.execute(f"DROP TABLE IF EXISTS {READINGS_TABLE}")
+                    cur.execute(f"DROP TABLE IF EXISTS {LATEST_TABLE}")
+                conn.commit()
+        self.db.close_pool()
+
+
+def _percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def pct(p):
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+    return {'count': len(values), 'mean': statistics.fmean(values), 'p50': pct(50), 'p95': pct(95),
+            'p99': pct(99), 'max': values[-1]}
+
+
+def bench_decode(payloads, repeat):
+    """Microseconds per payload for print_dps and decode_readings."""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for device, status in payloads:
+                print_dps(status, device, device['name'])
+        print_time = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for device, status in payloads:
+            decode_readings(status, device)
+    decode_time = time.perf_counter() - started
+    total = repeat * len(payloads)
+    return {'payloads': total,
+            'print_dps_us_per_payload': print_time / total * 1e6,
+            'decode_readings_us_per_payload': decode_time / total * 1e6}
+
+
+def bench_insert(target, payloads, batch_size):
+    """Rows/s for single-row commits and for multi-row batches."""
+    started = time.perf_counter()
+    for device, status in payloads:
+        target.insert_one(device['name'], status, ip='127.0.0.1', origin='bench')
+    single = time.perf_counter() - started
+
+    rows = [(device['name'], datetime.now(), '127.0.0.1', 'bench', status) for device, status in payloads]
+    # lecturas de cada payload, para pasar a cada lote las de sus propias filas
+    readings = [[(device['name'], datetime.now()) + r for r in decode_readings(status, device)]
+                for device, status in payloads]
+    started = time.perf_counter()
+    for i in range(0, len(rows), batch_size):
+        target.insert_rows(rows[i:i + batch_size], STATUS_TABLE)
+    batched = time.perf_counter() - started
+    started = time.perf_counter()
+    for i in range(0, len(rows), batch_size):
+        target.insert_rows(rows[i:i + batch_size], STATUS_TABLE, readings=[r for per_row in readings[i:i + batch_size] for r in per_row])
+    batched_readings = time.perf_counter() - started
+    return {'rows': len(rows), 'batch_size': batch_size, 'readings': sum(map(len, readings)),
+            'single_row_rows_per_sec': len(rows) / single,
+            'batched_rows_per_sec': len(rows) / batched,
+            'batched_with_readings_rows_per_sec': len(rows) / batched_readings}
+
+
+def bench_e2e(target, payloads, rate, batch_size, max_latency):
+    """Latency (ms) from payload to committed row through the write-behind queue."""
+    latencies = []
+
+    def insert_and_measure(rows, table_name, readings=None):
+        target.insert_rows(rows, table_name, readings=readings)
+        committed = datetime.now()
+        latencies.extend((committed - row[1]).total_seconds() * 1000 for row in rows)
+
+    writer = StatusWriter(table_name=STATUS_TABLE, batch_size=batch_size, max_latency=max_latency,
+                          stats_interval=0, insert_rows=insert_and_measure)
+    writer.start()
+    interval = 1.0 / rate if rate else 0
+    next_send = time.perf_counter()
+    for device, status in payloads:
+        writer.enqueue(device['name'], status, ip='127.0.0.1', origin='bench',
+                       readings=decode_readings(status, device))
+        if interval:
+            next_send += interval
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    writer.stop(timeout=60)
+    result = {'rate': rate, 'batch_size': batch_size, 'max_latency_s': max_latency,
+              'latency_ms': _percentiles(latencies)}
+    result.update({k: v for k, v in writer.stats().items() if k in ('written', 'failed', 'flushes')})
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de decodificación e ingesta")
+    parser.add_argument('--target', choices=('sqlite', 'mariadb'), default='sqlite')
+    parser.add_argument('--sqlite-path', default=':memory:')
+    parser.add_argument('--rows', type=int, default=2000, help="Payloads para insert y e2e")
+    parser.add_argument('--decode-repeat', type=int, default=5)
+    parser.add_argument('--batch', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=500, help="Payloads/s en el test e2e (0 = sin límite)")
+    parser.add_argument('--max-latency', type=float, default=0.5, help="max_latency del writer en el test e2e")
+    parser.add_argument('--keep', action='store_true', help="No borrar las tablas bench en MariaDB")
+    parser.add_argument('--output', help="Fichero JSON de salida (por defecto stdout)")
+    args = parser.parse_args()
+
+    templates = load_templates()
+    payloads = generate_payloads(templates, args.rows)
+    target = SqliteTarget(args.sqlite_path) if args.target == 'sqlite' else MariaDBTarget(keep=args.keep)
+    try:
+        results = {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'git_commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'target': target.name,
+            'templates': sorted({d['category'] for d in templates}),
+            'decode': bench_decode(payloads[:1000], args.decode_repeat),
+            'insert': bench_insert(target, payloads, args.batch),
+            'e2e': bench_e2e(target, payloads, args.rate, args.batch, args.max_latency),
+        }
+    finally:
+        target.close()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""In-process pub/sub of decoded readings with a local streaming socket.
+
+The monitor daemons publish every decoded reading once, next to the
+write-behind enqueue, as a message on topic "<device_name>/<code>". Live
+consumers (dashboards, automations) subscribe with glob filters such as
+"termometro_*/va_temperature" or "Automatico/phase_a_*" (a filter without "/"
+matches every code of the device) and receive the readings within
+milliseconds, without querying MariaDB.
+
+Each subscriber has its own bounded buffer (BROKER_BUFFER messages); when a
+slow consumer falls behind the oldest messages are dropped and counted, so a
+stuck client never blocks the daemon or the other subscribers. With no
+subscribers publish() returns at once.
+
+Subscribers connect to the daemon over:
+  - Server-Sent Events on BROKER_HOST:BROKER_PORT (127.0.0.1 by default; the
+    broadcast pod uses hostNetwork): GET /stream?topic=termometro_*/va_temperature.
+    Browsers on other origins only get the stream if BROKER_CORS_ORIGIN is set.
+  - a Unix socket at BROKER_SOCKET: the first line sent is the list of
+    filters (comma separated, empty for all); JSON lines come back
+
+Usage:
+    from broker import get_broker, start_broker_server
+    start_broker_server(9111)
+    get_broker().publish(device_name, readings)
+
+    curl -N 'http://localhost:9111/stream?topic=termometro_*/va_temperature'
+    echo 'termo/*' | socat - UNIX-CONNECT:/run/domotica/tuya_async_monitor.sock
+"""
+import json
+import logging
+import os
+import re
+import socketserver
+import threading
+import time
+from collections import deque
+from fnmatch import translate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+BUFFER_SIZE = int(os.getenv('BROKER_BUFFER', 1000))
+# Solo local salvo que se pida otra interfaz (0.0.0.0 para exponerlo en el pod)
+HOST = os.getenv('BROKER_HOST', '127.0.0.1')
+# Origen web autorizado a leer el stream (p.ej. http://grafana.local); sin él, sin cabecera CORS
+CORS_ORIGIN = os.getenv('BROKER_CORS_ORIGIN')
+# Comentario SSE / línea vacía para que proxies y clientes no cierren la conexión
+KEEPALIVE = 15.0
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def compile_filters(filters):
+    """Glob filters -> one compiled regex over "device/code" topics."""
+    patterns = [f if '/' in f else f + '/*' for f in filters] or ['*']
+    return re.compile('|'.join(f'(?:{translate(p)})' for p in patterns))
+
+
+class Subscription:
+    """Bounded drop-oldest buffer of the messages matching some filters."""
+
+    def __init__(self, broker, filters=('*',), buffer_size=BUFFER_SIZE):
+        self.broker = broker
+        self.filters = tuple(f.strip() for f in filters if f.strip())
+        self._match = compile_filters(self.filters).match
+        self._buffer = deque(maxlen=buffer_size)
+        self._cond = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def _put(self, message):
+        with self._cond:
+            if len(self._buffer) == self._buffer.maxlen:
+                self.dropped += 1
+                metrics.BROKER_DROPPED.inc()
+            self._buffer.append(message)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Every buffered message (oldest first); [] after ``timeout`` seconds or once closed."""
+        with self._cond:
+            if not self._buffer and not self.closed:
+                self._cond.wait(timeout)
+            messages = list(self._buffer)
+            self._buffer.clear()
+        return messages
+
+    def close(self):
+        self.broker.unsubscribe(self)
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class Broker:
+    """Topic fan-out of readings to the subscriptions of this process."""
+
+    def __init__(self, buffer_size=BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        # tupla inmutable: publish() la recorre sin tomar el lock
+        self._subscriptions = ()
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self, filters=('*',), buffer_size=None):
+        subscription = Subscription(self, filters, buffer_size or self.buffer_size)
+        with self._lock:
+            self._subscriptions += (subscription,)
+        metrics.BROKER_SUBSCRIBERS.set(len(self._subscriptions))
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions = tuple(s for s in self._subscriptions if s is not subscription)
+        metrics.BROKER_SUBSCRIBERS.set(len(self._subscriptions))
+
+    def publish(self, device_name, readings, ts=None):
+        """Fan out (dps_key, code, value, unit) readings; returns the messages delivered."""
+        subscriptions = self._subscriptions
+        if not subscriptions or not readings:
+            return 0
+        ts = round(ts or time.time(), 3)
+        delivered = 0
+        for dps_key, code, value, unit in readings:
+            topic = f"{device_name}/{code}"
+            message = None
+            for subscription in subscriptions:
+                if subscription._match(topic):
+                    if message is None:
+                        message = {'topic': topic, 'device': device_name, 'code': code, 'dps_key': dps_key,
+                                   'value': value, 'unit': unit, 'ts': ts}
+                    subscription._put(message)
+                    delivered += 1
+        self.published += delivered
+        return delivered
+
+    def stats(self):
+        subscriptions = self._subscriptions
+        return {'subscribers': len(subscriptions), 'published': self.published,
+                'dropped': sum(s.dropped for s in subscriptions),
+                'filters': [list(s.filters) for s in subscriptions]}
+
+
+def get_broker():
+    """Return the process-wide broker, creating it on first use."""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = Broker()
+    return _broker
+
+
+def _stream(subscription, write):
+    """Write messages to a client until it disconnects; ``write(messages, dropped)`` sends one batch."""
+    reported = 0
+    try:
+        while not subscription.closed:
+            messages = subscription.get(KEEPALIVE)
+            dropped = subscription.dropped - reported
+            reported = subscription.dropped
+            write(messages, dropped)
+    except (BrokenPipeError, ConnectionError, OSError):
+        pass
+    finally:
+        subscription.close()
+
+
+class _SSEHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/':
+            body = json.dumps(get_broker().stats()).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if url.path != '/stream':
+            self.send_error(404)
+            return
+        filters = [f for value in parse_qs(url.query).get('topic', []) for f in value.split(',')]
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        if CORS_ORIGIN:
+            self.send_header('Access-Control-Allow-Origin', CORS_ORIGIN)
+        self.end_headers()
+        self.wfile.flush()
+
+        def write(messages, dropped):
+            chunk = ''.join(f"data: {json.dumps(m, separators=(',', ':'))}\n\n" for m in messages)
+            if dropped:
+                chunk += f"event: dropped\ndata: {dropped}\n\n"
+            self.wfile.write((chunk or ': keepalive\n\n').encode())
+            self.wfile.flush()
+
+        _stream(get_broker().subscribe(filters), write)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+class _UnixHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        filters = self.rfile.readline(4096).decode(errors='replace').split(',')
+
+        def write(messages, dropped):
+            lines = [json.dumps(m, separators=(',', ':')) for m in messages]
+            if dropped:
+                lines.append(json.dumps({'dropped': dropped}))
+            self.wfile.write(('\n'.join(lines) + '\n').encode() if lines else b'\n')
+            self.wfile.flush()
+
+        _stream(get_broker().subscribe(filters), write)
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def start_broker_server(default_port):
+    """Serve the SSE stream on BROKER_HOST:BROKER_PORT (or ``default_port``, 0 disables it) and, if
+    BROKER_SOCKET is set, the Unix socket. Returns True if anything was started."""
+    started = False
+    port = int(os.getenv('BROKER_PORT', default_port))
+    if port:
+        try:
+            server = ThreadingHTTPServer((HOST, port), _SSEHandler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name='broker-sse', daemon=True).start()
+            logger.info(f"Lecturas en vivo (SSE) en {HOST}:{port}/stream")
+            started = True
+        except OSError as e:
+            logger.warning(f"No se pudo abrir el puerto del broker {port}: {e}")
+    path = os.getenv('BROKER_SOCKET')
+    if path:
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            if os.path.exists(path):
+                os.unlink(path)
+            server = _UnixServer(path, _UnixHandler)
+            threading.Thread(target=server.serve_forever, name='broker-unix', daemon=True).start()
+            logger.info(f"Lecturas en vivo en el socket {path}")
+            started = True
+        except OSError as e:
+            logger.warning(f"No se pudo abrir el socket del broker {path}: {e}")
+    return started
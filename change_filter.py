@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""Change detection and per-metric deadband filtering before storage.
+
+Keeps the last *stored* value of every DPS per device and drops payloads in
+which nothing changed, or in which numeric values moved less than the
+deadband for their code (e.g. 0.1 °C or 5 W). Comparing against the last
+stored value, not the last received one, means slow drifts are still recorded
+once they add up to more than the deadband. A device that has been silent for
+``max_silence`` seconds gets a row anyway as a keep-alive.
+
+Deadbands are in the scaled unit of the DPS and can be overridden per device
+with a "deadband" object in its devices.json / devices.monitor.json entry
+(keys are DPS codes or DPS numbers), and "max_silence" in seconds.
+
+Usage:
+    from change_filter import get_change_filter
+    if get_change_filter().should_store(device_name, data, device_info):
+        get_writer().enqueue(...)
+"""
+import logging
+import os
+import threading
+import time
+
+from dps_utils import get_decoder
+
+logger = logging.getLogger(__name__)
+
+# Umbrales por defecto, en la unidad ya escalada de cada código
+DEFAULT_DEADBANDS = {
+    'va_temperature': 0.1,
+    'temp_current': 0.1,
+    'va_humidity': 1,
+    'humidity_value': 1,
+    'cur_power': 5,
+    'cur_voltage': 2,
+    'cur_current': 20,
+}
+
+_filter = None
+_filter_lock = threading.Lock()
+
+
+class ChangeFilter:
+    """Per-device last-value cache with deadbands and a max-silence keep-alive."""
+
+    def __init__(self, deadbands=None, max_silence=600, report_interval=900):
+        self.deadbands = dict(DEFAULT_DEADBANDS if deadbands is None else deadbands)
+        self.max_silence = max_silence
+        self.report_interval = report_interval
+        self._lock = threading.Lock()
+        # device_name -> {dps_key: last stored value}
+        self._last = {}
+        # device_name -> monotonic time of the last stored row
+        self._last_stored = {}
+        self._counts = {}
+        self._next_report = time.monotonic() + report_interval
+
+    def _deadband(self, field, device_deadbands):
+        for key in (field.code, field.key):
+            if key in device_deadbands:
+                return float(device_deadbands[key])
+        return self.deadbands.get(field.code, 0.0)
+
+    def _changed(self, device_name, dps, device_info):
+        """True if any DPS differs from the last stored value by at least its deadband."""
+        last = self._last.setdefault(device_name, {})
+        decoder = get_decoder(device_info)
+        device_deadbands = (device_info or {}).get('deadband', {}) or {}
+        changed = False
+        for k, v in dps.items():
+            field = decoder.field(str(k))
+            prev = last.get(field.key)
+            if prev is None:
+                changed = True
+            elif isinstance(v, (int, float)) and not isinstance(v, bool) \
+                    and isinstance(prev, (int, float)) and not isinstance(prev, bool):
+                # redondeo para que 21.6 - 21.5 cuente como 0.1 y no como 0.0999...
+                diff = round(abs(field.scale_value(v) - field.scale_value(prev)), 9)
+                deadband = self._deadband(field, device_deadbands)
+                if (diff >= deadband) if deadband else diff:
+                    changed = True
+            elif v != prev:
+                changed = True
+        return changed
+
+    def should_store(self, device_name, data, device_info=None):
+        """Decide whether a status payload is worth a row; updates the cache if so."""
+        dps = (data or {}).get('dps') or {}
+        now = time.monotonic()
+        max_silence = float((device_info or {}).get('max_silence', self.max_silence))
+        with self._lock:
+            counts = self._counts.setdefault(device_name, {'stored': 0, 'suppressed': 0})
+            last_stored = self._last_stored.get(device_name)
+            store = self._changed(device_name, dps, device_info) \
+                or last_stored is None or now - last_stored >= max_silence
+            if store:
+                last = self._last[device_name]
+                for k, v in dps.items():
+                    last[str(k)] = v
+                self._last_stored[device_name] = now
+                counts['stored'] += 1
+            else:
+                counts['suppressed'] += 1
+            if now >= self._next_report:
+                self._next_report = now + self.report_interval
+                logger.info(f"Filas suprimidas por dispositivo: {self._counts}")
+        return store
+
+    def stats(self):
+        """{device_name: {'stored': n, 'suppressed': m}} since start."""
+        with self._lock:
+            return {name: dict(c) for name, c in self._counts.items()}
+
+
+def get_change_filter():
+    """Return the process-wide filter (MAX_SILENCE env var, seconds, default 600)."""
+    global _filter
+    if _filter is None:
+        with _filter_lock:
+            if _filter is None:
+                _filter = ChangeFilter(max_silence=float(os.getenv('MAX_SILENCE', 600)))
+    return _filter
@@ -2,11 +2,29 @@
 """Helpers for MariaDB connection and inserting device status JSON.
 
 Usage: from db_mariadb import insert_status_db
+
+Connections come from a per-process pool (see db_pool.py); credentials are read
+once and each table is created at most once per process.
 """
 import json
+import logging
 import os
-import pymysql
+import threading
+from datetime import date, timedelta
+from functools import lru_cache
+
+from db_pool import ConnectionPool, DISCONNECT_ERRORS, is_disconnect
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+_ensured_tables = set()
+# Particiones futuras que se crean con la tabla (partitions.py las mantiene despues)
+PARTITIONS_AHEAD_DAYS = 62
+
 
+@lru_cache(maxsize=1)
 def get_db_config():
     db_defaults = {
         'host': os.getenv('DB_HOST', 'localhost'),
@@ -33,36 +51,278 @@ def get_db_config():
     return db_defaults
 
 
-def ensure_table(conn, table_name='device_status'):
+def period_start(day, granularity='month'):
+    """First day of the partition period (day or month) containing ``day``."""
+    return day if granularity == 'day' else day.replace(day=1)
+
+
+def next_period(start, granularity='month'):
+    if granularity == 'day':
+        return start + timedelta(days=1)
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def partition_name(start, granularity='month'):
+    return start.strftime('p%Y%m%d' if granularity == 'day' else 'p%Y%m')
+
+
+def partition_defs(first, last, granularity='month'):
+    """PARTITION clauses for every period from ``first`` to ``last`` (dates), without pmax."""
+    defs = []
+    start = period_start(first, granularity)
+    while start <= last:
+        end = next_period(start, granularity)
+        defs.append(f"PARTITION {partition_name(start, granularity)} VALUES LESS THAN (TO_DAYS('{end.isoformat()}'))")
+        start = end
+    return defs
+
+
+def partition_clause(first, last, granularity='month'):
+    """PARTITION BY RANGE on ts covering ``first``..``last`` plus a catch-all pmax."""
+    defs = partition_defs(first, last, granularity) + ["PARTITION pmax VALUES LESS THAN MAXVALUE"]
+    return "PARTITION BY RANGE (TO_DAYS(ts)) (\n    " + ",\n    ".join(defs) + "\n)"
+
+
+def ensure_table(conn, table_name='device_status', granularity=None):
+    """device_status, RANGE-partitioned by day or month on ts.
+
+    Partitioning lets time-filtered queries ($__timeFilter(ts)) prune to the
+    partitions in range and retention drop whole partitions instead of
+    DELETEs; partitions.py pre-creates future ones and drops expired ones.
+    The primary key includes ts because MariaDB requires the partitioning
+    column in every unique key. PARTITION_GRANULARITY=none creates it plain.
+    Generated columns for the JSON paths the dashboards read are added by
+    schema_tune.py.
+    """
+    granularity = granularity or os.getenv('PARTITION_GRANULARITY', 'month')
+    partitioning = ''
+    if granularity != 'none':
+        today = date.today()
+        partitioning = partition_clause(today, today + timedelta(days=PARTITIONS_AHEAD_DAYS), granularity)
     with conn.cursor() as cur:
         cur.execute(
             f"""
             CREATE TABLE IF NOT EXISTS {table_name} (
-                id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                id BIGINT AUTO_INCREMENT,
                 device_name VARCHAR(255),
-                ts DATETIME,
+                ts DATETIME NOT NULL,
                 ip VARCHAR(45),
                 origin VARCHAR(100),
-                status_json LONGTEXT
+                status_json LONGTEXT,
+                PRIMARY KEY (id, ts),
+                KEY idx_device_ts (device_name, ts)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            {partitioning};
+            """
+        )
+        if partitioning:
+            # CREATE TABLE IF NOT EXISTS no toca una tabla creada antes del particionado
+            cur.execute("SELECT COUNT(*) FROM information_schema.PARTITIONS WHERE TABLE_SCHEMA = DATABASE() "
+                        "AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL", (table_name,))
+            if not cur.fetchone()[0]:
+                logger.warning(f"{table_name} no está particionada: las consultas por rango leen la tabla entera. "
+                               f"Convertirla con 'python partitions.py --convert'")
+    conn.commit()
+
+
+def ensure_readings_table(conn, table_name='device_readings'):
+    """Narrow typed table with one decoded numeric value per row.
+
+    Graph queries filter on (device_name, code, ts), which the composite index
+    turns into a range scan instead of JSON_VALUE over every device_status row.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table_name} (
+                id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                device_name VARCHAR(255) NOT NULL,
+                ts DATETIME NOT NULL,
+                dps_key VARCHAR(64) NOT NULL,
+                code VARCHAR(100) NOT NULL,
+                value DOUBLE,
+                unit VARCHAR(20),
+                inserted_at DATETIME(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+                KEY idx_device_code_ts (device_name, code, ts)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+            """
+        )
+        # Tablas creadas antes de inserted_at (lo usa el corte del catch-up de rollups)
+        cur.execute("SELECT 1 FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() "
+                    "AND TABLE_NAME = %s AND COLUMN_NAME = 'inserted_at'", (table_name,))
+        if cur.fetchone() is None:
+            cur.execute(f"ALTER TABLE {table_name} "
+                        f"ADD COLUMN inserted_at DATETIME(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3)")
+    conn.commit()
+
+
+def ensure_latest_table(conn, table_name='device_latest'):
+    """Last value of every (device, code): "current value" panels become a primary-key lookup."""
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table_name} (
+                device_name VARCHAR(255) NOT NULL,
+                code VARCHAR(100) NOT NULL,
+                dps_key VARCHAR(64) NOT NULL,
+                value DOUBLE,
+                unit VARCHAR(20),
+                ts DATETIME NOT NULL,
+                PRIMARY KEY (device_name, code)
             ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
             """
         )
     conn.commit()
 
 
+def latest_readings(readings):
+    """Newest reading per (device_name, code), sorted by key so concurrent upserts lock in the same order."""
+    latest = {}
+    for r in readings:
+        key = (r[0], r[3])
+        if key not in latest or r[1] >= latest[key][1]:
+            latest[key] = r
+    return [latest[key] for key in sorted(latest)]
+
+
+def ensure_spool_table(conn, table_name='spool_replay'):
+    """Replay position of each spool segment, committed with the rows it covers."""
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table_name} (
+                segment VARCHAR(191) PRIMARY KEY,
+                byte_offset BIGINT NOT NULL DEFAULT 0,
+                updated_at DATETIME
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+            """
+        )
+    conn.commit()
+
+
+def get_pool():
+    """Return the process-wide connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                db_conf = get_db_config()
+                _pool = ConnectionPool(
+                    size=int(os.getenv('DB_POOL_SIZE', 4)),
+                    host=db_conf['host'], user=db_conf['user'], password=db_conf['password'],
+                    database=db_conf['db'], port=int(db_conf['port']), charset=db_conf.get('charset', 'utf8mb4'))
+    return _pool
+
+
+def ensure_table_once(conn, table_name='device_status', ensure=None):
+    """Run the table's ensure function only the first time it is used in this process."""
+    if table_name in _ensured_tables:
+        return
+    (ensure or ensure_table)(conn, table_name)
+    _ensured_tables.add(table_name)
+
+
+def close_pool():
+    """Close all pooled connections (call on shutdown)."""
+    if _pool is not None:
+        _pool.close_all()
+
+
+def insert_status_rows(rows, table_name='device_status', readings=None, readings_table='device_readings',
+                       checkpoint=None, latest_table='device_latest'):
+    """Bulk insert of (device_name, ts, ip, origin, status_obj) tuples in one transaction.
+
+    ``readings`` are optional (device_name, ts, dps_key, code, value, unit)
+    tuples for the typed readings table, written in the same transaction;
+    the newest of them per device and code are also upserted into
+    ``latest_table`` (None to skip), never replacing a newer ts.
+    pymysql rewrites executemany on a plain INSERT ... VALUES into a single
+    multi-row INSERT, so a batch costs one round-trip and one commit.
+
+    ``checkpoint`` is an optional (segment, byte_offset) spool position saved
+    in spool_replay in the same transaction, so a replayed chunk is either
+    written together with its new position or not at all.
+    """
+    if not rows and not readings and not checkpoint:
+        return
+    params = [(device_name, ts, ip, origin, json.dumps(status_obj))
+              for device_name, ts, ip, origin, status_obj in rows]
+    for attempt in (1, 2):
+        try:
+            with get_pool().connection() as conn:
+                # el DDL hace commit implícito en MariaDB: las tablas se crean antes de la transacción del lote
+                if params:
+                    ensure_table_once(conn, table_name)
+                if readings:
+                    ensure_table_once(conn, readings_table, ensure_readings_table)
+                    if latest_table:
+                        ensure_table_once(conn, latest_table, ensure_latest_table)
+                if checkpoint:
+                    ensure_table_once(conn, 'spool_replay', ensure_spool_table)
+                with conn.cursor() as cur:
+                    if params:
+                        cur.executemany(f"INSERT INTO {table_name} (device_name, ts, ip, origin, status_json) VALUES (%s, %s, %s, %s, %s)",
+                                        params)
+                    if readings:
+                        cur.executemany(f"INSERT INTO {readings_table} (device_name, ts, dps_key, code, value, unit) VALUES (%s, %s, %s, %s, %s, %s)",
+                                        readings)
+                        if latest_table:
+                            # MariaDB aplica las asignaciones en orden: ts se actualiza el último
+                            cur.executemany(f"INSERT INTO {latest_table} (device_name, ts, dps_key, code, value, unit) "
+                                            f"VALUES (%s, %s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE "
+                                            f"dps_key = IF(VALUES(ts) >= ts, VALUES(dps_key), dps_key), "
+                                            f"value = IF(VALUES(ts) >= ts, VALUES(value), value), "
+                                            f"unit = IF(VALUES(ts) >= ts, VALUES(unit), unit), "
+                                            f"ts = GREATEST(ts, VALUES(ts))",
+                                            latest_readings(readings))
+                    if checkpoint:
+                        cur.execute("INSERT INTO spool_replay (segment, byte_offset, updated_at) VALUES (%s, %s, NOW()) "
+                                    "ON DUPLICATE KEY UPDATE byte_offset = VALUES(byte_offset), updated_at = NOW()",
+                                    checkpoint)
+                conn.commit()
+            return
+        except DISCONNECT_ERRORS as e:
+            if attempt == 2 or not is_disconnect(e):
+                raise
+
+
 def insert_status_db(device_name, status_obj, ip=None, origin='polling', table_name='device_status'):
-    db_conf = get_db_config()
-    try:
-        conn = pymysql.connect(host=db_conf['host'], user=db_conf['user'], password=db_conf['password'],
-                               database=db_conf['db'], port=int(db_conf['port']), charset=db_conf.get('charset','utf8mb4'))
+    # Un reintento si la conexion del pool se cayo (p.ej. reinicio del pod de MariaDB)
+    for attempt in (1, 2):
         try:
-            ensure_table(conn, table_name)
-            with conn.cursor() as cur:
-                cur.execute(f"INSERT INTO {table_name} (device_name, ts, ip, origin, status_json) VALUES (%s, NOW(), %s, %s, %s)",
-                            (device_name, ip, origin, json.dumps(status_obj)))
-            conn.commit()
-        finally:
-            conn.close()
-    except Exception as e:
-        # raise the exception to the caller to decide how to handle it
-        raise
+            with get_pool().connection() as conn:
+                ensure_table_once(conn, table_name)
+                with conn.cursor() as cur:
+                    cur.execute(f"INSERT INTO {table_name} (device_name, ts, ip, origin, status_json) VALUES (%s, NOW(), %s, %s, %s)",
+                                (device_name, ip, origin, json.dumps(status_obj)))
+                conn.commit()
+            return
+        except DISCONNECT_ERRORS as e:
+            if attempt == 2 or not is_disconnect(e):
+                # raise the exception to the caller to decide how to handle it
+                raise
+
+
+def load_spool_offset(segment):
+    """Byte offset already replayed for a spool segment (0 if never seen)."""
+    with get_pool().connection() as conn:
+        ensure_table_once(conn, 'spool_replay', ensure_spool_table)
+        with conn.cursor() as cur:
+            cur.execute("SELECT byte_offset FROM spool_replay WHERE segment = %s", (segment,))
+            row = cur.fetchone()
+        conn.commit()
+    return row[0] if row else 0
+
+
+def save_spool_offset(segment, byte_offset):
+    """Move a spool segment's replay position without writing rows (chunk set aside)."""
+    insert_status_rows([], checkpoint=(segment, byte_offset))
+
+
+def delete_spool_checkpoint(segment):
+    """Forget a spool segment once its file has been removed."""
+    with get_pool().connection() as conn:
+        ensure_table_once(conn, 'spool_replay', ensure_spool_table)
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM spool_replay WHERE segment = %s", (segment,))
+        conn.commit()
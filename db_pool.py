@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""Pool of persistent MariaDB connections with health checks and reconnect.
+
+Usage:
+    from db_pool import ConnectionPool
+    pool = ConnectionPool(host=..., user=..., password=..., database=..., port=3306)
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+"""
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import pymysql
+
+# Excepciones de pymysql que pueden indicar que la conexion ya no sirve (ver is_disconnect)
+DISCONNECT_ERRORS = (pymysql.err.OperationalError, pymysql.err.InterfaceError)
+# pymysql tambien devuelve OperationalError para errores del contenido (1054 columna desconocida,
+# 1292 valor incorrecto, 1526 sin particion...): solo estos codigos son una conexion perdida.
+# 2003 no conecta, 2006 server gone away, 2013 conexion perdida, 2055 perdida con error de sistema,
+# 1053 servidor apagandose, 1927 conexion cerrada (KILL)
+DISCONNECT_CODES = (2003, 2006, 2013, 2055, 1053, 1927)
+
+
+def is_disconnect(error):
+    """True if ``error`` means the connection is gone, not that MariaDB rejected the statement."""
+    if isinstance(error, pymysql.err.InterfaceError):
+        return True
+    return (isinstance(error, pymysql.err.OperationalError)
+            and bool(error.args) and error.args[0] in DISCONNECT_CODES)
+
+
+class ConnectionPool:
+    """Fixed-size, thread-safe pool of pymysql connections.
+
+    Connections are created lazily up to ``size``. Before a connection that has
+    been idle longer than ``ping_interval`` seconds is handed out it is pinged
+    (with reconnect), so a MariaDB restart costs one reconnect instead of an
+    error on every caller.
+    """
+
+    def __init__(self, size=4, ping_interval=30, acquire_timeout=10, **connect_kwargs):
+        self.size = size
+        self.ping_interval = ping_interval
+        self.acquire_timeout = acquire_timeout
+        self.connect_kwargs = connect_kwargs
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = pymysql.connect(autocommit=False, **self.connect_kwargs)
+        conn._pool_last_used = time.monotonic()
+        return conn
+
+    def _check(self, conn):
+        """Ping a connection that has been idle for a while; reconnect if needed."""
+        if time.monotonic() - getattr(conn, '_pool_last_used', 0) >= self.ping_interval:
+            conn.ping(reconnect=True)
+        return conn
+
+    def acquire(self, timeout=None):
+        """Get a healthy connection from the pool, creating one if allowed."""
+        timeout = self.acquire_timeout if timeout is None else timeout
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    return self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            try:
+                conn = self._idle.get(timeout=timeout)
+            except queue.Empty:
+                raise TimeoutError(f"No hay conexiones libres en el pool tras {timeout}s")
+        try:
+            return self._check(conn)
+        except Exception:
+            self._discard(conn)
+            raise
+
+    def release(self, conn):
+        """Return a connection to the pool."""
+        conn._pool_last_used = time.monotonic()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            self._discard(conn)
+
+    def _discard(self, conn):
+        with self._lock:
+            self._created -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """Context manager that acquires a connection and always gives it back.
+
+        On a disconnect error the connection is thrown away instead of being
+        returned, so the next caller gets a fresh one.
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        except Exception as e:
+            if is_disconnect(e):
+                self._discard(conn)
+                raise
+            try:
+                conn.rollback()
+            except Exception:
+                self._discard(conn)
+                raise
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def close_all(self):
+        """Close every idle connection (e.g. on shutdown)."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
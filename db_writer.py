@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""Write-behind queue for device_status rows.
+
+The monitors hand readings to a bounded in-memory queue and return at once; a
+background thread drains it and writes them with multi-row INSERTs, flushing
+when ``batch_size`` rows are pending or ``max_latency`` seconds have passed.
+
+If MariaDB is unreachable the batch goes to an on-disk spool (spool.py) and is
+replayed, in order and without duplicates, once the database is back.
+Deadlocks and lock wait timeouts are retried in place first (and spooled if
+they persist). Errors are classified by code (db_pool.is_disconnect), because
+pymysql raises OperationalError for content errors too: a batch MariaDB
+rejects for its content is set aside in the spool's dead-letter directory
+instead of being lost or blocking the spool, and a rejected spool chunk is
+set aside the same way with its replay position committed past it.
+
+Usage:
+    from db_writer import get_writer
+    get_writer().enqueue(device_name, status_obj, ip=ip, origin='polling',
+                         readings=decode_readings(status_obj, device_info))
+"""
+import atexit
+import logging
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from datetime import datetime
+
+import pymysql
+
+import metrics
+from db_mariadb import delete_spool_checkpoint, insert_status_rows, load_spool_offset, save_spool_offset
+from db_pool import is_disconnect
+from spool import Spool
+
+logger = logging.getLogger(__name__)
+
+_writer = None
+_writer_lock = threading.Lock()
+# Deadlock y lock wait timeout: se reintenta el lote antes de mandarlo al spool
+TRANSIENT_ERRORS = (1205, 1213)
+TRANSIENT_RETRIES = 3
+
+
+def _is_transient(error):
+    return isinstance(error, pymysql.err.OperationalError) and bool(error.args) and error.args[0] in TRANSIENT_ERRORS
+
+
+def _unavailable(error):
+    """MariaDB could not take the batch now (spool it and retry) rather than rejecting its rows."""
+    # TimeoutError: pool sin conexiones libres
+    return is_disconnect(error) or _is_transient(error) or isinstance(error, TimeoutError)
+
+
+class StatusWriter(threading.Thread):
+    """Background thread that batches device_status inserts."""
+
+    def __init__(self, table_name='device_status', max_queue=10000, batch_size=200,
+                 max_latency=2.0, stats_interval=300, insert_rows=insert_status_rows,
+                 spool=None, replay_batch=1000, retry_interval=5.0):
+        super().__init__(name='status-writer', daemon=True)
+        self.table_name = table_name
+        # insert_rows(rows, table_name, readings=...) - sustituible en benchmarks
+        self.insert_rows = insert_rows
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.stats_interval = stats_interval
+        # Spool en disco para cuando MariaDB no está disponible (None = se pierden)
+        self.spool = spool
+        self.replay_batch = replay_batch
+        self.retry_interval = retry_interval
+        self._retry_at = 0.0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop_event = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'enqueued': 0,
+            'written': 0,
+            'dropped': 0,
+            'failed': 0,
+            'flushes': 0,
+            'last_batch_size': 0,
+            'last_flush_latency': 0.0,
+            'max_flush_latency': 0.0,
+            'spooled': 0,
+            'replayed': 0,
+        }
+
+    def enqueue(self, device_name, status_obj, ip=None, origin='polling', readings=None):
+        """Queue a reading; never blocks. Returns False if the queue is full.
+
+        ``readings`` are the decoded (dps_key, code, value, unit) tuples that go
+        to the typed readings table alongside the raw JSON row.
+        """
+        try:
+            self._queue.put_nowait((device_name, datetime.now(), ip, origin, status_obj, readings))
+        except queue.Full:
+            with self._stats_lock:
+                self._stats['dropped'] += 1
+            logger.warning(f"Cola de escritura llena, descartada lectura de {device_name}")
+            return False
+        with self._stats_lock:
+            self._stats['enqueued'] += 1
+        return True
+
+    def stats(self):
+        """Snapshot of queue depth, batch sizes and flush latency."""
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        snapshot['queue_depth'] = self._queue.qsize()
+        snapshot['queue_max'] = self._queue.maxsize
+        if self.spool is not None:
+            snapshot['spool_bytes'] = self.spool.size()
+            snapshot['spool_segments'] = self.spool.segments()
+        return snapshot
+
+    def _take_batch(self, max_latency=None):
+        """Collect up to batch_size rows, waiting at most max_latency for the batch to fill."""
+        batch = []
+        deadline = time.monotonic() + (self.max_latency if max_latency is None else max_latency)
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (self._stop_event.is_set() and self._queue.empty()):
+                break
+            try:
+                batch.append(self._queue.get(timeout=min(remaining, 0.5)))
+            except queue.Empty:
+                continue
+        return batch
+
+    @staticmethod
+    def _split(batch):
+        """Queue items -> (device_status rows, device_readings rows)."""
+        rows = [item[:5] for item in batch]
+        readings = [(device_name, ts) + tuple(r)
+                    for device_name, ts, _, _, _, item_readings in batch
+                    for r in item_readings or ()]
+        return rows, readings
+
+    def _to_spool(self, batch):
+        self.spool.append(batch)
+        with self._stats_lock:
+            self._stats['spooled'] += len(batch)
+
+    def _flush(self, batch):
+        if self.spool is not None and self.spool.pending():
+            # hay filas anteriores sin escribir: detrás de ellas, para mantener el orden
+            self._to_spool(batch)
+            return
+        started = time.monotonic()
+        rows, readings = self._split(batch)
+        try:
+            self._insert_retrying(rows, readings)
+            metrics.DB_BATCH_ROWS.observe(len(batch))
+        except Exception as e:
+            if not _unavailable(e):
+                self._dead_letter(batch, e)
+                return
+            if self.spool is None:
+                logger.error(f"No se pudo guardar un lote de {len(batch)} filas en MariaDB: {e}")
+                with self._stats_lock:
+                    self._stats['failed'] += len(batch)
+                return
+            logger.warning(f"MariaDB no disponible ({e}), lote de {len(batch)} filas guardado en el spool")
+            self._to_spool(batch)
+            self._retry_at = time.monotonic() + self.retry_interval
+            return
+        latency = time.monotonic() - started
+        with self._stats_lock:
+            self._stats['written'] += len(batch)
+            self._stats['flushes'] += 1
+            self._stats['last_batch_size'] = len(batch)
+            self._stats['last_flush_latency'] = latency
+            self._stats['max_flush_latency'] = max(self._stats['max_flush_latency'], latency)
+
+    def _dead_letter(self, batch, error):
+        # MariaDB rechaza el contenido: reintentarlo daría el mismo error
+        with self._stats_lock:
+            self._stats['failed'] += len(batch)
+        if self.spool is None:
+            logger.error(f"No se pudo guardar un lote de {len(batch)} filas en MariaDB: {error}")
+            return
+        try:
+            self.spool.dead_letter(batch, error)
+        except OSError as dead_error:
+            logger.error(f"Perdido un lote de {len(batch)} filas ({error}): no se pudo apartar: {dead_error}")
+
+    def _insert_retrying(self, rows, readings, **kwargs):
+        for attempt in range(1, TRANSIENT_RETRIES + 1):
+            try:
+                with metrics.timed(metrics.DB_INSERT):
+                    self.insert_rows(rows, self.table_name, readings=readings, **kwargs)
+                return
+            except pymysql.err.OperationalError as e:
+                if not _is_transient(e) or attempt == TRANSIENT_RETRIES:
+                    raise
+                logger.warning(f"Conflicto de bloqueo en MariaDB ({e}), reintento {attempt}/{TRANSIENT_RETRIES - 1}")
+                time.sleep(0.2 * attempt)
+
+    def _replay(self):
+        """Write the next chunk of the spool, committing its offset in the same transaction."""
+        chunk = None
+        try:
+            chunk = self.spool.read_chunk(self.replay_batch, load_spool_offset)
+            if chunk is None:
+                return
+            segment, end_offset, batch = chunk
+            rows, readings = self._split(batch)
+            self._insert_retrying(rows, readings, checkpoint=(segment, end_offset))
+        except Exception as e:
+            if _unavailable(e):
+                logger.warning(f"MariaDB sigue sin estar disponible ({e}), reintento del spool en {self.retry_interval}s")
+                self._retry_at = time.monotonic() + self.retry_interval
+                return
+            if chunk is None:
+                logger.error(f"No se pudo leer el spool: {e}")
+                self._retry_at = time.monotonic() + self.retry_interval
+                return
+            # un tramo que MariaDB rechaza no debe bloquear el resto del spool: se aparta y
+            # se confirma su posición, para no repetirlo en cada arranque
+            try:
+                self.spool.dead_letter(batch, e)
+                save_spool_offset(segment, end_offset)
+            except Exception as skip_error:
+                logger.warning(f"No se pudo saltar el tramo rechazado de {segment}: {skip_error}")
+                self._retry_at = time.monotonic() + self.retry_interval
+                return
+            with self._stats_lock:
+                self._stats['failed'] += len(batch)
+        else:
+            with self._stats_lock:
+                self._stats['replayed'] += len(batch)
+        self.spool.advance(end_offset)
+        done = self.spool.pop_if_done()
+        if done:
+            try:
+                delete_spool_checkpoint(done)
+            except Exception as e:
+                logger.warning(f"No se pudo borrar el checkpoint del spool {done}: {e}")
+            if not self.spool.pending():
+                logger.info(f"Spool vaciado: {self.stats()}")
+
+    def run(self):
+        next_stats = time.monotonic() + self.stats_interval
+        while not (self._stop_event.is_set() and self._queue.empty()):
+            replaying = self.spool is not None and self.spool.pending() and time.monotonic() >= self._retry_at
+            batch = self._take_batch(0 if replaying else None)
+            if batch:
+                self._flush(batch)
+            if replaying:
+                self._replay()
+            if self.stats_interval and time.monotonic() >= next_stats:
+                logger.info(f"status-writer: {self.stats()}")
+                next_stats = time.monotonic() + self.stats_interval
+
+    def stop(self, timeout=10):
+        """Flush everything still queued and stop the thread."""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+        if self.spool is not None:
+            self.spool.close()
+
+
+def _sigterm_to_exit(sig, frame):
+    # Convierte SIGTERM en SystemExit para que atexit vacie la cola
+    sys.exit(0)
+
+
+def _open_spool():
+    """Spool in SPOOL_DIR (default ./spool/<script>, empty disables), capped at SPOOL_MAX_MB."""
+    # un directorio por daemon: con docker-compose todos comparten /app
+    spool_dir = os.getenv('SPOOL_DIR', os.path.join('spool', os.path.splitext(os.path.basename(sys.argv[0]))[0]))
+    if not spool_dir:
+        return None
+    try:
+        return Spool(spool_dir, max_bytes=int(os.getenv('SPOOL_MAX_MB', 256)) * 1024 * 1024)
+    except OSError as e:
+        logger.error(f"No se pudo abrir el spool en {spool_dir}: {e}. Sin spool, las lecturas se perderán si MariaDB cae")
+        return None
+
+
+def get_writer():
+    """Return the process-wide writer, starting it on first use.
+
+    The queue is flushed at interpreter exit; if SIGTERM still has its default
+    action it is turned into a normal exit so that flush also runs under
+    systemd/k8s stops.
+    """
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = StatusWriter(
+                    max_queue=int(os.getenv('DB_WRITER_QUEUE', 10000)),
+                    batch_size=int(os.getenv('DB_WRITER_BATCH', 200)),
+                    max_latency=float(os.getenv('DB_WRITER_LATENCY', 2.0)),
+                    spool=_open_spool(),
+                )
+                _writer.start()
+                metrics.track_writer(_writer)
+                atexit.register(_writer.stop)
+                if threading.current_thread() is threading.main_thread() \
+                        and signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+                    signal.signal(signal.SIGTERM, _sigterm_to_exit)
+    return _writer
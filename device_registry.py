@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""In-memory registry of devices.json / devices.monitor.json.
+
+Each file is parsed once and indexed by id, name and IP. The file's mtime is
+checked at most every ``check_interval`` seconds and the indexes are rebuilt
+only when it changes. Lookups that miss are remembered as negative entries, so
+an unknown device on the LAN costs a set lookup until the file changes.
+
+Usage:
+    from device_registry import get_registry
+    info = get_registry('devices.json').by_id(gwId)
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+class DeviceRegistry:
+    """Indexed, hot-reloading view of one device file."""
+
+    def __init__(self, path, check_interval=2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._next_check = 0.0
+        self._devices = []
+        self._by_id = {}
+        self._by_name = {}
+        self._by_ip = {}
+        self._missing = set()
+        self._file_missing = False
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            if not self._file_missing:
+                print(f"Error: {self.path} not found.")
+                self._file_missing = True
+                self._devices, self._by_id, self._by_name, self._by_ip = [], {}, {}, {}
+                self._missing.clear()
+            self._mtime = None
+            return
+        self._file_missing = False
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, 'r') as f:
+                devices = json.load(f)
+        except (OSError, ValueError) as e:
+            # fichero a medio escribir: se mantiene la version anterior y se reintenta
+            logger.warning(f"No se pudo leer {self.path}: {e}")
+            return
+        self._devices = devices
+        self._by_id = {d['id']: d for d in devices if d.get('id')}
+        self._by_name = {d['name']: d for d in devices if d.get('name')}
+        self._by_ip = {d['ip']: d for d in devices if d.get('ip')}
+        self._missing.clear()
+        self._mtime = mtime
+        logger.info(f"{self.path} cargado: {len(devices)} dispositivo(s)")
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        with self._lock:
+            if now >= self._next_check:
+                self._load()
+                self._next_check = now + self.check_interval
+
+    def _lookup(self, index_name, value):
+        self._refresh()
+        index = getattr(self, index_name)
+        device = index.get(value)
+        if device is None:
+            miss = (index_name, value)
+            if miss not in self._missing:
+                self._missing.add(miss)
+                print(f"Error: Device '{value}' not found in {self.path}.")
+        return device
+
+    def by_id(self, device_id):
+        return self._lookup('_by_id', device_id)
+
+    def by_name(self, name):
+        return self._lookup('_by_name', name)
+
+    def by_ip(self, ip):
+        return self._lookup('_by_ip', ip)
+
+    def is_unknown(self, device_id):
+        """True if ``device_id`` already missed since the last reload."""
+        self._refresh()
+        return ('_by_id', device_id) in self._missing
+
+    def devices(self):
+        self._refresh()
+        return list(self._devices)
+
+
+def get_registry(path='devices.json'):
+    """Return the shared registry for a device file."""
+    registry = _registries.get(path)
+    if registry is None:
+        with _registries_lock:
+            registry = _registries.setdefault(path, DeviceRegistry(path))
+    return registry
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""Shared cache of each device's last known IP and protocol version.
+
+Creating tinytuya.Device(dev_id, 'Auto', ...) listens for the device's UDP
+broadcast, which can take up to 8 seconds per device. The monitors record
+every address they learn, from broadcasts and from successful connects, in the
+device_discovery table of MariaDB, so the broadcast listener's observations
+reach every polling replica and a new replica starts warm; they connect
+straight to the cached IP and the 'Auto' scan is only the fallback when that
+connect fails.
+
+The table is re-read at most every REFRESH_INTERVAL seconds. Every entry is
+also kept in a small local JSON file (rewritten atomically, only when an IP or
+version changes), used when MariaDB is not reachable; writes that could not
+reach the table are retried on the next refresh. DISCOVERY_TABLE='' keeps the
+cache in the file only. MariaDB is never queried with the lock held, and
+update(..., background=True) only touches memory and the file: a background
+thread pushes the change, so a receive loop never waits on the database.
+
+Usage:
+    from discovery_cache import get_discovery_cache
+    cache = get_discovery_cache()
+    entry = cache.get(dev_id)            # {'ip': ..., 'version': ..., 'ts': ...} or None
+    cache.update(dev_id, ip, version)
+    cache.update(dev_id, ip, version, background=True)   # sin esperar a MariaDB
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from db_mariadb import ensure_table_once, get_pool
+
+logger = logging.getLogger(__name__)
+
+TABLE = os.getenv('DISCOVERY_TABLE', 'device_discovery')
+# Segundos entre relecturas de la tabla (la escribe sobre todo el monitor broadcast)
+REFRESH_INTERVAL = 30
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def ensure_discovery_table(conn, table_name=TABLE):
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table_name} (
+                dev_id VARCHAR(255) PRIMARY KEY,
+                ip VARCHAR(64) NOT NULL,
+                version VARCHAR(10),
+                ts BIGINT NOT NULL
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+            """
+        )
+    conn.commit()
+
+
+class DiscoveryCache:
+    """dev_id -> last known ip/version, shared through MariaDB with a local JSON copy."""
+
+    def __init__(self, path, table=TABLE):
+        self.path = path
+        self.table = table
+        self._lock = threading.Lock()
+        # una sola sincronización con MariaDB a la vez, sin bloquear get/update
+        self._sync_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._entries = self._read()
+        # dev_id -> entrada pendiente de escribir en la tabla ({'ip': ..., 'forget': True} = borrarla)
+        self._pending = {}
+        self._refreshed = None
+        self._db_ok = True
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as f:
+                entries = json.load(f)
+            return entries if isinstance(entries, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"No se pudo leer la caché de descubrimiento {self.path}: {e}")
+            return {}
+
+    def _db_sync(self, pending):
+        """Write ``pending`` changes to the table and return all its entries."""
+        with get_pool().connection() as conn:
+            ensure_table_once(conn, self.table, ensure_discovery_table)
+            with conn.cursor() as cur:
+                for dev_id, entry in pending.items():
+                    if entry.get('forget'):
+                        # solo si nadie ha visto entretanto el dispositivo en otra IP
+                        cur.execute(f"DELETE FROM {self.table} WHERE dev_id = %s AND ip = %s",
+                                    (dev_id, entry['ip']))
+                    else:
+                        # gana la observación más reciente, venga de la réplica que venga
+                        cur.execute(f"INSERT INTO {self.table} (dev_id, ip, version, ts) VALUES (%s, %s, %s, %s) "
+                                    f"ON DUPLICATE KEY UPDATE ip = IF(VALUES(ts) >= ts, VALUES(ip), ip), "
+                                    f"version = IF(VALUES(ts) >= ts, VALUES(version), version), "
+                                    f"ts = GREATEST(ts, VALUES(ts))",
+                                    (dev_id, entry['ip'], entry.get('version'), entry['ts']))
+                cur.execute(f"SELECT dev_id, ip, version, ts FROM {self.table}")
+                rows = cur.fetchall()
+            conn.commit()
+        return {dev_id: {'ip': ip, 'version': version, 'ts': ts} for dev_id, ip, version, ts in rows}
+
+    def _sync(self, force=False):
+        """Push pending changes and re-read the table (at most every REFRESH_INTERVAL). Call without the lock."""
+        if not self.table:
+            return
+        with self._sync_lock:
+            with self._lock:
+                now = time.monotonic()
+                # sin MariaDB no se reintenta en cada cambio, solo cada REFRESH_INTERVAL
+                if not (force and self._db_ok) and self._refreshed is not None \
+                        and now - self._refreshed < REFRESH_INTERVAL:
+                    return
+                self._refreshed = now
+                pending = dict(self._pending)
+            try:
+                shared = self._db_sync(pending)
+            except Exception as e:
+                with self._lock:
+                    if self._db_ok:
+                        logger.warning(f"Caché de descubrimiento sin MariaDB, se usa {self.path}: {e}")
+                        self._db_ok = False
+                return
+            with self._lock:
+                self._db_ok = True
+                for dev_id in pending:
+                    if self._pending.get(dev_id) is pending[dev_id]:
+                        del self._pending[dev_id]
+                # los cambios llegados durante la sincronización siguen pendientes y mandan
+                for dev_id, entry in self._pending.items():
+                    if entry.get('forget'):
+                        shared.pop(dev_id, None)
+                    else:
+                        shared[dev_id] = entry
+                if shared != self._entries:
+                    self._entries = shared
+                    self._write(shared)
+
+    def _run_sync(self):
+        while True:
+            self._wake.wait(REFRESH_INTERVAL)
+            self._wake.clear()
+            if self._pending:
+                self._sync(force=True)
+
+    def _sync_later(self):
+        """Hand the pending changes to the background sync thread. Call with the lock held."""
+        if not self.table:
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run_sync, name='discovery-sync', daemon=True)
+            self._thread.start()
+        self._wake.set()
+
+    def get(self, dev_id):
+        self._sync()
+        with self._lock:
+            entry = self._entries.get(dev_id)
+            return dict(entry) if entry else None
+
+    def update(self, dev_id, ip, version=None, background=False):
+        """Record an observed address; writes only if ip or version changed.
+
+        With ``background`` the change is pushed to MariaDB by a background
+        thread instead of before returning.
+        """
+        if not dev_id or not ip or ip == 'Auto':
+            return False
+        version = str(version) if version else None
+        with self._lock:
+            entry = self._entries.get(dev_id)
+            if entry and entry.get('ip') == ip and (version is None or entry.get('version') == version):
+                return False
+            entry = self._entries[dev_id] = {'ip': ip, 'version': version or (entry or {}).get('version'),
+                                             'ts': int(time.time())}
+            self._save(dev_id)
+            self._pending[dev_id] = entry
+            if background:
+                self._sync_later()
+        if not background:
+            self._sync(force=True)
+        return True
+
+    def forget(self, dev_id):
+        """Drop an entry whose address no longer answers."""
+        with self._lock:
+            entry = self._entries.pop(dev_id, None)
+            if entry is not None:
+                self._save(dev_id, removed=True)
+                self._pending[dev_id] = {'ip': entry['ip'], 'forget': True}
+        if entry is not None:
+            self._sync(force=True)
+
+    def _save(self, dev_id, removed=False):
+        # fusionar con lo que hayan escrito otros procesos que comparten el fichero
+        merged = self._read()
+        if removed:
+            merged.pop(dev_id, None)
+        else:
+            merged[dev_id] = self._entries[dev_id]
+        self._entries = merged
+        self._write(merged)
+
+    def _write(self, entries):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(entries, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning(f"No se pudo guardar la caché de descubrimiento {self.path}: {e}")
+
+
+def get_discovery_cache(path=None):
+    """Process-wide cache for ``path`` (default DISCOVERY_CACHE env or discovery_cache.json)."""
+    path = path or os.getenv('DISCOVERY_CACHE', 'discovery_cache.json')
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = _caches[path] = DiscoveryCache(path)
+        return cache
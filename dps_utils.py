@@ -4,40 +4,26 @@
 
 import json
 import base64
+import logging
 from datetime import datetime
 
+from device_registry import get_registry
+
+try:
+    import numpy as np
+except ImportError:  # NumPy es opcional: solo acelera decode_phase_column
+    np = None
+
+logger = logging.getLogger(__name__)
+
 
 def load_device_info_polling(device_name):
     """Load device info from devices.monitor.json by device name"""
-    try:
-        with open('devices.monitor.json', 'r') as f:
-            devices = json.load(f)
-    except FileNotFoundError:
-        print("Error: devices.monitor.json not found.")
-        return None
-    
-    device_info = next((d for d in devices if d['name'] == device_name), None)
-    if not device_info:
-        print(f"Error: Device '{device_name}' not found in devices.json.")
-        return None
-    
-    return device_info
+    return get_registry('devices.monitor.json').by_name(device_name)
 
 def load_device_info_by_id(device_id):
     """Load device info from devices.json by device ID"""
-    try:
-        with open('devices.json', 'r') as f:
-            devices = json.load(f)
-    except FileNotFoundError:
-        print("Error: devices.json not found.")
-        return None
-
-    device_info = next((d for d in devices if d['id'] == device_id), None)
-    if not device_info:
-        print(f"Error: Device '{device_id}' not found in devices.json.")
-        return None
-    
-    return device_info
+    return get_registry('devices.json').by_id(device_id)
 
 
 def _parse_values_obj(obj):
@@ -108,6 +94,95 @@ def get_type_for(dps_key, mapping):
     return mapping.get(str(dps_key), {}).get('type', 'N/A')
 
 
+class DpsField:
+    """Decoding info for one DPS key, resolved once from the device mapping."""
+    __slots__ = ('key', 'code', 'type', 'unit', 'scale', 'divisor')
+
+    def __init__(self, key, mapping):
+        self.key = str(key)
+        self.code = get_code_for(key, mapping)
+        self.type = get_type_for(key, mapping)
+        self.unit = get_unit_for(key, mapping)
+        self.scale = get_scale_for(key, mapping)
+        self.divisor = 10 ** self.scale if self.scale is not None else None
+
+    def scale_value(self, raw_value):
+        """Same result as scale_value(), without touching the mapping."""
+        try:
+            num = float(raw_value)
+        except Exception:
+            return raw_value
+        if self.divisor is not None:
+            return num / self.divisor
+        return num
+
+
+class DpsDecoder:
+    """Per-device decoder compiled once from its mapping.
+
+    All JSON parsing of the mapping's 'values'/'raw_values' happens here, so
+    decoding a packet is just dict lookups.
+    """
+    __slots__ = ('fields',)
+
+    def __init__(self, mapping):
+        mapping = mapping or {}
+        self.fields = {str(k): DpsField(k, mapping) for k in mapping}
+
+    def field(self, dps_key):
+        f = self.fields.get(dps_key)
+        if f is None:
+            # DPS no presente en el mapping: se compila una vez y se guarda
+            f = self.fields[dps_key] = DpsField(dps_key, {})
+        return f
+
+    def decode(self, dps):
+        """Return [(field, raw_value, scaled_value)] for a raw dps dict, sorted by key."""
+        field = self.field
+        return [(f, v, f.scale_value(v)) for f, v in
+                ((field(str(k)), v) for k, v in sorted(dps.items(), key=dps_sort_key))]
+
+    def readings(self, dps_data):
+        """Numeric (dps_key, code, value, unit) tuples; see decode_readings()."""
+        if not dps_data or 'dps' not in dps_data:
+            return []
+        readings = []
+        field = self.field
+        for k, v in dps_data['dps'].items():
+            f = field(str(k))
+            if isinstance(v, bool):
+                value = 1.0 if v else 0.0
+            elif isinstance(v, (int, float)):
+                value = f.scale_value(v)
+            elif f.code in PHASE_CODES and isinstance(v, str):
+                try:
+                    phase = parse_phase(v)
+                except Exception:
+                    continue
+                for (name, unit), value in zip(PHASE_UNITS, phase):
+                    readings.append((f.key, f'{f.code}_{name}', value, unit))
+                continue
+            else:
+                continue
+            readings.append((f.key, f.code if f.code != 'N/A' else f.key, value, f.unit))
+        return readings
+
+
+_decoders = {}
+
+
+def get_decoder(device_info):
+    """Return the cached DpsDecoder for a device, rebuilding it if its mapping changed."""
+    mapping = (device_info or {}).get('mapping', {}) or {}
+    cache_key = (device_info or {}).get('id') or (device_info or {}).get('name')
+    cached = _decoders.get(cache_key)
+    if cached is not None and cached[0] is mapping:
+        return cached[1]
+    decoder = DpsDecoder(mapping)
+    _decoders[cache_key] = (mapping, decoder)
+    return decoder
+
+
 def dps_sort_key(item):
     """Sort key for DPS items"""
     k, _ = item
@@ -117,53 +192,144 @@ def dps_sort_key(item):
         return k
 
 
+# Códigos DPS con tensión/intensidad/potencia empaquetadas en base64 (medidores dlq)
+PHASE_CODES = ('phase_a', 'phase_b', 'phase_c')
+PHASE_UNITS = (('voltage', 'V'), ('current', 'A'), ('power', 'kW'))
+
+
+def parse_phase(value):
+    """Decode a base64 phase blob into (voltage V, current A, power kW).
+
+    Layout: bytes 0-1 voltage /10, bytes 2-4 current /1000, last 3 bytes power /1000.
+    Raises ValueError for blobs too short to hold the current, like the old bit-string decoder.
+    """
+    raw = base64.b64decode(value)
+    if len(raw) < 3:
+        raise ValueError(f"blob de fase de {len(raw)} bytes")
+    return (int.from_bytes(raw[0:2], 'big') / 10,
+            int.from_bytes(raw[2:5], 'big') / 1000,
+            int.from_bytes(raw[-3:], 'big') / 1000)
+
+
+def decode_phase_column(values):
+    """Decode many phase blobs at once (e.g. a column of historical rows).
+
+    Returns (index, voltage, current, power): the positions in ``values`` that
+    could be decoded and their values, as NumPy arrays when NumPy is installed,
+    otherwise as lists. 8-byte blobs are decoded in bulk, other lengths one by
+    one with parse_phase; blobs that cannot be decoded are skipped and logged.
+    """
+    raws = []
+    for v in values:
+        try:
+            raws.append(base64.b64decode(v) if v else b'')
+        except (TypeError, ValueError):
+            raws.append(b'')
+    index, others = [], {}
+    for i, (v, r) in enumerate(zip(values, raws)):
+        if len(r) == 8:
+            index.append(i)
+            continue
+        try:
+            others[i] = parse_phase(v)
+            index.append(i)
+        except (TypeError, ValueError):
+            pass
+    if len(index) < len(values):
+        logger.warning(f"{len(values) - len(index)} blobs de fase no decodificables omitidos")
+    if np is None:
+        out = [others[i] if i in others else parse_phase(values[i]) for i in index]
+        return (index,) + (tuple(list(col) for col in zip(*out)) if out else ([], [], []))
+    fast = [i for i in index if i not in others]
+    buf = np.frombuffer(b''.join(raws[i] for i in fast), dtype=np.uint8)
+    b = buf.reshape(-1, 8).astype(np.uint32)
+    columns = {i: n for n, i in enumerate(fast)}
+    voltage = np.empty(len(index))
+    current = np.empty(len(index))
+    power = np.empty(len(index))
+    pos = np.fromiter((n for n, i in enumerate(index) if i in columns), dtype=np.intp)
+    voltage[pos] = ((b[:, 0] << 8) | b[:, 1]) / 10
+    current[pos] = ((b[:, 2] << 16) | (b[:, 3] << 8) | b[:, 4]) / 1000
+    power[pos] = ((b[:, 5] << 16) | (b[:, 6] << 8) | b[:, 7]) / 1000
+    for n, i in enumerate(index):
+        if i in others:
+            voltage[n], current[n], power[n] = others[i]
+    return np.asarray(index, dtype=np.intp), voltage, current, power
+
+
 def decode_phase(value):
     """Decode phase data from base64 encoded value"""
-    decoded_value = base64.b64decode(value)
-    binary_value = ''.join(format(byte, '08b') for byte in decoded_value)
-    Tension = int(binary_value[:16], 2)
-    Intensidad = int(binary_value[16:40], 2)
-    Potencia = int(binary_value[-24:], 2)
-    print(' Tension:', Tension / 10, 'V')
-    print(' Intensidad:', Intensidad / 1000, 'A')
-    print(' Potencia:', Potencia / 1000, 'KW')
+    Tension, Intensidad, Potencia = parse_phase(value)
+    print(' Tension:', Tension, 'V')
+    print(' Intensidad:', Intensidad, 'A')
+    print(' Potencia:', Potencia, 'KW')
+    return Tension, Intensidad, Potencia
 
 
-def print_dps(dps_data, device_info, device_name):
-    """Print formatted DPS data from status payload"""
+def decode_readings(dps_data, device_info):
+    """Decode a status payload into numeric readings for the typed table.
+
+    Returns a list of (dps_key, code, value, unit) tuples with the value already
+    scaled. Booleans are stored as 0/1 and phase_a/b/c blobs become
+    <code>_voltage/_current/_power; other enums, strings and raw blobs are skipped.
+    """
+    return get_decoder(device_info).readings(dps_data)
+
+
+def sensor_readings(sensor_values):
+    """
+    Ariston: convierte los valores numéricos/booleanos de los sensores en lecturas
+    (clave, código, valor, unidad) para la tabla tipada.
+    """
+    readings = []
+    for key, sensor in sensor_values.items():
+        value = sensor.get('value') if isinstance(sensor, dict) else None
+        if isinstance(value, bool):
+            value = 1.0 if value else 0.0
+        elif not isinstance(value, (int, float)):
+            continue
+        readings.append((key, key, float(value), sensor.get('units')))
+    return readings
+
+
+def format_dps(dps_data, device_info, device_name):
+    """Formatted DPS lines of a status payload (what print_dps shows)"""
     if not dps_data or 'dps' not in dps_data:
-        return
+        return []
     
-    dps = dps_data['dps']
-    mapping = device_info.get('mapping', {}) or {}
+    decoder = get_decoder(device_info)
     
     now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    print(f"Dispositivo: {device_name} a las {now}")
+    lines = [f"Dispositivo: {device_name} a las {now}"]
     
-    # Imprimir timestamp si está disponible
+    # Timestamp si está disponible
     if 't' in dps_data:
         try:
             timestamp = int(dps_data['t'])
             dt = datetime.fromtimestamp(timestamp)
             dt_str = dt.strftime('%Y-%m-%d %H:%M:%S')
-            print(f"Timestamp: {dt_str}")
+            lines.append(f"Timestamp: {dt_str}")
         except Exception as e:
-            print(f"Timestamp: {dps_data['t']} (error al convertir: {e})")
+            lines.append(f"Timestamp: {dps_data['t']} (error al convertir: {e})")
     
-    for k, v in sorted(dps.items(), key=dps_sort_key):
-        code = get_code_for(k, mapping)
-        scaled = scale_value(k, v, mapping)
-        data_type = get_type_for(k, mapping)
-        unit = get_unit_for(k, mapping)
-        
+    for field, v, scaled in decoder.decode(dps_data['dps']):
         # Format output based on type
-        if data_type == "Boolean":
-            output = f"{code}={v}"
+        if field.type == "Boolean":
+            output = f"{field.code}={v}"
         else:
-            output = f"{code}={scaled}"
-            if unit:
-                output += f" {unit}"
+            output = f"{field.code}={scaled}"
+            if field.unit:
+                output += f" {field.unit}"
         
-        print(output)
-        if code == "phase_a":
-            decode_phase(v)
+        lines.append(output)
+        if field.code == "phase_a":
+            Tension, Intensidad, Potencia = parse_phase(v)
+            lines.extend((f" Tension: {Tension} V", f" Intensidad: {Intensidad} A", f" Potencia: {Potencia} KW"))
+    return lines
+
+
+def print_dps(dps_data, device_info, device_name):
+    """Print formatted DPS data from status payload"""
+    lines = format_dps(dps_data, device_info, device_name)
+    if lines:
+        print("\n".join(lines))
@@ -54,8 +54,14 @@ kubectl apply -f "${SCRIPT_DIR}/12-ingress.yaml"
 
 echo ">>> Desplegando monitores Python..."
 kubectl apply -f "${SCRIPT_DIR}/20-tuya-broadcast-monitor.yaml"
+# tuya-polling-monitor pasó de Deployment a StatefulSet (réplicas repartidas)
+kubectl delete deployment -n domotica tuya-polling-monitor --ignore-not-found
 kubectl apply -f "${SCRIPT_DIR}/21-tuya-polling-monitor.yaml"
 kubectl apply -f "${SCRIPT_DIR}/22-termo-ariston.yaml"
+kubectl apply -f "${SCRIPT_DIR}/23-rollups.yaml"
+kubectl apply -f "${SCRIPT_DIR}/24-partitions.yaml"
+kubectl apply -f "${SCRIPT_DIR}/25-archive.yaml"
+kubectl apply -f "${SCRIPT_DIR}/26-series-api.yaml"
 
 echo ""
 echo "=== Despliegue completado ==="
@@ -68,8 +74,11 @@ echo "Ver logs:"
 echo "  kubectl logs -n domotica deployment/mariadb"
 echo "  kubectl logs -n domotica deployment/grafana"
 echo "  kubectl logs -n domotica deployment/tuya-broadcast-monitor"
-echo "  kubectl logs -n domotica deployment/tuya-polling-monitor"
+echo "  kubectl logs -n domotica statefulset/tuya-polling-monitor"
 echo "  kubectl logs -n domotica deployment/termo-ariston"
+echo "  kubectl logs -n domotica deployment/rollups"
+echo "  kubectl logs -n domotica deployment/series-api"
+echo "  kubectl get cronjob -n domotica partitions archive"
 echo ""
 
 # Mostrar la info del Ingress
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""Queue-based logging for the monitor daemons.
+
+The daemons' threads and event loop only put records on a queue; a single
+listener thread formats them and writes to the console and to a size-rotated
+log file (LOG_MAX_BYTES, LOG_BACKUPS). If the queue is full, records are
+dropped and counted instead of blocking the receive loop.
+
+Per-payload dumps (the print_dps output) go to the "payloads" logger at DEBUG
+level and at most once every PAYLOAD_LOG_INTERVAL seconds per device, so they
+cost nothing unless LOG_LEVEL=DEBUG.
+
+Usage:
+    from log_setup import setup_logging, get_payload_log
+    setup_logging("/var/log/tuya_async_monitor.log")
+    logger = logging.getLogger(__name__)
+    get_payload_log()(device_name, data, device_info)
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+from dps_utils import format_dps
+
+logger = logging.getLogger(__name__)
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener = None
+_payload_log = None
+_setup_lock = threading.Lock()
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records when the queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # el formateo se hace en el hilo del listener, no en el del llamante
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(log_file=None, level=None, max_queue=10000):
+    """Route the root logger through a queue to console + rotating ``log_file``.
+
+    ``level`` defaults to the LOG_LEVEL env var (INFO). Safe to call more than
+    once; only the first call installs the handlers.
+    """
+    global _listener
+    with _setup_lock:
+        root = logging.getLogger()
+        if _listener is not None:
+            return
+        formatter = logging.Formatter(LOG_FORMAT)
+        handlers = []
+        console = logging.StreamHandler(sys.stdout)
+        console.setFormatter(formatter)
+        handlers.append(console)
+        file_error = None
+        if log_file:
+            try:
+                os.makedirs(os.path.dirname(log_file) or ".", exist_ok=True)
+                file_handler = logging.handlers.RotatingFileHandler(
+                    log_file, maxBytes=int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024)),
+                    backupCount=int(os.getenv('LOG_BACKUPS', 5)), encoding='utf-8')
+                file_handler.setFormatter(formatter)
+                handlers.append(file_handler)
+            except OSError as e:
+                # Fallback if /var/log is not writable
+                file_error = e
+
+        log_queue = queue.Queue(maxsize=max_queue)
+        queue_handler = _NonBlockingQueueHandler(log_queue)
+        root.handlers = [queue_handler]
+        root.setLevel(level or os.getenv('LOG_LEVEL', 'INFO').upper())
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+    if file_error is not None:
+        logger.warning(f"Could not write to {log_file}: {file_error}")
+
+
+def dropped_records():
+    """Records dropped because the log queue was full."""
+    handlers = [h for h in logging.getLogger().handlers if isinstance(h, _NonBlockingQueueHandler)]
+    return sum(h.dropped for h in handlers)
+
+
+class PayloadLog:
+    """Per-device rate-limited DEBUG dump of received payloads."""
+
+    def __init__(self, interval=60.0, logger_name='payloads'):
+        self.interval = interval
+        self.logger = logging.getLogger(logger_name)
+        self._last = {}
+        self.suppressed = 0
+
+    def __call__(self, device_name, data, device_info=None, label='Received Payload'):
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return False
+        now = time.monotonic()
+        last = self._last.get(device_name)
+        if last is not None and now - last < self.interval:
+            self.suppressed += 1
+            return False
+        self._last[device_name] = now
+        lines = format_dps(data, device_info, device_name) if isinstance(data, dict) else []
+        self.logger.debug("%s: %s: %r%s", device_name, label, data,
+                          "".join("\n  " + line for line in lines))
+        return True
+
+
+def get_payload_log():
+    """Process-wide PayloadLog (PAYLOAD_LOG_INTERVAL env var, seconds, default 60)."""
+    global _payload_log
+    if _payload_log is None:
+        _payload_log = PayloadLog(float(os.getenv('PAYLOAD_LOG_INTERVAL', 60)))
+    return _payload_log
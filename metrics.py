@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""Prometheus metrics shared by the monitor daemons.
+
+Each daemon calls start_metrics_server() once and then records:
+  - per-device counters: packets received, errors, reconnects
+  - latency histograms per pipeline stage: device round-trip (status(),
+    heartbeat, cloud reads), decode and DB insert
+  - seconds since the last successful reading per device, computed at scrape
+    time so stale devices can be alerted on directly
+
+prometheus_client is optional: without it every call here is a no-op.
+
+Usage:
+    import metrics
+    metrics.start_metrics_server(9101)
+    with metrics.timed(metrics.DEVICE_ROUNDTRIP, device, 'status'):
+        data = d.status()
+    metrics.reading_ok(device)
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    from prometheus_client import Counter, Gauge, Histogram, start_http_server
+except ImportError:  # prometheus_client es opcional
+    Counter = Gauge = Histogram = start_http_server = None
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class _Noop:
+    """Stand-in for metric objects when prometheus_client is missing."""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, *args):
+        pass
+
+    def observe(self, *args):
+        pass
+
+    def set(self, *args):
+        pass
+
+    def set_function(self, *args):
+        pass
+
+
+if Counter is not None:
+    PACKETS = Counter('domotica_packets_total', 'Payloads received per device', ['device'])
+    ERRORS = Counter('domotica_errors_total', 'Errors per device', ['device'])
+    RECONNECTS = Counter('domotica_reconnects_total', 'Reconnections per device', ['device'])
+    DEVICE_ROUNDTRIP = Histogram('domotica_device_roundtrip_seconds', 'Device request round-trip',
+                                 ['device', 'command'], buckets=LATENCY_BUCKETS)
+    DECODE = Histogram('domotica_decode_seconds', 'Payload decode time', buckets=LATENCY_BUCKETS)
+    DB_INSERT = Histogram('domotica_db_insert_seconds', 'Batch insert + commit time', buckets=LATENCY_BUCKETS)
+    DB_BATCH_ROWS = Histogram('domotica_db_batch_rows', 'Rows per insert batch',
+                              buckets=(1, 5, 10, 25, 50, 100, 200, 500, 1000))
+    SECONDS_SINCE_READING = Gauge('domotica_seconds_since_last_reading',
+                                  'Seconds since the last successful reading', ['device'])
+    WRITER_QUEUE = Gauge('domotica_writer_queue_depth', 'Rows waiting in the write-behind queue')
+    SPOOL_BYTES = Gauge('domotica_spool_bytes', 'Bytes of rows spooled on disk waiting for MariaDB')
+    API_QUERY = Histogram('domotica_series_query_seconds', 'Series API read + downsample time (cache misses)',
+                          buckets=LATENCY_BUCKETS)
+    API_CACHE = Counter('domotica_series_cache_total', 'Series API cache lookups', ['result'])
+    SHARD_DEVICES = Gauge('domotica_shard_devices', 'Devices polled by this replica')
+    BROKER_SUBSCRIBERS = Gauge('domotica_broker_subscribers', 'Live reading stream subscribers')
+    BROKER_DROPPED = Counter('domotica_broker_dropped_total', 'Readings dropped from full subscriber buffers')
+    BROADCAST_DROPPED = Counter('domotica_broadcast_dropped_total', 'Broadcasts dropped from the full poll queue')
+else:
+    PACKETS = ERRORS = RECONNECTS = DEVICE_ROUNDTRIP = DECODE = DB_INSERT = DB_BATCH_ROWS = _Noop()
+    SECONDS_SINCE_READING = WRITER_QUEUE = SPOOL_BYTES = API_QUERY = API_CACHE = SHARD_DEVICES = _Noop()
+    BROKER_SUBSCRIBERS = BROKER_DROPPED = BROADCAST_DROPPED = _Noop()
+
+_last_reading = {}
+_lock = threading.Lock()
+
+
+def start_metrics_server(default_port):
+    """Serve /metrics on METRICS_PORT (or ``default_port``); 0 disables it."""
+    port = int(os.getenv('METRICS_PORT', default_port))
+    if start_http_server is None or not port:
+        return False
+    try:
+        start_http_server(port)
+    except OSError as e:
+        logger.warning(f"No se pudo abrir el puerto de métricas {port}: {e}")
+        return False
+    logger.info(f"Métricas Prometheus en :{port}/metrics")
+    return True
+
+
+@contextmanager
+def timed(histogram, *labels):
+    """Observe the duration of the block in ``histogram`` (with optional labels)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        (histogram.labels(*labels) if labels else histogram).observe(time.perf_counter() - started)
+
+
+def packet(device):
+    PACKETS.labels(device).inc()
+
+
+def error(device):
+    ERRORS.labels(device).inc()
+
+
+def reconnect(device):
+    RECONNECTS.labels(device).inc()
+
+
+def reading_ok(device):
+    """Mark a successful reading; the staleness gauge is computed on scrape."""
+    with _lock:
+        first = device not in _last_reading
+        _last_reading[device] = time.time()
+    if first:
+        SECONDS_SINCE_READING.labels(device).set_function(lambda: time.time() - _last_reading[device])
+
+
+def track_writer(writer):
+    """Export the write-behind queue depth and spool size of a StatusWriter."""
+    WRITER_QUEUE.set_function(lambda: writer.stats()['queue_depth'])
+    if writer.spool is not None:
+        SPOOL_BYTES.set_function(writer.spool.size)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Partition maintenance for device_status (RANGE on TO_DAYS(ts)).
+
+Each run:
+  - pre-creates the partitions for the next ``--ahead-days`` days by splitting
+    the empty catch-all pmax partition (instant, no rows move)
+  - drops the partitions whose whole range is older than ``--retention-days``
+    (DROP PARTITION discards the data files, no row-by-row DELETE)
+
+An existing unpartitioned device_status can be converted once with --convert;
+that ALTER copies the whole table, so run it in a maintenance window.
+
+Usage:
+    python partitions.py                          # mantener device_status
+    python partitions.py --retention-days 365
+    python partitions.py --convert                # particionar una tabla antigua
+    python partitions.py --loop 86400             # repetir cada día (docker-compose)
+"""
+import argparse
+import logging
+import os
+import time
+from datetime import date, timedelta
+
+from db_mariadb import (PARTITIONS_AHEAD_DAYS, ensure_table, ensure_table_once, get_pool, next_period,
+                        partition_clause, partition_defs, period_start)
+
+logger = logging.getLogger(__name__)
+
+# TO_DAYS() de MariaDB cuenta desde el año 0: TO_DAYS(d) = d.toordinal() + 365
+TO_DAYS_OFFSET = 365
+
+
+def list_partitions(conn, table_name):
+    """[(name, upper bound as a date or None for MAXVALUE)] in range order; [] if not partitioned."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS "
+                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL "
+                    "ORDER BY PARTITION_ORDINAL_POSITION", (table_name,))
+        rows = cur.fetchall()
+    return [(name, None if desc == 'MAXVALUE' else date.fromordinal(int(desc) - TO_DAYS_OFFSET))
+            for name, desc in rows]
+
+
+def add_future_partitions(conn, table_name, granularity, ahead_days=PARTITIONS_AHEAD_DAYS, today=None):
+    """Split pmax so there are partitions up to ``today + ahead_days``. Returns how many were added."""
+    partitions = list_partitions(conn, table_name)
+    bounds = [bound for _, bound in partitions if bound is not None]
+    if not partitions or partitions[-1][1] is not None or not bounds:
+        logger.warning(f"{table_name} no tiene la partición pmax esperada, no se añaden particiones")
+        return 0
+    today = today or date.today()
+    last = today + timedelta(days=ahead_days)
+    first = bounds[-1]
+    if period_start(first, granularity) != first:
+        # el último límite no cae en un inicio de periodo (se cambió la granularidad)
+        first = next_period(period_start(first, granularity), granularity)
+    defs = partition_defs(first, last, granularity)
+    if not defs:
+        return 0
+    with conn.cursor() as cur:
+        cur.execute(f"ALTER TABLE {table_name} REORGANIZE PARTITION pmax INTO ("
+                    + ", ".join(defs) + ", PARTITION pmax VALUES LESS THAN MAXVALUE)")
+    logger.info(f"{table_name}: {len(defs)} particiones nuevas hasta {last}")
+    return len(defs)
+
+
+def drop_expired_partitions(conn, table_name, retention_days, today=None):
+    """Drop partitions whose upper bound is on or before today - retention_days."""
+    if not retention_days:
+        return []
+    cutoff = (today or date.today()) - timedelta(days=retention_days)
+    partitions = list_partitions(conn, table_name)
+    # nunca se borra la última partición con datos ni pmax
+    expired = [name for name, bound in partitions[:-2] if bound is not None and bound <= cutoff]
+    if expired:
+        with conn.cursor() as cur:
+            cur.execute(f"ALTER TABLE {table_name} DROP PARTITION {', '.join(expired)}")
+        logger.info(f"{table_name}: borradas {len(expired)} particiones anteriores a {cutoff}: {', '.join(expired)}")
+    return expired
+
+
+def convert_table(conn, table_name, granularity, ahead_days=PARTITIONS_AHEAD_DAYS):
+    """Partition an existing plain device_status (copies the table)."""
+    if list_partitions(conn, table_name):
+        logger.info(f"{table_name} ya está particionada")
+        return False
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT MIN(ts) FROM {table_name}")
+        oldest = cur.fetchone()[0]
+        today = date.today()
+        first = oldest.date() if oldest else today
+        logger.info(f"Particionando {table_name} desde {first} (copia completa de la tabla)")
+        cur.execute(f"UPDATE {table_name} SET ts = '1970-01-01' WHERE ts IS NULL")
+        cur.execute(f"ALTER TABLE {table_name} MODIFY ts DATETIME NOT NULL, "
+                    f"DROP PRIMARY KEY, ADD PRIMARY KEY (id, ts) "
+                    + partition_clause(first, today + timedelta(days=ahead_days), granularity))
+    conn.commit()
+    return True
+
+
+def maintain(table_name='device_status', granularity='month', ahead_days=PARTITIONS_AHEAD_DAYS,
+             retention_days=0, convert=False):
+    with get_pool().connection() as conn:
+        ensure_table_once(conn, table_name, lambda c, t: ensure_table(c, t, granularity))
+        if convert:
+            convert_table(conn, table_name, granularity, ahead_days)
+        if not list_partitions(conn, table_name):
+            logger.warning(f"{table_name} no está particionada; usar --convert")
+            return
+        add_future_partitions(conn, table_name, granularity, ahead_days)
+        drop_expired_partitions(conn, table_name, retention_days)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mantenimiento de particiones de device_status")
+    parser.add_argument('--table', default='device_status')
+    parser.add_argument('--granularity', choices=('day', 'month'),
+                        default=os.getenv('PARTITION_GRANULARITY', 'month'))
+    parser.add_argument('--ahead-days', type=int, default=PARTITIONS_AHEAD_DAYS,
+                        help="Días futuros con partición ya creada")
+    parser.add_argument('--retention-days', type=int, default=int(os.getenv('RETENTION_DAYS', 0)),
+                        help="Borrar particiones más antiguas que esto (0 = conservar todo)")
+    parser.add_argument('--convert', action='store_true',
+                        help="Particionar una tabla existente sin particiones (copia la tabla)")
+    parser.add_argument('--loop', type=int, default=0, metavar='SEGUNDOS',
+                        help="Repetir el mantenimiento cada N segundos")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    convert = args.convert
+    while True:
+        try:
+            maintain(args.table, args.granularity, args.ahead_days, args.retention_days, convert)
+            convert = False
+        except Exception as e:
+            logger.error(f"Error en el mantenimiento de particiones: {e}")
+        if not args.loop:
+            break
+        time.sleep(args.loop)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Adaptive per-device poll intervals with error backoff and jitter.
+
+Each device gets its own PollSchedule. Readings that changed (by the change
+filter's deadbands) halve the status interval down to ``min_interval``;
+readings without changes stretch it by 25% up to ``max_interval``. A power
+meter under load is therefore polled every few seconds while a flat
+thermometer drifts out to minutes.
+
+Failures back off exponentially (BACKOFF_BASE, doubling up to BACKOFF_MAX)
+and every delay carries random jitter, so devices that failed together or
+started together do not keep hitting the LAN in synchronized bursts.
+
+Usage:
+    schedule = PollSchedule(30, min_interval=5, max_interval=300)
+    schedule.observe(changed)
+    await asyncio.sleep(schedule.next_delay())
+    ...
+    await asyncio.sleep(schedule.error_delay())
+"""
+import random
+
+MIN_INTERVAL = 5
+MAX_INTERVAL = 300
+SPEEDUP = 0.5
+SLOWDOWN = 1.25
+JITTER = 0.1
+BACKOFF_BASE = 5
+BACKOFF_MAX = 300
+
+
+def jittered(delay, jitter=JITTER):
+    """``delay`` spread randomly by +-``jitter`` (fraction)."""
+    return delay * random.uniform(1 - jitter, 1 + jitter)
+
+
+class PollSchedule:
+    """Status interval of one device, adapted to how fast its values change."""
+
+    __slots__ = ('interval', 'min_interval', 'max_interval', 'jitter', 'errors')
+
+    def __init__(self, interval, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL, jitter=JITTER):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.interval = min(max(interval, self.min_interval), self.max_interval)
+        self.jitter = jitter
+        self.errors = 0
+
+    @classmethod
+    def for_device(cls, device_info, interval):
+        """Schedule with the device's "status_min"/"status_max" overrides, if any."""
+        return cls(interval,
+                   min_interval=float(device_info.get('status_min', min(MIN_INTERVAL, interval))),
+                   max_interval=float(device_info.get('status_max', max(MAX_INTERVAL, interval))))
+
+    def ok(self):
+        """A request succeeded: clear the error streak."""
+        self.errors = 0
+
+    def observe(self, changed):
+        """Adapt the interval after a good reading and clear the error streak."""
+        self.ok()
+        factor = SPEEDUP if changed else SLOWDOWN
+        self.interval = min(max(self.interval * factor, self.min_interval), self.max_interval)
+
+    def next_delay(self):
+        return jittered(self.interval, self.jitter)
+
+    def first_delay(self):
+        """Random offset within one interval, to spread devices started together."""
+        return random.uniform(0, self.interval)
+
+    def error_delay(self):
+        """Exponential backoff with jitter for consecutive failures."""
+        self.errors += 1
+        cap = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (self.errors - 1))
+        # la mitad fija y la otra mitad aleatoria: nunca reintenta de inmediato
+        return random.uniform(cap / 2, cap)
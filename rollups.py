@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""Minute/hour/day rollups of device_readings.
+
+Each rollup table keeps min/max/sum/count/last per (device_name, code, bucket).
+The catch-up job only reads device_readings rows with an id above the stored
+watermark, folds them into the three resolutions with upserts and advances the
+watermark in the same transaction, so history is never rescanned.
+
+The watermark only moves past rows that no open transaction can still precede:
+rows are cut at inserted_at (set by MariaDB on insert, unlike ts, which spool
+replay and the backfill write with old values), no later than SAFETY_LAG ago
+and before the start of the oldest transaction still writing.
+
+Usage:
+    python rollups.py            # una pasada de catch-up
+    python rollups.py --loop 60  # catch-up cada 60 segundos
+
+    from rollups import pick_resolution
+    table = pick_resolution(start, end)   # 'device_readings', 'device_rollup_1m', ...
+"""
+import argparse
+import logging
+import time
+from datetime import timedelta
+
+import pymysql
+
+from db_mariadb import ensure_readings_table, ensure_table_once, get_pool
+
+logger = logging.getLogger(__name__)
+
+READINGS_TABLE = 'device_readings'
+WATERMARK_TABLE = 'rollup_watermark'
+# (sufijo, segundos por bucket)
+RESOLUTIONS = (('1m', 60), ('1h', 3600), ('1d', 86400))
+# Rangos cortos se sirven directamente desde la tabla de lecturas
+RAW_MAX_SPAN = timedelta(hours=6)
+# Margen para sentencias en curso: una fila insertada hace menos que esto aun puede tener
+# por delante ids menores sin commitear
+SAFETY_LAG = timedelta(seconds=30)
+_trx_warned = False
+
+
+def rollup_table(suffix):
+    return f'device_rollup_{suffix}'
+
+
+def bucket_start(ts, seconds):
+    """Truncate a datetime to the start of its 1m/1h/1d bucket."""
+    if seconds == 60:
+        return ts.replace(second=0, microsecond=0)
+    if seconds == 3600:
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def ensure_rollup_tables(conn):
+    with conn.cursor() as cur:
+        for suffix, _ in RESOLUTIONS:
+            cur.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {rollup_table(suffix)} (
+                    device_name VARCHAR(255) NOT NULL,
+                    code VARCHAR(100) NOT NULL,
+                    bucket DATETIME NOT NULL,
+                    min_value DOUBLE,
+                    max_value DOUBLE,
+                    sum_value DOUBLE,
+                    count BIGINT NOT NULL DEFAULT 0,
+                    last_value DOUBLE,
+                    last_ts DATETIME,
+                    PRIMARY KEY (device_name, code, bucket)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+                """
+            )
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (
+                name VARCHAR(100) PRIMARY KEY,
+                last_id BIGINT NOT NULL DEFAULT 0,
+                updated_at DATETIME
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+            """
+        )
+    conn.commit()
+
+
+def aggregate(rows):
+    """Fold (device_name, code, ts, value) rows into per-bucket aggregates.
+
+    Returns {suffix: {(device_name, code, bucket): [min, max, sum, count, last, last_ts]}}.
+    """
+    result = {suffix: {} for suffix, _ in RESOLUTIONS}
+    for device_name, code, ts, value in rows:
+        if value is None:
+            continue
+        for suffix, seconds in RESOLUTIONS:
+            key = (device_name, code, bucket_start(ts, seconds))
+            agg = result[suffix].get(key)
+            if agg is None:
+                result[suffix][key] = [value, value, value, 1, value, ts]
+                continue
+            if value < agg[0]:
+                agg[0] = value
+            if value > agg[1]:
+                agg[1] = value
+            agg[2] += value
+            agg[3] += 1
+            if ts >= agg[5]:
+                agg[4] = value
+                agg[5] = ts
+    return result
+
+
+def _upsert(cur, suffix, aggregates):
+    table = rollup_table(suffix)
+    # last_value se asigna antes que last_ts: MariaDB evalua el SET de izquierda a derecha
+    cur.executemany(
+        f"""
+        INSERT INTO {table} (device_name, code, bucket, min_value, max_value, sum_value, count, last_value, last_ts)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            min_value = LEAST(min_value, VALUES(min_value)),
+            max_value = GREATEST(max_value, VALUES(max_value)),
+            sum_value = sum_value + VALUES(sum_value),
+            count = count + VALUES(count),
+            last_value = IF(VALUES(last_ts) >= last_ts, VALUES(last_value), last_value),
+            last_ts = GREATEST(last_ts, VALUES(last_ts))
+        """,
+        [key + tuple(agg) for key, agg in aggregates.items()],
+    )
+
+
+def safe_cutoff(cur):
+    """Latest inserted_at the catch-up may fold: no uncommitted row has a lower id than one older than it.
+
+    Capped at the start of the oldest open write transaction when the server
+    lets us read information_schema.INNODB_TRX (needs PROCESS); otherwise only
+    transactions shorter than SAFETY_LAG are covered.
+    """
+    global _trx_warned
+    lag = SAFETY_LAG.total_seconds()
+    cur.execute("SELECT NOW(3) - INTERVAL %s SECOND", (lag,))
+    cutoff = cur.fetchone()[0]
+    try:
+        cur.execute("SELECT MIN(trx_started) - INTERVAL %s SECOND FROM information_schema.INNODB_TRX "
+                    "WHERE trx_mysql_thread_id <> CONNECTION_ID() AND trx_rows_modified > 0", (lag,))
+        oldest = cur.fetchone()[0]
+    except pymysql.MySQLError as e:
+        if not _trx_warned:
+            logger.warning(f"Sin acceso a INNODB_TRX ({e}); corte de rollups solo por SAFETY_LAG")
+            _trx_warned = True
+        return cutoff
+    return min(cutoff, oldest) if oldest is not None else cutoff
+
+
+def run_catchup(batch_size=5000, max_batches=None, name='rollups'):
+    """Fold every reading above the watermark into the rollup tables.
+
+    Returns the number of readings processed.
+    """
+    processed = 0
+    batches = 0
+    with get_pool().connection() as conn:
+        ensure_table_once(conn, READINGS_TABLE, ensure_readings_table)
+        ensure_table_once(conn, 'rollup_tables', lambda c, _: ensure_rollup_tables(c))
+        while max_batches is None or batches < max_batches:
+            with conn.cursor() as cur:
+                cur.execute(f"SELECT last_id FROM {WATERMARK_TABLE} WHERE name = %s FOR UPDATE", (name,))
+                row = cur.fetchone()
+                watermark = row[0] if row else 0
+                cur.execute(
+                    f"SELECT id, device_name, code, ts, value, inserted_at FROM {READINGS_TABLE} "
+                    f"WHERE id > %s ORDER BY id LIMIT %s",
+                    (watermark, batch_size))
+                fetched = cur.fetchall()
+                # Cortar en la primera fila insertada despues del corte: puede haber ids menores sin commitear
+                cutoff = safe_cutoff(cur)
+                rows = []
+                for r in fetched:
+                    if r[5] > cutoff:
+                        break
+                    rows.append(r)
+                if not rows:
+                    conn.rollback()
+                    break
+                aggregates = aggregate([r[1:5] for r in rows])
+                for suffix, _ in RESOLUTIONS:
+                    _upsert(cur, suffix, aggregates[suffix])
+                cur.execute(
+                    f"INSERT INTO {WATERMARK_TABLE} (name, last_id, updated_at) VALUES (%s, %s, NOW()) "
+                    f"ON DUPLICATE KEY UPDATE last_id = VALUES(last_id), updated_at = NOW()",
+                    (name, rows[-1][0]))
+            conn.commit()
+            processed += len(rows)
+            batches += 1
+            if len(rows) < len(fetched) or len(fetched) < batch_size:
+                break
+    return processed
+
+
+def pick_resolution(start, end, max_points=1000, min_points=None):
+    """Choose the table to read for a time range.
+
+    Short ranges use raw readings; longer ones use the finest rollup that keeps
+    the series under ``max_points`` buckets. With ``min_points`` the coarsest
+    rollup that still has at least that many buckets is chosen instead (raw
+    readings if not even the 1m rollup has), so a chart gets the points it
+    asked for while reading as few rows as possible.
+    """
+    span = end - start
+    if min_points:
+        for suffix, seconds in reversed(RESOLUTIONS):
+            if span.total_seconds() / seconds >= min_points:
+                return rollup_table(suffix)
+        return READINGS_TABLE
+    if span <= RAW_MAX_SPAN:
+        return READINGS_TABLE
+    for suffix, seconds in RESOLUTIONS:
+        if span.total_seconds() / seconds <= max_points:
+            return rollup_table(suffix)
+    return rollup_table(RESOLUTIONS[-1][0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Catch-up de las tablas de rollup desde device_readings")
+    parser.add_argument('--loop', type=int, default=0, metavar='SEGUNDOS',
+                        help="Repetir el catch-up cada N segundos")
+    parser.add_argument('--batch', type=int, default=5000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    while True:
+        started = time.monotonic()
+        try:
+            n = run_catchup(batch_size=args.batch)
+            logger.info(f"Rollups: {n} lecturas procesadas en {time.monotonic() - started:.2f}s")
+        except Exception as e:
+            logger.error(f"Error en el catch-up de rollups: {e}")
+        if not args.loop:
+            break
+        time.sleep(args.loop)
+
+
+if __name__ == "__main__":
+    main()
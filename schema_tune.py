@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""Indexes and generated columns for device_status derived from the dashboards.
+
+Reads every rawSql query in dashboard.json and finds which devices and which
+JSON paths (JSON_VALUE / JSON_EXISTS on status_json) the panels use. From that
+it plans:
+
+  - a (device_name, ts) index: every panel filters on one device and a time
+    range or orders by ts, which without it is a full scan of device_status
+  - a STORED generated column per hot JSON path, with exactly the expression
+    the panels use (JSON_VALUE(status_json, '$.dps."1"') -> dps_1), so the
+    value is extracted once on insert instead of on every refresh
+  - covering (device_name, ts, <column>) indexes for the hottest paths
+
+The columns and covering indexes only help the panels as they are written
+where the server's optimizer substitutes an indexed generated column for its
+expression; elsewhere the panels can select the column by name (dps_1).
+
+The indexes are built with LOCK=NONE, so inserts keep going; a server that
+cannot do it online refuses the statement instead of locking the table
+(--allow-lock to accept the lock). Adding STORED columns rebuilds the table
+(ALGORITHM=COPY), which MariaDB only runs with LOCK=NONE from 11.2 on; older
+servers get LOCK=SHARED, so inserts wait (in the writers' queue and spool)
+until the copy ends. Each query is EXPLAINed
+before and after so the change in access type, key and rows is visible.
+
+Usage:
+    python schema_tune.py                    # plan y EXPLAIN actual, sin cambios
+    python schema_tune.py --apply            # aplicar y comparar EXPLAIN
+    python schema_tune.py --top 6 --covering 2 --dashboard dashboard.json
+"""
+import argparse
+import json
+import logging
+import re
+from collections import Counter, defaultdict
+
+from db_mariadb import ensure_table, ensure_table_once, get_pool
+
+logger = logging.getLogger(__name__)
+
+TABLE = 'device_status'
+DEVICE_TS_INDEX = 'idx_device_ts'
+
+_COMMENT = re.compile(r'--[^\n]*')
+_JSON_PATH = re.compile(r"JSON_(?:VALUE|EXISTS)\(\s*status_json\s*,\s*'([^']+)'\s*\)", re.I)
+_DEVICE_EQ = re.compile(r"device_name\s*=\s*'([^']+)'", re.I)
+_DEVICE_IN = re.compile(r"device_name\s+IN\s*\(([^)]*)\)", re.I)
+_CASE_DEVICE = re.compile(r"WHEN\s+device_name\s*=\s*'([^']+)'\s+THEN(.*?)\bEND\b", re.I | re.S)
+_FROM_TABLE = re.compile(r'\bFROM\s+' + TABLE + r'\b', re.I)
+_TIME_FILTER = re.compile(r'\$__timeFilter\((\w+)\)')
+_TIME_GROUP = re.compile(r'\$__timeGroup(?:Alias)?\((\w+)[^)]*\)')
+_RANGE = re.compile(r'now-(\d+)([mhdwy])')
+_RANGE_UNITS = {'m': 'MINUTE', 'h': 'HOUR', 'd': 'DAY', 'w': 'WEEK', 'y': 'YEAR'}
+# Primera versión de MariaDB con ALTER ... ALGORITHM=COPY, LOCK=NONE
+ONLINE_COPY_VERSION = (11, 2)
+
+
+def dashboard_queries(dashboard):
+    """[(panel title, rawSql)] of every query in a dashboard JSON."""
+    found = []
+
+    def walk(node, title):
+        if isinstance(node, dict):
+            title = node.get('title', title)
+            if isinstance(node.get('rawSql'), str):
+                found.append((title, node['rawSql']))
+            for value in node.values():
+                walk(value, title)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value, title)
+
+    walk(dashboard, None)
+    return found
+
+
+def parse_query(sql):
+    """(devices, {(device, path)}) used by one query on device_status; None for other tables."""
+    sql = _COMMENT.sub('', sql)
+    if not _FROM_TABLE.search(sql):
+        return None
+    devices = set(_DEVICE_EQ.findall(sql))
+    for group in _DEVICE_IN.findall(sql):
+        devices.update(re.findall(r"'([^']+)'", group))
+    pairs = set()
+    # MAX(CASE WHEN device_name = 'x' THEN JSON_VALUE(...) END): cada ruta va con su dispositivo
+    for device, body in _CASE_DEVICE.findall(sql):
+        pairs.update((device, path) for path in _JSON_PATH.findall(body))
+    rest = _CASE_DEVICE.sub('', sql)
+    pairs.update((device, path) for path in _JSON_PATH.findall(rest) for device in devices or {None})
+    return devices, pairs
+
+
+def column_name(path):
+    """'$.dps."1"' -> 'dps_1', '$.heating.value' -> 'heating_value'."""
+    name = re.sub(r'[^0-9a-zA-Z]+', '_', path.lstrip('$')).strip('_').lower()
+    return name[:60] or 'json_value'
+
+
+def json_expression(path):
+    return f"JSON_VALUE(status_json, '{path}')"
+
+
+def analyze(queries):
+    """Usage of each JSON path: {path: {'panels': n, 'devices': set}} and the device_status queries."""
+    usage = defaultdict(lambda: {'panels': 0, 'devices': set()})
+    status_queries = []
+    for title, sql in queries:
+        parsed = parse_query(sql)
+        if parsed is None:
+            continue
+        status_queries.append((title, sql))
+        paths = Counter()
+        for device, path in parsed[1]:
+            paths[path] += 1
+            if device:
+                usage[path]['devices'].add(device)
+        for path in paths:
+            usage[path]['panels'] += 1
+    return dict(usage), status_queries
+
+
+def existing_schema(conn, table=TABLE):
+    """({column: generation expression or ''}, {index name: [columns]})."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT COLUMN_NAME, GENERATION_EXPRESSION FROM information_schema.COLUMNS "
+                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", (table,))
+        columns = {name: expr or '' for name, expr in cur.fetchall()}
+        cur.execute("SELECT INDEX_NAME, COLUMN_NAME FROM information_schema.STATISTICS "
+                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s ORDER BY INDEX_NAME, SEQ_IN_INDEX",
+                    (table,))
+        indexes = defaultdict(list)
+        for name, column in cur.fetchall():
+            indexes[name].append(column)
+    conn.commit()
+    return columns, dict(indexes)
+
+
+def server_version(conn):
+    """(major, minor) of a MariaDB server, or None for another server."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT VERSION()")
+        version = cur.fetchone()[0]
+    conn.commit()
+    match = re.match(r'(\d+)\.(\d+)', version)
+    return (int(match.group(1)), int(match.group(2))) if match and 'mariadb' in version.lower() else None
+
+
+def copy_lock(version):
+    """LOCK clause for the table-copy ALTER that adds STORED columns."""
+    return 'NONE' if version and version >= ONLINE_COPY_VERSION else 'SHARED'
+
+
+def plan(usage, columns, indexes, top=8, covering=2, table=TABLE, copy_lock='SHARED'):
+    """ALTER TABLE statements: [(description, sql)] for what is missing."""
+    hot = sorted(usage.items(), key=lambda item: (-item[1]['panels'], item[0]))[:top]
+    steps = []
+    new_columns = []
+    skipped = set()
+    for path, info in hot:
+        name = column_name(path)
+        if name in columns:
+            if json_expression(path).replace(' ', '') not in columns[name].replace(' ', '').replace('`', ''):
+                logger.warning(f"{table}.{name} ya existe con otra expresión; se omite {path}")
+                skipped.add(name)
+            continue
+        new_columns.append((name, path, info))
+    if new_columns:
+        clauses = [f"ADD COLUMN {name} VARCHAR(255) AS ({json_expression(path)}) STORED"
+                   for name, path, _ in new_columns]
+        steps.append((f"columnas generadas {', '.join(n for n, _, _ in new_columns)} "
+                      f"(usadas por {', '.join(str(i['panels']) for _, _, i in new_columns)} paneles)",
+                      f"ALTER TABLE {table} {', '.join(clauses)}, ALGORITHM=COPY, LOCK={copy_lock}"))
+    if not any(cols[:2] == ['device_name', 'ts'] for cols in indexes.values()):
+        steps.append(("índice (device_name, ts) para el filtro por dispositivo y rango",
+                      f"ALTER TABLE {table} ADD INDEX {DEVICE_TS_INDEX} (device_name, ts), "
+                      f"ALGORITHM=INPLACE, LOCK=NONE"))
+    for path, info in hot[:covering]:
+        name = column_name(path)
+        wanted = ['device_name', 'ts', name]
+        # sin su columna generada el índice no tiene sobre qué construirse
+        if name in skipped or info['panels'] < 2 or any(cols == wanted for cols in indexes.values()):
+            continue
+        steps.append((f"índice cubriente (device_name, ts, {name}) ({info['panels']} paneles)",
+                      f"ALTER TABLE {table} ADD INDEX idx_device_ts_{name} (device_name, ts, {name}), "
+                      f"ALGORITHM=INPLACE, LOCK=NONE"))
+    return steps
+
+
+def explainable(sql, time_range='6 HOUR'):
+    """Replace the Grafana macros so the query can be EXPLAINed."""
+    sql = _TIME_FILTER.sub(lambda m: f"{m.group(1)} >= NOW() - INTERVAL {time_range}", sql)
+    return _TIME_GROUP.sub(lambda m: m.group(1), sql)
+
+
+def dashboard_range(dashboard):
+    match = _RANGE.fullmatch(str((dashboard.get('time') or {}).get('from', '')))
+    return f"{match.group(1)} {_RANGE_UNITS[match.group(2)]}" if match else '6 HOUR'
+
+
+def explain(conn, sql, table=TABLE):
+    """(access type, key, estimated rows) of the table in the EXPLAIN of ``sql``."""
+    with conn.cursor() as cur:
+        cur.execute('EXPLAIN ' + sql)
+        names = [d[0] for d in cur.description]
+        rows = [dict(zip(names, row)) for row in cur.fetchall()]
+    conn.commit()
+    for row in rows:
+        if row.get('table') == table:
+            return row.get('type'), row.get('key'), row.get('rows')
+    return None
+
+
+def explain_all(conn, queries, time_range):
+    result = {}
+    for title, sql in queries:
+        try:
+            result[(title, sql)] = explain(conn, explainable(sql, time_range))
+        except Exception as e:
+            logger.warning(f"No se pudo hacer EXPLAIN de '{title}': {e}")
+            result[(title, sql)] = None
+    return result
+
+
+def _fmt(plan_row):
+    if plan_row is None:
+        return '-'
+    access, key, rows = plan_row
+    return f"{access} key={key or '-'} rows={rows}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnas generadas e índices de device_status según los paneles")
+    parser.add_argument('--dashboard', default='dashboard.json')
+    parser.add_argument('--top', type=int, default=8, help="Rutas JSON más usadas con columna generada")
+    parser.add_argument('--covering', type=int, default=2, help="Rutas con índice cubriente (device_name, ts, col)")
+    parser.add_argument('--apply', action='store_true', help="Aplicar el plan (por defecto solo se muestra)")
+    parser.add_argument('--allow-lock', action='store_true',
+                        help="Permitir que el ALTER bloquee la tabla si el servidor no puede hacerlo online")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    with open(args.dashboard, 'r') as f:
+        dashboard = json.load(f)
+    usage, queries = analyze(dashboard_queries(dashboard))
+    print(f"{len(queries)} consultas sobre {TABLE}; rutas JSON por número de paneles:")
+    for path, info in sorted(usage.items(), key=lambda item: (-item[1]['panels'], item[0])):
+        print(f"  {info['panels']:3}  {path:32} -> {column_name(path):20} {', '.join(sorted(info['devices']))}")
+
+    time_range = dashboard_range(dashboard)
+    with get_pool().connection() as conn:
+        ensure_table_once(conn, TABLE, ensure_table)
+        columns, indexes = existing_schema(conn)
+        lock = copy_lock(server_version(conn))
+        steps = plan(usage, columns, indexes, args.top, args.covering, copy_lock=lock)
+        if lock != 'NONE' and any('ALGORITHM=COPY' in sql for _, sql in steps):
+            print("Aviso: este servidor no copia la tabla online (MariaDB < 11.2); los inserts esperarán "
+                  "hasta que acabe el ALTER de las columnas generadas")
+        before = explain_all(conn, queries, time_range)
+        if not steps:
+            print("Nada que cambiar: columnas e índices ya creados")
+        for description, sql in steps:
+            print(f"\n-- {description}\n{sql};")
+        if not args.apply or not steps:
+            print("\nEXPLAIN actual:")
+            for (title, _), row in before.items():
+                print(f"  {title or '-':40} {_fmt(row)}")
+            return
+        for description, sql in steps:
+            if args.allow_lock:
+                sql = sql.replace('LOCK=NONE', 'LOCK=DEFAULT')
+            logger.info(f"Aplicando: {description}")
+            with conn.cursor() as cur:
+                cur.execute(sql)
+            conn.commit()
+        after = explain_all(conn, queries, time_range)
+    print("\nEXPLAIN antes -> después:")
+    for key, row in before.items():
+        print(f"  {key[0] or '-':40} {_fmt(row)}  ->  {_fmt(after.get(key))}")
+
+
+if __name__ == "__main__":
+    main()
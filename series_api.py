@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""Downsampled time series for Grafana (JSON / Infinity datasources).
+
+Instead of a panel pulling every raw row of its range, Grafana asks this
+service for one (device_name, code) series and gets back at most
+``maxDataPoints`` points:
+
+  - the source table is the coarsest one with at least ``maxDataPoints``
+    buckets (rollups.pick_resolution(min_points=...)): ranges shorter than
+    maxDataPoints minutes read raw readings, longer ones the 1m/1h/1d rollups,
+    from which each bucket contributes its min_value and max_value, so short
+    peaks are not averaged away before downsampling
+  - rows read are bounded: a raw read stops at RAW_MAX_ROWS and falls back to
+    the 1m rollup; the 1m and 1h tables are only chosen when the next coarser
+    one has fewer than maxDataPoints buckets, so they return under 60x
+    maxDataPoints rows (the ratio between resolutions), at most two points each
+  - the points are reduced with Largest-Triangle-Three-Buckets, which keeps the
+    visual shape (peaks and dips) of the series
+  - results are cached in memory (TTL + LRU) with the range rounded to the
+    point step, so dashboard refreshes every few seconds hit the cache
+
+Endpoints:
+    GET  /                      health check (JSON datasource "Save & test")
+    POST /metrics, /search      list of "device/code" series
+    POST /query                 JSON datasource: {"range": ..., "maxDataPoints": ..., "targets": [...]}
+    GET  /series?device=termometro_salon&code=va_temperature&from=${__from}&to=${__to}&maxDataPoints=500
+                                Infinity datasource: [{"time": ms, "value": v}, ...]
+
+Usage:
+    python series_api.py --port 8081
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import metrics
+from db_mariadb import get_pool
+from rollups import READINGS_TABLE, RESOLUTIONS, pick_resolution, rollup_table
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_POINTS = 1000
+# Filas en bruto leídas como máximo; con más se usa el rollup de 1 minuto
+RAW_MAX_ROWS = int(os.getenv('SERIES_RAW_MAX_ROWS', 50000))
+CACHE_TTL = float(os.getenv('SERIES_CACHE_TTL', 10))
+CACHE_ENTRIES = int(os.getenv('SERIES_CACHE_ENTRIES', 256))
+
+
+def lttb(points, threshold):
+    """Largest-Triangle-Three-Buckets downsampling of [(x, y)] sorted by x."""
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(points)
+    sampled = [points[0]]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # media del bucket siguiente, tercer vértice del triángulo
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        count = next_end - next_start
+        avg_x = sum(p[0] for p in points[next_start:next_end]) / count
+        avg_y = sum(p[1] for p in points[next_start:next_end]) / count
+
+        ax, ay = points[a]
+        best_area = -1.0
+        best = start = int(i * every) + 1
+        for j in range(start, int((i + 1) * every) + 1):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best = j
+        sampled.append(points[best])
+        a = best
+    sampled.append(points[-1])
+    return sampled
+
+
+class SeriesCache:
+    """Thread-safe LRU of query results that expire after ``ttl`` seconds."""
+
+    def __init__(self, ttl=CACHE_TTL, max_entries=CACHE_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_cache = SeriesCache()
+
+
+def _to_datetime(value):
+    """Epoch milliseconds (Grafana ${__from}) or ISO string -> naive local datetime, like ts."""
+    if isinstance(value, (int, float)) or (isinstance(value, str) and value.isdigit()):
+        return datetime.fromtimestamp(int(value) / 1000)
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed.astimezone().replace(tzinfo=None) if parsed.tzinfo else parsed
+
+
+def _read_raw(cur, device_name, code, start, end):
+    """Raw points, or None if the range has more than RAW_MAX_ROWS of them."""
+    cur.execute(f"SELECT ts, value FROM {READINGS_TABLE} WHERE device_name = %s AND code = %s "
+                f"AND ts >= %s AND ts < %s AND value IS NOT NULL ORDER BY ts LIMIT %s",
+                (device_name, code, start, end, RAW_MAX_ROWS + 1))
+    rows = cur.fetchall()
+    if len(rows) > RAW_MAX_ROWS:
+        return None
+    return [(int(ts.timestamp() * 1000), float(value)) for ts, value in rows]
+
+
+def _read_rollup(cur, table, seconds, device_name, code, start, end):
+    """Min and max of each bucket as two points (the max half a bucket later)."""
+    cur.execute(f"SELECT bucket, min_value, max_value FROM {table} WHERE device_name = %s AND code = %s "
+                f"AND bucket >= %s AND bucket < %s AND count > 0 AND min_value IS NOT NULL ORDER BY bucket",
+                (device_name, code, start, end))
+    points = []
+    for bucket, low, high in cur.fetchall():
+        t = int(bucket.timestamp() * 1000)
+        points.append((t, float(low)))
+        if high != low:
+            points.append((t + seconds * 500, float(high)))
+    return points
+
+
+def read_points(device_name, code, start, end, max_points):
+    """[(epoch ms, value)] of one series from the table that fits the range."""
+    table = pick_resolution(start, end, min_points=max_points)
+    with get_pool().connection() as conn:
+        with conn.cursor() as cur:
+            points = _read_raw(cur, device_name, code, start, end) if table == READINGS_TABLE else None
+            if points is None:
+                if table == READINGS_TABLE:
+                    logger.debug(f"{device_name}/{code}: más de {RAW_MAX_ROWS} lecturas, se usa el rollup de 1m")
+                    table = rollup_table(RESOLUTIONS[0][0])
+                seconds = next(s for suffix, s in RESOLUTIONS if rollup_table(suffix) == table)
+                points = _read_rollup(cur, table, seconds, device_name, code, start, end)
+        conn.commit()
+    return points
+
+
+def get_series(device_name, code, start, end, max_points=DEFAULT_MAX_POINTS, cache=_cache):
+    """Downsampled series for [start, end), served from the cache when possible."""
+    max_points = max(3, min(int(max_points), 10000))
+    # redondear el rango al paso entre puntos (y al menos al TTL) para que los
+    # refrescos con un rango desplazado unos segundos reutilicen la entrada
+    step = max(cache.ttl, (end - start).total_seconds() / max_points, 1)
+    start_q = datetime.fromtimestamp(start.timestamp() // step * step)
+    end_q = datetime.fromtimestamp((end.timestamp() // step + 1) * step)
+    key = (device_name, code, start_q, end_q, max_points)
+    points = cache.get(key)
+    if points is not None:
+        metrics.API_CACHE.labels('hit').inc()
+        return points
+    metrics.API_CACHE.labels('miss').inc()
+    with metrics.timed(metrics.API_QUERY):
+        points = lttb(read_points(device_name, code, start_q, end_q, max_points), max_points)
+    cache.put(key, points)
+    return points
+
+
+def list_series():
+    """'device/code' of every series that has a current value."""
+    with get_pool().connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT device_name, code FROM device_latest ORDER BY device_name, code")
+            rows = cur.fetchall()
+        conn.commit()
+    return [f"{device}/{code}" for device, code in rows]
+
+
+def _split_target(target):
+    if isinstance(target.get('payload'), dict) and target['payload'].get('device'):
+        return target['payload']['device'], target['payload'].get('code')
+    device_name, _, code = (target.get('target') or '').partition('/')
+    return device_name, code
+
+
+class SeriesHandler(BaseHTTPRequestHandler):
+    def _send_json(self, obj, status=200):
+        body = json.dumps(obj, separators=(',', ':')).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/':
+            return self._send_json({'status': 'ok'})
+        if url.path != '/series':
+            return self._send_json({'error': 'not found'}, 404)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        try:
+            start, end = _to_datetime(params['from']), _to_datetime(params['to'])
+            points = get_series(params['device'], params['code'], start, end,
+                                params.get('maxDataPoints', DEFAULT_MAX_POINTS))
+        except (KeyError, ValueError) as e:
+            return self._send_json({'error': f"parámetro incorrecto: {e}"}, 400)
+        except Exception as e:
+            # MariaDB caída, pool agotado...: responder en vez de dejar a Grafana esperando
+            logger.error(f"Error leyendo la serie {params.get('device')}/{params.get('code')}: {e}")
+            return self._send_json({'error': f"error interno: {e}"}, 500)
+        self._send_json([{'time': t, 'value': v} for t, v in points])
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        try:
+            if path in ('/metrics', '/search'):
+                names = list_series()
+                return self._send_json(names if path == '/search' else
+                                       [{'label': n, 'value': n} for n in names])
+            if path != '/query':
+                return self._send_json({'error': 'not found'}, 404)
+            request = self._read_json()
+            start = _to_datetime(request['range']['from'])
+            end = _to_datetime(request['range']['to'])
+            max_points = request.get('maxDataPoints', DEFAULT_MAX_POINTS)
+            result = []
+            for target in request.get('targets', []):
+                device_name, code = _split_target(target)
+                if not device_name or not code:
+                    continue
+                points = get_series(device_name, code, start, end, max_points)
+                result.append({'target': target.get('target') or f"{device_name}/{code}",
+                               'datapoints': [[v, t] for t, v in points]})
+        except (KeyError, ValueError) as e:
+            return self._send_json({'error': f"petición incorrecta: {e}"}, 400)
+        except Exception as e:
+            logger.error(f"Error atendiendo {path}: {e}")
+            return self._send_json({'error': f"error interno: {e}"}, 500)
+        self._send_json(result)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API de series reducidas (LTTB) para Grafana")
+    parser.add_argument('--port', type=int, default=int(os.getenv('SERIES_API_PORT', 8081)))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    metrics.start_metrics_server(9104)
+    server = ThreadingHTTPServer(('', args.port), SeriesHandler)
+    server.daemon_threads = True
+    logger.info(f"API de series en :{args.port} (caché {_cache.ttl:.0f}s, {_cache.max_entries} entradas)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""Split the polled devices between several monitor replicas.
+
+Replicas of one group register in poll_replicas and refresh their heartbeat
+every SHARD_SYNC_INTERVAL seconds; a replica whose heartbeat is older than
+SHARD_LEASE_TTL is considered dead. Devices are assigned over the live
+replicas with a consistent-hash ring (VNODES points per replica), so a replica
+joining or leaving moves only about 1/N of the devices.
+
+Owning a device also requires its row in poll_leases, renewed on every sync
+and taken over only once expired or released. A replica that stops owning a
+device on the ring releases its lease, so two replicas never poll the same
+device while the assignment changes. A replica that cannot reach MariaDB keeps
+polling only until the leases from its last successful sync expire. When a replica dies its devices move to
+the survivors after about SHARD_LEASE_TTL seconds; a clean shutdown releases
+them immediately.
+
+All times are MariaDB's NOW(3), so the replicas' clocks do not matter.
+
+Usage:
+    from shard import ShardCoordinator
+    shard = ShardCoordinator('tuya-polling')
+    owned = shard.sync(device_ids)    # set of ids this replica should poll
+    shard.leave()
+
+    python shard.py --group tuya-polling   # réplicas vivas y reparto actual
+"""
+import argparse
+import bisect
+import hashlib
+import logging
+import os
+import socket
+from collections import Counter
+
+from db_mariadb import ensure_table_once, get_pool
+
+logger = logging.getLogger(__name__)
+
+MEMBERS_TABLE = 'poll_replicas'
+LEASES_TABLE = 'poll_leases'
+VNODES = 64
+LEASE_TTL = float(os.getenv('SHARD_LEASE_TTL', 10))
+SYNC_INTERVAL = float(os.getenv('SHARD_SYNC_INTERVAL', 2))
+# Réplicas muertas que se borran de poll_replicas
+FORGET_AFTER = 3600
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent-hash ring with ``vnodes`` points per member."""
+
+    def __init__(self, members, vnodes=VNODES):
+        points = sorted((_hash(f"{member}#{i}"), member) for member in members for i in range(vnodes))
+        self._keys = [p[0] for p in points]
+        self._members = [p[1] for p in points]
+
+    def owner(self, key):
+        if not self._keys:
+            return None
+        i = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._members[i]
+
+
+def ensure_shard_tables(conn, table_name=MEMBERS_TABLE):
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table_name} (
+                group_name VARCHAR(100) NOT NULL,
+                replica_id VARCHAR(255) NOT NULL,
+                heartbeat DATETIME(3) NOT NULL,
+                started_at DATETIME(3) NOT NULL,
+                PRIMARY KEY (group_name, replica_id)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+            """
+        )
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {LEASES_TABLE} (
+                group_name VARCHAR(100) NOT NULL,
+                device_id VARCHAR(255) NOT NULL,
+                owner VARCHAR(255) NOT NULL,
+                expires_at DATETIME(3) NOT NULL,
+                PRIMARY KEY (group_name, device_id)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+            """
+        )
+    conn.commit()
+
+
+def default_replica_id():
+    """Pod name in k8s (the hostname) plus pid, so local processes differ too."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class ShardCoordinator:
+    """Membership heartbeat + ring assignment + device leases for one replica."""
+
+    def __init__(self, group='tuya-polling', replica_id=None, lease_ttl=LEASE_TTL, interval=SYNC_INTERVAL,
+                 vnodes=VNODES):
+        self.group = group
+        self.replica_id = replica_id or default_replica_id()
+        self.lease_ttl = lease_ttl
+        self.interval = interval
+        self.vnodes = vnodes
+        self.members = []
+
+    def sync(self, device_ids):
+        """Heartbeat, release devices no longer ours and renew/claim ours; returns the owned ids."""
+        device_ids = set(device_ids)
+        with get_pool().connection() as conn:
+            ensure_table_once(conn, MEMBERS_TABLE, ensure_shard_tables)
+            with conn.cursor() as cur:
+                cur.execute(f"INSERT INTO {MEMBERS_TABLE} (group_name, replica_id, heartbeat, started_at) "
+                            f"VALUES (%s, %s, NOW(3), NOW(3)) ON DUPLICATE KEY UPDATE heartbeat = NOW(3)",
+                            (self.group, self.replica_id))
+                cur.execute(f"SELECT replica_id FROM {MEMBERS_TABLE} "
+                            f"WHERE group_name = %s AND heartbeat >= NOW(3) - INTERVAL %s SECOND",
+                            (self.group, self.lease_ttl))
+                self.members = sorted(row[0] for row in cur.fetchall())
+                ring = HashRing(self.members, self.vnodes)
+                wanted = sorted(d for d in device_ids if ring.owner(d) == self.replica_id)
+
+                cur.execute(f"SELECT device_id FROM {LEASES_TABLE} WHERE group_name = %s AND owner = %s",
+                            (self.group, self.replica_id))
+                release = [row[0] for row in cur.fetchall() if row[0] not in wanted]
+                if release:
+                    cur.executemany(f"DELETE FROM {LEASES_TABLE} WHERE group_name = %s AND device_id = %s "
+                                    f"AND owner = %s", [(self.group, d, self.replica_id) for d in release])
+                if wanted:
+                    # las asignaciones se evalúan en orden: expires_at solo se renueva si
+                    # owner ya es (o acaba de pasar a ser) esta réplica
+                    cur.executemany(
+                        f"INSERT INTO {LEASES_TABLE} (group_name, device_id, owner, expires_at) "
+                        f"VALUES (%s, %s, %s, NOW(3) + INTERVAL %s SECOND) "
+                        f"ON DUPLICATE KEY UPDATE "
+                        f"owner = IF(owner = VALUES(owner) OR expires_at < NOW(3), VALUES(owner), owner), "
+                        f"expires_at = IF(owner = VALUES(owner), VALUES(expires_at), expires_at)",
+                        [(self.group, d, self.replica_id, self.lease_ttl) for d in wanted])
+                cur.execute(f"SELECT device_id FROM {LEASES_TABLE} "
+                            f"WHERE group_name = %s AND owner = %s AND expires_at > NOW(3)",
+                            (self.group, self.replica_id))
+                owned = {row[0] for row in cur.fetchall()}
+                cur.execute(f"DELETE FROM {MEMBERS_TABLE} "
+                            f"WHERE group_name = %s AND heartbeat < NOW(3) - INTERVAL %s SECOND",
+                            (self.group, FORGET_AFTER))
+            conn.commit()
+        return owned & device_ids
+
+    def leave(self):
+        """Drop this replica and its leases so the others take its devices now."""
+        with get_pool().connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"DELETE FROM {LEASES_TABLE} WHERE group_name = %s AND owner = %s",
+                            (self.group, self.replica_id))
+                cur.execute(f"DELETE FROM {MEMBERS_TABLE} WHERE group_name = %s AND replica_id = %s",
+                            (self.group, self.replica_id))
+            conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Réplicas vivas y reparto de dispositivos entre ellas")
+    parser.add_argument('--group', default=os.getenv('SHARD_GROUP', 'tuya-polling'))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    with get_pool().connection() as conn:
+        ensure_table_once(conn, MEMBERS_TABLE, ensure_shard_tables)
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT replica_id, heartbeat, heartbeat >= NOW(3) - INTERVAL %s SECOND "
+                        f"FROM {MEMBERS_TABLE} WHERE group_name = %s ORDER BY replica_id", (LEASE_TTL, args.group))
+            members = cur.fetchall()
+            cur.execute(f"SELECT owner FROM {LEASES_TABLE} WHERE group_name = %s AND expires_at > NOW(3)",
+                        (args.group,))
+            leases = Counter(row[0] for row in cur.fetchall())
+        conn.commit()
+    for replica_id, heartbeat, alive in members:
+        print(f"{replica_id:40} {'viva' if alive else 'caída':6} heartbeat={heartbeat} "
+              f"dispositivos={leases.get(replica_id, 0)}")
+    if not members:
+        print(f"Sin réplicas registradas en el grupo {args.group}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""Append-only on-disk spool for rows that could not be written to MariaDB.
+
+Rows are appended as JSON lines to segment files in ``directory`` (one
+sequential write and flush per batch, a new segment every ``segment_bytes``).
+The write-behind queue (db_writer.StatusWriter) spools a batch when MariaDB is
+unreachable and keeps spooling while anything is pending, so rows reach the
+database in the order they were read. It then replays the spool oldest segment
+first, committing each chunk together with its byte offset in spool_replay;
+after a crash the replay resumes from the committed offset, so no row is
+written twice.
+
+Disk usage is bounded by ``max_bytes``: past it the oldest segment is dropped
+(and logged) rather than filling the volume.
+
+Batches MariaDB rejects (bad data rather than a lost connection) are set aside
+in ``directory``/dead, in the same format: once the cause is fixed, moving a
+file back into ``directory`` replays it.
+
+Usage:
+    spool = Spool('spool', max_bytes=256 * 1024 * 1024)
+    spool.append(batch)
+    segment, end_offset, items = spool.read_chunk(1000, load_spool_offset)
+"""
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = '.spool'
+DEAD_LETTER_DIR = 'dead'
+
+
+def _encode(item):
+    device_name, ts, ip, origin, status_obj, readings = item
+    return (json.dumps([device_name, ts.isoformat(), ip, origin, status_obj,
+                        [list(r) for r in readings or ()]],
+                       separators=(',', ':'), default=str) + '\n').encode('utf-8')
+
+
+def _decode(line):
+    device_name, ts, ip, origin, status_obj, readings = json.loads(line)
+    return device_name, datetime.fromisoformat(ts), ip, origin, status_obj, [tuple(r) for r in readings]
+
+
+class Spool:
+    """Segment files of pending writer items, replayed in order."""
+
+    def __init__(self, directory, segment_bytes=8 * 1024 * 1024, max_bytes=256 * 1024 * 1024, fsync=False):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+        self.spool_id = self._load_id()
+        self._lock = threading.Lock()
+        # nombres de segmento, del más antiguo al más nuevo
+        self._segments = deque(sorted(os.path.basename(p)
+                                      for p in glob.glob(os.path.join(directory, '*' + SEGMENT_SUFFIX))))
+        self._sizes = {name: os.path.getsize(self._path(name)) for name in self._segments}
+        self._active = None
+        self._file = None
+        self._read_segment = None
+        self._read_offset = 0
+        self.stats = {'appended': 0, 'segments_replayed': 0, 'segments_dropped': 0, 'corrupt': 0,
+                      'dead_letter': 0}
+        if self._segments:
+            logger.info(f"Spool {directory}: {len(self._segments)} segmentos pendientes ({self.size()} bytes)")
+
+    def _load_id(self):
+        """Stable id of this spool directory; prefixes segment keys in spool_replay."""
+        path = os.path.join(self.directory, 'spool.id')
+        try:
+            with open(path) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            spool_id = uuid.uuid4().hex[:12]
+            with open(path, 'w') as f:
+                f.write(spool_id + '\n')
+            return spool_id
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _key(self, name):
+        return f"{self.spool_id}/{name}"
+
+    def pending(self):
+        return bool(self._segments)
+
+    def size(self):
+        return sum(self._sizes.values())
+
+    def segments(self):
+        return len(self._segments)
+
+    def _open_segment(self):
+        # nombre creciente y nunca reutilizado, aunque el spool se vacíe y se reinicie el proceso
+        last = int(self._segments[-1][:-len(SEGMENT_SUFFIX)]) if self._segments else 0
+        name = f"{max(time.time_ns(), last + 1):020d}{SEGMENT_SUFFIX}"
+        self._file = open(self._path(name), 'ab')
+        self._active = name
+        self._segments.append(name)
+        self._sizes[name] = 0
+
+    def _close_active(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+        self._file = None
+        self._active = None
+
+    def append(self, items):
+        """Append writer items (device_name, ts, ip, origin, status_obj, readings)."""
+        data = b''.join(_encode(item) for item in items)
+        with self._lock:
+            if self._file is None:
+                self._open_segment()
+            self._file.write(data)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._sizes[self._active] += len(data)
+            self.stats['appended'] += len(items)
+            if self._sizes[self._active] >= self.segment_bytes:
+                self._close_active()
+            self._enforce_limit()
+
+    def dead_letter(self, items, reason):
+        """Set rejected items aside in a new file under dead/; returns its path."""
+        directory = os.path.join(self.directory, DEAD_LETTER_DIR)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{time.time_ns():020d}{SEGMENT_SUFFIX}")
+        with open(path, 'wb') as f:
+            f.write(b''.join(_encode(item) for item in items))
+            f.flush()
+            os.fsync(f.fileno())
+        with self._lock:
+            self.stats['dead_letter'] += len(items)
+        logger.error(f"{len(items)} filas rechazadas por MariaDB apartadas en {path}: {reason}")
+        return path
+
+    def _enforce_limit(self):
+        while self.size() > self.max_bytes and len(self._segments) > 1:
+            name = self._segments.popleft()
+            size = self._sizes.pop(name)
+            if name == self._read_segment:
+                self._read_segment = None
+            os.remove(self._path(name))
+            self.stats['segments_dropped'] += 1
+            logger.warning(f"Spool lleno (> {self.max_bytes} bytes): descartado el segmento {name} ({size} bytes)")
+
+    def read_chunk(self, max_items, load_offset):
+        """Next items of the oldest segment as (segment_key, end_offset, items), or None.
+
+        ``load_offset(segment_key)`` returns the offset already committed for a
+        segment; it is asked once, when replay of the segment starts.
+        """
+        with self._lock:
+            if not self._segments:
+                return None
+            name = self._segments[0]
+            if name != self._read_segment:
+                self._read_offset = load_offset(self._key(name))
+                self._read_segment = name
+            offset = self._read_offset
+            size = self._sizes[name]
+            closed = name != self._active
+        items = []
+        with open(self._path(name), 'rb') as f:
+            f.seek(offset)
+            while len(items) < max_items:
+                line = f.readline()
+                if not line:
+                    break
+                if not line.endswith(b'\n'):
+                    if closed:
+                        # línea cortada por una caída a mitad de escritura
+                        self.stats['corrupt'] += 1
+                        offset = size
+                    break
+                offset += len(line)
+                try:
+                    items.append(_decode(line))
+                except (ValueError, TypeError):
+                    self.stats['corrupt'] += 1
+        return self._key(name), offset, items
+
+    def advance(self, end_offset):
+        """Record that the oldest segment was replayed up to ``end_offset``."""
+        with self._lock:
+            self._read_offset = end_offset
+
+    def pop_if_done(self):
+        """Remove the oldest segment if fully replayed; returns its key or None."""
+        with self._lock:
+            if not self._segments or self._segments[0] != self._read_segment:
+                return None
+            name = self._segments[0]
+            if self._read_offset < self._sizes[name]:
+                return None
+            if name == self._active:
+                self._close_active()
+            self._segments.popleft()
+            self._sizes.pop(name)
+            self._read_segment = None
+            os.remove(self._path(name))
+            self.stats['segments_replayed'] += 1
+            return self._key(name)
+
+    def close(self):
+        with self._lock:
+            self._close_active()
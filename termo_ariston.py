@@ -1,29 +1,33 @@
 #!/usr/bin/env python3
 
 import json
+import logging
 import os
 import getpass
 import sys
 import time
 import signal
 from aquaaristonremotethermo.aristonaqua import AquaAristonHandler
-from db_mariadb import insert_status_db
+from db_writer import get_writer
+from dps_utils import sensor_readings
+import metrics
+from broker import get_broker, start_broker_server
+from log_setup import setup_logging
 
 CREDENTIALS_FILE = 'credentials.json'
 LOG_FILE = "/var/log/termo_ariston.log"
 POLL_INTERVAL = 180  # 180 segundos
+METRICS_PORT = 9103
+BROKER_PORT = 9113
 
 # Variable de control para el daemon
 running = True
 
-def log_message(message):
-    """Escribe un mensaje en el archivo de log"""
-    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-    try:
-        with open(LOG_FILE, "a") as f:
-            f.write(f"[{timestamp}] {message}\n")
-    except Exception as e:
-        print(f"Error escribiendo log: {e}")
+logger = logging.getLogger(__name__)
+
+def log_message(message, level=logging.INFO):
+    """Encola un mensaje para el log (lo escribe el hilo de logging de log_setup)"""
+    logger.log(level, message)
 
 def signal_handler(sig, frame):
     """Manejador de señales para apagar el daemon gracefully"""
@@ -80,28 +84,31 @@ def setup_ariston_handler(username, password, boiler_type):
 # Función para imprimir los valores de los sensores
 def print_sensor_values(sensor_values):
     """
-    Imprime los valores de los sensores de manera formateada.
+    Vuelca los valores de los sensores al log de payloads (solo con LOG_LEVEL=DEBUG).
     """
-    print("POWER =", sensor_values['power']['value'])
-    print("HEATING =", sensor_values['heating']['value'])
-    print("ECO =", sensor_values['eco']['value'])
-    print("Temperatura Actual =", sensor_values['current_temperature']['value'])
-    print("Temperatura Objetivo =", sensor_values['required_temperature']['value'])
-    print("Tiempo requerido =", sensor_values['remaining_time']['value'])
-    print("Duchas Disponibles =", sensor_values['showers']['value'])
-    print("Modo =", sensor_values['mode']['value'])
-    print("-" * 40)  # Separador para mejor legibilidad
+    payloads = logging.getLogger('payloads')
+    if not payloads.isEnabledFor(logging.DEBUG):
+        return
+    labels = (("POWER", 'power'), ("HEATING", 'heating'), ("ECO", 'eco'),
+              ("Temperatura Actual", 'current_temperature'), ("Temperatura Objetivo", 'required_temperature'),
+              ("Tiempo requerido", 'remaining_time'), ("Duchas Disponibles", 'showers'), ("Modo", 'mode'))
+    payloads.debug("termo:" + "".join(f"\n  {label} = {sensor_values.get(key, {}).get('value')}"
+                                      for label, key in labels))
 
 # Función principal del daemon
 def main():
     """Función principal que corre como daemon"""
     global running
     
+    setup_logging(LOG_FILE)
+
     # Registrar manejadores de señales
     signal.signal(signal.SIGTERM, signal_handler)
     signal.signal(signal.SIGINT, signal_handler)
     
     log_message("Daemon termo iniciado")
+    metrics.start_metrics_server(METRICS_PORT)
+    start_broker_server(BROKER_PORT)
     
     # Obtener credenciales
     try:
@@ -128,10 +135,15 @@ def main():
         # Bucle principal - consulta el termo cada POLL_INTERVAL segundos
         while running:
             try:
-                sensor_values = api_instance.sensor_values
+                with metrics.timed(metrics.DEVICE_ROUNDTRIP, "termo", "sensor_values"):
+                    sensor_values = api_instance.sensor_values
+                metrics.packet("termo")
+                metrics.reading_ok("termo")
                 
                 # Guardar en base de datos
-                insert_status_db("termo", sensor_values, origin='ariston_daemon')
+                readings = sensor_readings(sensor_values)
+                get_writer().enqueue("termo", sensor_values, origin='ariston_daemon', readings=readings)
+                get_broker().publish("termo", readings)
                 
                 # Mostrar valores en consola
                 print_sensor_values(sensor_values)
@@ -145,9 +157,8 @@ def main():
                 time.sleep(POLL_INTERVAL)
                 
             except Exception as e:
-                msg = f"Error consultando sensores: {e}"
-                log_message(msg)
-                print(msg)
+                metrics.error("termo")
+                log_message(f"Error consultando sensores: {e}", logging.ERROR)
                 # Reintentar después de un tiempo
                 time.sleep(10)
 
@@ -164,6 +175,8 @@ def main():
             log_message("Conexión con Ariston cerrada")
         except Exception as e:
             log_message(f"Error cerrando conexión: {e}")
+        # Vaciar la cola de escritura antes de salir
+        get_writer().stop()
 
 # Punto de entrada del programa
 if __name__ == "__main__":
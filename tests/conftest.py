@@ -0,0 +1,5 @@
+import os
+import sys
+
+# los módulos del proyecto están en la raíz del repositorio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
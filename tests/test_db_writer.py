@@ -0,0 +1,113 @@
+"""StatusWriter against a fake insert_rows: rejected batches go to dead/, the rest keeps flowing."""
+import glob
+import os
+from datetime import datetime
+
+import pymysql
+import pytest
+
+import db_writer
+from db_writer import StatusWriter
+from spool import DEAD_LETTER_DIR, Spool
+
+
+class FakeDB:
+    """insert_rows stand-in: rejects rows of device 'bad' like a missing partition (1526)."""
+
+    def __init__(self):
+        self.rows = []
+        self.checkpoints = {}
+        self.down = False
+
+    def insert_rows(self, rows, table_name, readings=None, checkpoint=None):
+        if self.down:
+            raise pymysql.err.OperationalError(2003, "Can't connect to MySQL server")
+        if any(row[0] == 'bad' for row in rows):
+            raise pymysql.err.OperationalError(1526, "Table has no partition for value 0")
+        self.rows.extend(rows)
+        if checkpoint:
+            self.checkpoints[checkpoint[0]] = checkpoint[1]
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = FakeDB()
+    monkeypatch.setattr(db_writer, 'load_spool_offset', lambda segment: db.checkpoints.get(segment, 0))
+    monkeypatch.setattr(db_writer, 'save_spool_offset', lambda segment, offset: db.checkpoints.__setitem__(segment, offset))
+    monkeypatch.setattr(db_writer, 'delete_spool_checkpoint', lambda segment: db.checkpoints.pop(segment, None))
+    return db
+
+
+def _item(device_name):
+    return (device_name, datetime(2026, 1, 1, 12, 0), '10.0.0.5', 'polling', {'dps': {'1': 20}},
+            [('1', 'va_temperature', 20.0, 'C')])
+
+
+def _writer(db, spool):
+    return StatusWriter(insert_rows=db.insert_rows, spool=spool, batch_size=1, max_latency=0.05,
+                        stats_interval=0, replay_batch=1, retry_interval=0)
+
+
+def _dead_devices(directory):
+    devices = []
+    for path in sorted(glob.glob(os.path.join(directory, DEAD_LETTER_DIR, '*.spool'))):
+        with open(path) as f:
+            devices.extend(line.split('"')[1] for line in f)
+    return devices
+
+
+def _drain(writer):
+    for _ in range(100):
+        if not writer.spool.pending():
+            return
+        writer._replay()
+    raise AssertionError("el spool no se vacía")
+
+
+def test_rejected_batch_is_dead_lettered_and_good_batch_written(db, tmp_path):
+    writer = _writer(db, Spool(str(tmp_path)))
+    writer.start()
+    writer.enqueue('bad', {'dps': {}}, readings=[])
+    writer.enqueue('good', {'dps': {}}, readings=[])
+    writer.stop()
+
+    assert [row[0] for row in db.rows] == ['good']
+    assert _dead_devices(str(tmp_path)) == ['bad']
+    # el lote rechazado no pasa al spool ni bloquea los siguientes
+    assert not writer.spool.pending()
+    assert writer.stats()['failed'] == 1
+
+
+def test_disconnect_spools_and_rejected_chunk_does_not_block_replay(db, tmp_path):
+    writer = _writer(db, Spool(str(tmp_path)))
+    db.down = True
+    for device_name in ('good1', 'bad', 'good2'):
+        writer._flush([_item(device_name)])
+    assert db.rows == []
+    assert _dead_devices(str(tmp_path)) == []
+
+    db.down = False
+    _drain(writer)
+
+    assert [row[0] for row in db.rows] == ['good1', 'good2']
+    assert _dead_devices(str(tmp_path)) == ['bad']
+    assert db.checkpoints == {}
+
+
+def test_resume_after_crash_mid_spool(db, tmp_path):
+    spool = Spool(str(tmp_path))
+    for device_name in ('good1', 'bad', 'good2'):
+        spool.append([_item(device_name)])
+    spool.close()
+    # caída tras confirmar el primer tramo: filas y posición en la misma transacción
+    first = Spool(str(tmp_path))
+    segment, end_offset, items = first.read_chunk(1, db_writer.load_spool_offset)
+    db.insert_rows([item[:5] for item in items], 'device_status', checkpoint=(segment, end_offset))
+
+    writer = _writer(db, Spool(str(tmp_path)))
+    _drain(writer)
+
+    assert [row[0] for row in db.rows] == ['good1', 'good2']
+    assert _dead_devices(str(tmp_path)) == ['bad']
+    assert db.checkpoints == {}
+    assert glob.glob(os.path.join(str(tmp_path), '*.spool')) == []
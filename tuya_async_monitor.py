@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# TinyTuya async monitor - Monitors every device in devices.monitor.json from one process
+# -*- coding: utf-8 -*-
+"""Single-process polling engine for all devices in devices.monitor.json.
+
+Each device runs as an asyncio task with its own persistent tinytuya socket,
+heartbeat timer (KEEPALIVE_TIMER) and optional status timer (STATUS_TIMER).
+The event loop waits for socket readability, so idle devices cost nothing but
+a file descriptor; the few blocking tinytuya calls (connect, status, heartbeat,
+reading an already-arrived packet) run in a small thread pool. A device that
+fails is reconnected on its own without touching the others.
+
+With --status the status interval of each device adapts to how fast its values
+change (poll_scheduler.PollSchedule); failures back off exponentially with
+jitter, and at most MAX_CONCURRENT device requests are in flight at once.
+
+With --shard (or POLL_SHARDING=1) several replicas split the devices between
+them through leases in MariaDB (shard.ShardCoordinator); each replica only
+runs the monitors of the devices it currently holds.
+
+Usage: ./tuya_async_monitor.py [--status] [--shard] [nombre_dispositivo ...]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import tinytuya
+
+import metrics
+from broker import get_broker, start_broker_server
+from change_filter import get_change_filter
+from db_writer import get_writer
+from device_registry import get_registry
+from discovery_cache import get_discovery_cache
+from dps_utils import decode_readings
+from log_setup import get_payload_log, setup_logging
+from poll_scheduler import PollSchedule, jittered
+from shard import ShardCoordinator
+
+STATUS_TIMER = 30
+KEEPALIVE_TIMER = 12
+METRICS_PORT = 9101
+# Lecturas en vivo (SSE, broker.py)
+BROKER_PORT = 9111
+# Peticiones simultaneas a dispositivos (conexion, status, heartbeat)
+MAX_CONCURRENT = int(os.getenv('TUYA_MAX_CONCURRENT', 8))
+
+# Logs asincronos (cola + un hilo escritor) con rotacion en /var/log
+log_file = "/var/log/tuya_async_monitor.log"
+setup_logging(log_file)
+logger = logging.getLogger(__name__)
+payload_log = get_payload_log()
+
+
+class DeviceMonitor:
+    """Monitor loop for a single Tuya device inside the shared event loop."""
+
+    def __init__(self, device_info, executor, status_timer=None, registry=None, limiter=None):
+        self.device_info = device_info
+        self.registry = registry
+        self.name = device_info.get('name')
+        self.dev_id = device_info.get('id')
+        self.key = device_info.get('key')
+        self.ip = device_info.get('ip') or 'Auto'
+        self.version = device_info.get('version', '3.3')
+        self.status_timer = device_info.get('status_timer', status_timer)
+        self.schedule = PollSchedule.for_device(device_info, self.status_timer or STATUS_TIMER)
+        self.executor = executor
+        # limita las peticiones simultaneas de todos los dispositivos
+        self.limiter = limiter
+        self.device = None
+
+    async def _call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def _request(self, command, func, *args):
+        """Blocking device request in the pool, timed as a device round-trip."""
+        if self.limiter is None:
+            with metrics.timed(metrics.DEVICE_ROUNDTRIP, self.name, command):
+                return await self._call(func, *args)
+        async with self.limiter:
+            with metrics.timed(metrics.DEVICE_ROUNDTRIP, self.name, command):
+                return await self._call(func, *args)
+
+    async def _wait_readable(self, timeout):
+        """Wait until the device socket has data or ``timeout`` seconds pass."""
+        sock = self.device.socket if self.device else None
+        if sock is None or timeout <= 0:
+            return False
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        fd = sock.fileno()
+        loop.add_reader(fd, lambda: ready.done() or ready.set_result(True))
+        try:
+            await asyncio.wait_for(ready, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            loop.remove_reader(fd)
+
+    async def _open(self, address, version):
+        self.device = await self._request('connect',
+            lambda: tinytuya.Device(self.dev_id, address, self.key, version=float(version), persist=True))
+        return await self._request('status', self.device.status)
+
+    async def _connect(self):
+        cache = get_discovery_cache()
+        loop = asyncio.get_running_loop()
+        # la caché lee y escribe en MariaDB: fuera del event loop
+        cached = await loop.run_in_executor(self.executor, cache.get, self.dev_id) or {}
+        address = cached.get('ip') or self.device_info.get('ip')
+        version = cached.get('version') or self.version
+        data = None
+        if address:
+            logger.info(f"Conectando con {self.name} (id={self.dev_id} ip={address} version={version})")
+            data = await self._open(address, version)
+            if data and 'Err' in data:
+                logger.warning(f"{self.name} no responde en {address} (v{version}): {data.get('Error')}. Buscando en la red")
+                self.device.close()
+                await loop.run_in_executor(self.executor, cache.forget, self.dev_id)
+        if not address or (data and 'Err' in data):
+            # Setting the address to 'Auto' triggers a scan which can take up to 8 seconds
+            logger.info(f"Buscando {self.name} en la red (id={self.dev_id} version={self.version})")
+            data = await self._open('Auto', self.version)
+        if data and 'Err' in data:
+            logger.warning(f"Status request returned an error for {self.name}. "
+                           f"Version: {self.device.version}, Local Key: {self.device.local_key}")
+        else:
+            self.ip = self.device.address
+            await loop.run_in_executor(self.executor, cache.update, self.dev_id, self.device.address,
+                                       self.device.version)
+        self._handle(data, 'Initial Status')
+
+    def _handle(self, data, label='Received Payload'):
+        """Print and queue a payload. Returns False if the device answered with an error."""
+        if not data:
+            return True
+        if self.registry is not None:
+            # recoge cambios del mapping si se edito devices.monitor.json
+            self.device_info = self.registry.by_name(self.name) or self.device_info
+        metrics.packet(self.name)
+        payload_log(self.name, data, self.device_info, label)
+        if 'Error' in data:
+            metrics.error(self.name)
+            logger.warning(f"Received error for {self.name}: {data.get('Error')}")
+            return False
+        metrics.reading_ok(self.name)
+        if 'dps' not in data:
+            self.schedule.ok()
+            return True
+        changed = get_change_filter().should_store(self.name, data, self.device_info)
+        self.schedule.observe(changed)
+        if not changed:
+            return True
+        with metrics.timed(metrics.DECODE):
+            readings = decode_readings(data, self.device_info)
+        get_writer().enqueue(self.name, data, ip=self.ip, origin='polling', readings=readings)
+        get_broker().publish(self.name, readings)
+        return True
+
+    async def _loop(self):
+        heartbeat_time = time.monotonic() + jittered(KEEPALIVE_TIMER)
+        status_time = time.monotonic() + self.schedule.next_delay() if self.status_timer else None
+        while True:
+            now = time.monotonic()
+            if status_time and now >= status_time:
+                data = await self._request('status', self.device.status)
+                heartbeat_time = time.monotonic() + jittered(KEEPALIVE_TIMER)
+            elif now >= heartbeat_time:
+                data = await self._request('heartbeat', self.device.heartbeat, False)
+                heartbeat_time = time.monotonic() + jittered(KEEPALIVE_TIMER)
+            else:
+                # no need to send anything, just wait for an asynchronous update
+                next_event = min(t for t in (heartbeat_time, status_time) if t)
+                if self.device.socket is None:
+                    # socket cerrado tras un error: forzar reconexion con un status
+                    metrics.reconnect(self.name)
+                    data = await self._request('status', self.device.status)
+                elif await self._wait_readable(next_event - now):
+                    data = await self._call(self.device.receive)
+                else:
+                    continue
+            if not self._handle(data):
+                delay = self.schedule.error_delay()
+                logger.warning(f"{self.name}: reintento en {delay:.1f}s (fallo {self.schedule.errors} seguido)")
+                await asyncio.sleep(delay)
+            if status_time and (now >= status_time or (data and 'dps' in data)):
+                # un cambio recibido de forma asincrona tambien cuenta como lectura
+                status_time = time.monotonic() + self.schedule.next_delay()
+
+    async def run(self):
+        """Run forever, reconnecting this device on any failure."""
+        # arranque escalonado: no conectar todos los dispositivos a la vez
+        await asyncio.sleep(self.schedule.first_delay() if self.status_timer else jittered(1.0, 1.0))
+        while True:
+            try:
+                if self.device is None:
+                    await self._connect()
+                await self._loop()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metrics.error(self.name)
+                metrics.reconnect(self.name)
+                delay = self.schedule.error_delay()
+                logger.error(f"Error en el monitor de {self.name}: {e}. Reconectando en {delay:.1f}s")
+                if self.device is not None:
+                    self.device.close()
+                self.device = None
+                await asyncio.sleep(delay)
+
+    def close(self):
+        if self.device is not None:
+            self.device.close()
+
+
+async def run_monitors(devices, status_timer=None, registry=None, max_concurrent=MAX_CONCURRENT, shard=None):
+    """Monitor every device, or with ``shard`` only those this replica holds the lease for."""
+    # Un hilo por dispositivo como maximo para las llamadas bloqueantes de tinytuya
+    executor = ThreadPoolExecutor(max_workers=max(4, len(devices)), thread_name_prefix='tuya')
+    limiter = asyncio.Semaphore(max_concurrent) if max_concurrent else None
+    by_id = {info.get('id') or info.get('name'): info for info in devices}
+    running = {}
+
+    def start(dev_id):
+        monitor = DeviceMonitor(by_id[dev_id], executor, status_timer, registry, limiter)
+        running[dev_id] = (monitor, asyncio.create_task(monitor.run(), name=monitor.name))
+
+    async def stop(dev_id):
+        monitor, task = running.pop(dev_id)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        monitor.close()
+
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+
+    try:
+        if shard is None:
+            for dev_id in by_id:
+                start(dev_id)
+            logger.info(f"Monitorizando {len(running)} dispositivo(s) en un solo proceso")
+            await stopping.wait()
+        else:
+            logger.info(f"Réplica {shard.replica_id} del grupo {shard.group}: {len(by_id)} dispositivo(s) a repartir")
+            # Hasta cuando son nuestros los leases renovados en el ultimo sync correcto
+            leases_until = None
+            while not stopping.is_set():
+                started = time.monotonic()
+                try:
+                    # un sync colgado no puede alargar el sondeo mas alla de los leases
+                    timeout = max(leases_until - started, 0.1) if leases_until and running else None
+                    owned = await asyncio.wait_for(loop.run_in_executor(None, shard.sync, list(by_id)), timeout)
+                    leases_until = started + shard.lease_ttl
+                except Exception as e:
+                    logger.error(f"Error sincronizando el reparto de dispositivos: {e!r}")
+                    if leases_until is not None and time.monotonic() < leases_until:
+                        # los leases siguen vigentes: nadie mas puede tomar estos dispositivos
+                        owned = set(running)
+                    else:
+                        # caducados: otra réplica puede haberlos tomado, dejar de sondearlos
+                        if running:
+                            logger.warning(f"Leases caducados sin sincronizar: se detienen {len(running)} "
+                                           f"dispositivo(s)")
+                        owned = set()
+                lost, gained = set(running) - owned, owned - set(running)
+                for dev_id in lost:
+                    await stop(dev_id)
+                for dev_id in gained:
+                    start(dev_id)
+                if lost or gained:
+                    logger.info(f"Reparto: {len(running)}/{len(by_id)} dispositivo(s) en esta réplica "
+                                f"({len(shard.members)} réplica(s) vivas, +{len(gained)} -{len(lost)})")
+                metrics.SHARD_DEVICES.set(len(running))
+                try:
+                    await asyncio.wait_for(stopping.wait(), jittered(shard.interval))
+                except asyncio.TimeoutError:
+                    pass
+    finally:
+        for dev_id in list(running):
+            await stop(dev_id)
+        if shard is not None:
+            try:
+                await loop.run_in_executor(None, shard.leave)
+            except Exception as e:
+                logger.warning(f"No se pudieron liberar los leases de {shard.replica_id}: {e}")
+        executor.shutdown(wait=False, cancel_futures=True)
+        logger.info("Monitores detenidos")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Monitor de todos los dispositivos de devices.monitor.json")
+    parser.add_argument('names', nargs='*', help="Nombres de dispositivo (por defecto, todos)")
+    parser.add_argument('--status', action='store_true',
+                        help=f"Pedir status cada {STATUS_TIMER}s ademas del heartbeat")
+    parser.add_argument('--devices-file', default='devices.monitor.json')
+    parser.add_argument('--shard', action='store_true', default=os.getenv('POLL_SHARDING') == '1',
+                        help="Repartir los dispositivos entre las réplicas del grupo SHARD_GROUP (leases en MariaDB)")
+    args = parser.parse_args()
+
+    registry = get_registry(args.devices_file)
+    devices = registry.devices()
+    if args.names:
+        devices = [d for d in devices if d.get('name') in args.names]
+    if not devices:
+        logger.error(f"No se encontraron dispositivos en {args.devices_file}")
+        sys.exit(1)
+
+    metrics.start_metrics_server(METRICS_PORT)
+    start_broker_server(BROKER_PORT)
+    shard = ShardCoordinator(os.getenv('SHARD_GROUP', 'tuya-polling')) if args.shard else None
+    asyncio.run(run_monitors(devices, STATUS_TIMER if args.status else None, registry, shard=shard))
+    get_writer().stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Long-lived listener for Tuya UDP broadcasts.
+
+Tuya devices announce themselves every few seconds on UDP 6666 (3.1, plain),
+6667 (3.3+, encrypted) and 7000 (app/3.5). Instead of running
+tinytuya.deviceScan() in a loop, which collects a whole scan window before
+returning anything, this keeps the three sockets open and decodes each packet
+as it arrives.
+
+Repeated broadcasts are deduplicated per gwId: a device is emitted when it is
+first seen, when its IP or version changes, or again once ``repeat_interval``
+seconds have passed since it was last emitted.
+
+Usage:
+    from tuya_broadcast_listener import BroadcastListener
+    for bcast in BroadcastListener().packets():
+        print(bcast['gwId'], bcast['ip'], bcast['version'])
+"""
+import json
+import logging
+import selectors
+import socket
+import time
+
+import tinytuya
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_PORTS = (tinytuya.UDPPORT, tinytuya.UDPPORTS, tinytuya.UDPPORTAPP)
+
+
+class BroadcastListener:
+    """Decode Tuya broadcasts from all broadcast ports as a stream."""
+
+    def __init__(self, ports=BROADCAST_PORTS, repeat_interval=30.0):
+        self.ports = ports
+        self.repeat_interval = repeat_interval
+        self._selector = selectors.DefaultSelector()
+        self._sockets = []
+        # gwId -> (ip, version, monotonic time of last emit)
+        self._seen = {}
+        self.stats = {'received': 0, 'invalid': 0, 'duplicates': 0, 'emitted': 0}
+
+    def open(self):
+        for port in self.ports:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            except (AttributeError, OSError):
+                # SO_REUSEPORT not available
+                pass
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            sock.bind(("", port))
+            sock.setblocking(False)
+            self._selector.register(sock, selectors.EVENT_READ, port)
+            self._sockets.append(sock)
+        logger.info(f"Escuchando broadcasts Tuya en UDP {', '.join(str(p) for p in self.ports)}")
+
+    def close(self):
+        for sock in self._sockets:
+            try:
+                self._selector.unregister(sock)
+            except Exception:
+                pass
+            sock.close()
+        self._sockets = []
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @staticmethod
+    def decode(data, addr_ip=None):
+        """Decode one raw UDP packet into the broadcast dict, or None if it is not a device broadcast."""
+        try:
+            result = json.loads(tinytuya.decrypt_udp(data))
+        except Exception:
+            return None
+        if not isinstance(result, dict) or result.get('from') == 'app' or 'gwId' not in result:
+            return None
+        if addr_ip and not result.get('ip'):
+            result['ip'] = addr_ip
+        result['origin'] = 'broadcast'
+        return result
+
+    def _is_new(self, bcast, now):
+        """Dedup check; records the broadcast if it is going to be emitted."""
+        gw_id = bcast['gwId']
+        ip, version = bcast.get('ip'), bcast.get('version')
+        seen = self._seen.get(gw_id)
+        if seen is not None and seen[0] == ip and seen[1] == version and now - seen[2] < self.repeat_interval:
+            return False
+        self._seen[gw_id] = (ip, version, now)
+        return True
+
+    def poll(self, timeout=None):
+        """Wait up to ``timeout`` seconds and return the new (deduplicated) broadcasts."""
+        out = []
+        for key, _ in self._selector.select(timeout):
+            sock = key.fileobj
+            while True:
+                try:
+                    data, addr = sock.recvfrom(4048)
+                except (BlockingIOError, InterruptedError):
+                    break
+                self.stats['received'] += 1
+                bcast = self.decode(data, addr[0])
+                if bcast is None:
+                    self.stats['invalid'] += 1
+                    logger.debug(f"Paquete UDP no valido desde {addr[0]} puerto {key.data}")
+                    continue
+                if not self._is_new(bcast, time.monotonic()):
+                    self.stats['duplicates'] += 1
+                    continue
+                self.stats['emitted'] += 1
+                out.append(bcast)
+        return out
+
+    def packets(self):
+        """Generator of deduplicated broadcasts, yielded as they arrive."""
+        if not self._sockets:
+            self.open()
+        while True:
+            for bcast in self.poll(1.0):
+                yield bcast
@@ -1,93 +1,151 @@
+import logging
+import os
 import tinytuya
-import json
+import threading
 import time
-import sys
-from dps_utils import load_device_info_by_id, print_dps
-from db_mariadb import insert_status_db
+from collections import deque
+import metrics
+from broker import get_broker, start_broker_server
+from dps_utils import decode_readings
+from log_setup import get_payload_log, setup_logging
+from device_registry import get_registry
+from discovery_cache import get_discovery_cache
+from db_writer import get_writer
+from change_filter import get_change_filter
+from tuya_broadcast_listener import BroadcastListener
 
 # Configurar logs
 LOG_FILE = "/var/log/tinituya_brodcast_monitor_d.log"
+# Segundos mínimos entre dos consultas de estado al mismo dispositivo
+REPEAT_INTERVAL = 30
+POLL_WORKERS = 4
+# Broadcasts pendientes de consultar; si se llena (tormenta de broadcasts) se descartan los más antiguos
+POLL_QUEUE = int(os.getenv('BROADCAST_POLL_QUEUE', 256))
+METRICS_PORT = 9102
+BROKER_PORT = 9112
+# Fichero de dispositivos (devices.sim.json para las pruebas de carga con benchmarks.fake_devices)
+DEVICES_FILE = os.getenv('TUYA_DEVICES_FILE', 'devices.json')
 
-# Función para escribir logs
-def log_message(message):
-    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-    try:
-        with open(LOG_FILE, "a") as f:
-            f.write(f"[{timestamp}] {message}\n")
-    except PermissionError:
-        print(f"Error: Permiso denegado al escribir en {LOG_FILE}")
-    except Exception as e:
-        print(f"Error escribiendo log: {e}")
+# Logs asincronos: consola + fichero con rotacion, escritos desde un solo hilo
+setup_logging(LOG_FILE)
+logger = logging.getLogger(__name__)
+payload_log = get_payload_log()
+
+# Función para escribir logs (no bloquea: solo encola el mensaje)
+def log_message(message, level=logging.INFO):
+    logger.log(level, message)
 
-print(" Monitor Tuya iniciado. Escuchando cambios en la red...")
 log_message("Monitor Tuya iniciado. Escuchando cambios en la red...")
 
-def monitor():
-    # El modo monitor escucha los paquetes 'broadcast' de estado
-    # No requiere Local Key para detectar QUE algo cambió
-    
-    # Cargar mapeos de dispositivos
+def poll_status(bcast, device_info):
+    """Pide el estado (dps) a un dispositivo que acaba de anunciarse por broadcast"""
+    version = bcast.get('version') or device_info.get('version') or 3.3
+    d = tinytuya.Device(bcast['gwId'], bcast['ip'], device_info.get('key'), version=float(version))
     try:
-        with open('devices.json', 'r') as f:
-            all_devices = json.load(f)
-    except FileNotFoundError:
-        all_devices = []
-        msg = "Warning: devices.json no encontrado. Mostrando datos sin procesar."
-        print(msg)
-        log_message(msg)
-    
-    while True:
-        try:
-            # Buscamos dispositivos en la red de forma continua
-            devices = tinytuya.deviceScan()
-            
-            for ip in devices:
-                dev = devices[ip]
-                print(dev)
-                # Solo imprimimos si el dispositivo envió datos de estado (dps)
-                if 'dps' in dev and dev['dps']:
-                    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-                    gwId = dev['gwId']
-                    device_info=load_device_info_by_id(gwId)
-                    if not device_info:
-                        msg = f"Device id '{gwId}' not found in devices.json"
-                        print(msg)
-                        log_message(msg)
-                        sys.exit(1)
-                    DEVICE_NAME = device_info.get('name')
+        with metrics.timed(metrics.DEVICE_ROUNDTRIP, device_info.get('name'), 'status'):
+            return d.status()
+    finally:
+        d.close()
 
-                    #print("--------")
-                    ##print(dev)
-                    #print("--------")
-                    #print( dev['dps'])
 
+def process_device(dev, device_info):
+    """Consulta el estado de un dispositivo anunciado, lo muestra y lo encola para MariaDB"""
+    try:
+        DEVICE_NAME = device_info.get('name')
+        DPS = poll_status(dev, device_info)
+        metrics.packet(DEVICE_NAME)
+        if DPS and 'Error' in DPS:
+            metrics.error(DEVICE_NAME)
+        # Solo imprimimos si el dispositivo envió datos de estado (dps)
+        if not DPS or 'dps' not in DPS or not DPS['dps']:
+            return
+        metrics.reading_ok(DEVICE_NAME)
 
-                    
-                    # Mostrar en pantalla
-                    msg = f"Cambio detectado en {gwId} = {DEVICE_NAME} ({ip})"
-                    print(f"\n[{timestamp}] {msg}")
-                    log_message(msg)
-                    print("-" * 50)
+        # Volcado del payload solo con LOG_LEVEL=DEBUG y limitado por dispositivo
+        payload_log(DEVICE_NAME, DPS, device_info, f"Cambio detectado en {dev['gwId']} ({dev['ip']})")
 
-                    DPS = dev['dps']
-                    print_dps(DPS, device_info, DEVICE_NAME)
-                    # Buscar device info y mostrar datos formateados
+        # Se descartan lecturas repetidas o dentro de la banda muerta
+        if not get_change_filter().should_store(DEVICE_NAME, DPS, device_info):
+            return
+        with metrics.timed(metrics.DECODE):
+            readings = decode_readings(DPS, device_info)
+        get_writer().enqueue(DEVICE_NAME, DPS, ip=dev['ip'], origin=dev['origin'], readings=readings)
+        get_broker().publish(DEVICE_NAME, readings)
+    except Exception as e:
+        metrics.error(device_info.get('name'))
+        log_message(f"Error consultando {dev.get('gwId')} ({dev.get('ip')}): {e}", logging.WARNING)
 
-                    insert_status_db(DEVICE_NAME, DPS, ip=dev['ip'], origin=dev['origin'])
 
-                    
+class PollQueue:
+    """Bounded drop-oldest queue of announced devices, drained by ``workers`` threads."""
 
-                        
+    def __init__(self, workers=POLL_WORKERS, size=POLL_QUEUE):
+        self._items = deque(maxlen=size)
+        self._cond = threading.Condition()
+        self.dropped = 0
+        for i in range(workers):
+            threading.Thread(target=self._run, name=f'tuya-poll-{i}', daemon=True).start()
+
+    def put(self, dev, device_info):
+        with self._cond:
+            if len(self._items) == self._items.maxlen:
+                self.dropped += 1
+                metrics.BROADCAST_DROPPED.inc()
+                if self.dropped % 100 == 1:
+                    log_message(f"Cola de consultas llena ({self._items.maxlen}): {self.dropped} broadcasts descartados",
+                                logging.WARNING)
+            self._items.append((dev, device_info))
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._items:
+                    self._cond.wait()
+                dev, device_info = self._items.popleft()
+            process_device(dev, device_info)
+
+
+def monitor():
+    # El modo monitor escucha los paquetes 'broadcast' de los dispositivos de forma continua
+    # y consulta el estado de cada uno según se anuncia (sin esperar a una ventana de scan)
+    
+    # Cargar mapeos de dispositivos (el registro se recarga solo si cambia devices.json)
+    registry = get_registry(DEVICES_FILE)
+    discovery = get_discovery_cache()
+    metrics.start_metrics_server(METRICS_PORT)
+    start_broker_server(BROKER_PORT)
+    if not registry.devices():
+        log_message(f"Warning: {DEVICES_FILE} no encontrado. Mostrando datos sin procesar.", logging.WARNING)
+    # el writer se crea aquí, en el hilo principal, para que instale el manejador de SIGTERM
+    # (docker/k8s stop) y vacíe su cola al salir; desde un hilo tuya-poll no podría
+    get_writer()
+    pending = PollQueue()
+    
+    while True:
+        try:
+            with BroadcastListener(repeat_interval=REPEAT_INTERVAL) as listener:
+                for dev in listener.packets():
+                    logger.debug(f"Broadcast: {dev}")
+                    gwId = dev['gwId']
+                    # IP y versión para que los monitores conecten sin escanear; MariaDB se actualiza
+                    # desde otro hilo para no frenar la recepción de broadcasts si no responde
+                    discovery.update(gwId, dev.get('ip'), dev.get('version'), background=True)
+                    if registry.is_unknown(gwId):
+                        # dispositivo desconocido ya notificado: se ignora
+                        continue
+                    device_info = registry.by_id(gwId)
+                    if not device_info:
+                        log_message(f"Device id '{gwId}' not found in {DEVICES_FILE}, ignorado hasta que cambie el fichero",
+                                    logging.WARNING)
+                        continue
+                    pending.put(dev, device_info)
         except KeyboardInterrupt:
-            msg = "Monitor detenido por el usuario."
-            print(f"\n{msg}")
-            log_message(msg)
+            log_message("Monitor detenido por el usuario.")
             break
         except Exception as e:
-            msg = f"Error: {e}"
-            print(msg)
-            log_message(msg)
+            log_message(f"Error: {e}", logging.ERROR)
             time.sleep(2) # Pausa breve antes de reintentar
 
 if __name__ == "__main__":
-    monitor()
\ No newline at end of file
+    monitor()
@@ -1,6 +1,6 @@
 #!/bin/sh
 # Demonio que ejecuta monitores para todos los dispositivos Tuya
-# Este script lanza generic_monitor_d.py para cada dispositivo en devices.monitor.json
+# Este script lanza tuya_async_monitor.py, que monitoriza todos los dispositivos de devices.monitor.json
 
 # Directorio de logs
 LOG_DIR="/var/log"
@@ -50,30 +50,14 @@ cleanup() {
 # Capturar SIGTERM (desde systemd) e SIGINT (Ctrl+C)
 trap cleanup SIGTERM SIGINT
 
-# Ejecuta ./generic_monitor_d.py <name> para cada dispositivo listado en devices.monitor.json
-# Lanza todos los procesos en paralelo (cada uno ejecuta su loop de monitoreo independiente)
+# Ejecuta tuya_async_monitor.py, que monitoriza en un solo proceso (un event loop)
+# todos los dispositivos listados en devices.monitor.json
 run_all_device_monitors(){
-  # extrae la lista de nombres desde devices.monitor.json usando jq
-  if ! command -v jq >/dev/null 2>&1; then
-    log "ERROR" "jq no está instalado. Instálalo (por ejemplo: sudo apt install jq)"
-    return 1
-  fi
-
   if [ ! -f devices.monitor.json ]; then
     log "ERROR" "No se encontró devices.monitor.json en $(pwd)"
     return 1
   fi
 
-  names=$(jq -r '.[].name // empty' devices.monitor.json)
-
-  if [ -z "$names" ]; then
-    log "ERROR" "No se encontraron dispositivos en devices.monitor.json"
-    return 1
-  fi
-
-  count=$(echo "$names" | wc -l)
-  log "INFO" "Se encontraron $count dispositivo(s)"
-
   # Detener procesos anteriores si los hay
   for pid in $CHILD_PIDS; do
     if kill -0 "$pid" 2>/dev/null; then
@@ -82,24 +66,23 @@ run_all_device_monitors(){
   done
   CHILD_PIDS=""
 
-  for name in $names; do
-    log "INFO" "Lanzando monitor para dispositivo: $name"
-    ./tuya_polling_monitor.py "$name" >> "$LOG_FILE" 2>&1 &
-    new_pid=$!
-    CHILD_PIDS="$CHILD_PIDS $new_pid"
-    log "INFO" "Monitor para '$name' lanzado con PID: $new_pid"
-  done
-
-  # Esperar a todos los procesos de monitoreo (cada uno tiene su propio loop infinito)
-  for pid in $CHILD_PIDS; do
-    wait "$pid" || true
-  done
+  log "INFO" "Lanzando monitor único para todos los dispositivos"
+  # El monitor escribe su propio log con rotación (/var/log/tuya_async_monitor.log);
+  # su salida va a la consola (docker/kubectl logs) en lugar de a un fichero sin límite
+  python3 ./tuya_async_monitor.py "$@" &
+  new_pid=$!
+  CHILD_PIDS="$new_pid"
+  log "INFO" "Monitor lanzado con PID: $new_pid"
+
+  # Cada dispositivo se reconecta por su cuenta dentro del proceso; solo se
+  # reinicia todo si el propio proceso termina
+  wait "$new_pid" || true
 }
 
 # loop principal: correr continuamente
 log "INFO" "Iniciando loop principal de monitoreo..."
 while true; do
-  run_all_device_monitors
+  run_all_device_monitors "$@"
   log "WARNING" "Se perdió la conexión con los monitores o hubo un error. Reiniciando en 5 segundos..."
   sleep 5
 done
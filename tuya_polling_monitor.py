@@ -7,40 +7,29 @@ import time
 import json
 import sys
 import logging
-import os
-from db_mariadb import insert_status_db
-from dps_utils import print_dps, load_device_info_polling
+import metrics
+from db_writer import get_writer
+from change_filter import get_change_filter
+from dps_utils import decode_readings, load_device_info_polling
+from log_setup import get_payload_log, setup_logging
+from discovery_cache import get_discovery_cache
+from poll_scheduler import PollSchedule, jittered
 
 ##tinytuya.set_debug(True)
 
-# Configure logging to /var/log
+# Un proceso por dispositivo: con varios, METRICS_PORT distinto para cada uno (0 lo desactiva)
+METRICS_PORT = 9105
+
+# Logs asincronos: consola + fichero con rotacion en /var/log, escritos desde un solo hilo
 log_file = "/var/log/generic_polling_monitor_d.log"
-try:
-    # Ensure log directory exists and is writable
-    os.makedirs(os.path.dirname(log_file) if os.path.dirname(log_file) else ".", exist_ok=True)
-    
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(log_file),
-            logging.StreamHandler(sys.stdout)
-        ]
-    )
-    logger = logging.getLogger(__name__)
-except Exception as e:
-    # Fallback if /var/log is not writable
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
-    logger = logging.getLogger(__name__)
-    logger.warning(f"Could not write to {log_file}: {e}")
+setup_logging(log_file)
+logger = logging.getLogger(__name__)
+# Volcado de payloads solo con LOG_LEVEL=DEBUG y limitado por dispositivo
+payload_log = get_payload_log()
 
 # Load devices.monitor.json and get device by name from command-line argument
 if len(sys.argv) < 2:
     logger.error("Uso: ./generic_polling_monitor.py <nombre_dispositivo>")
-    print("Uso: ./generic_polling_monitor.py <nombre_dispositivo>")
     sys.exit(1)
 
 target_device_name = sys.argv[1]
@@ -58,48 +47,88 @@ DEVICEVERSION = device_info.get('version', '3.3')  # Default to 3.3 if not speci
 DEVICE_NAME = device_info.get('name')
 
 
-# Setting the address to 'Auto' or None will trigger a scan which will auto-detect both the address and version, but this can take up to 8 seconds
-print(f' ------------> deviceid= {DEVICEID} ip= {DEVICEIP} devicekey= {DEVICEKEY} version= {DEVICEVERSION}')
-d = tinytuya.Device(DEVICEID,'Auto', DEVICEKEY,version=DEVICEVERSION, persist=True)
+# IP y version de la cache de descubrimiento (broadcasts y conexiones previas) o de devices.monitor.json
+discovery = get_discovery_cache()
+cached = discovery.get(DEVICEID) or {}
+if cached.get('ip'):
+    DEVICEIP = cached['ip']
+    DEVICEVERSION = cached.get('version') or DEVICEVERSION
+logger.info(f"deviceid= {DEVICEID} ip= {DEVICEIP} version= {DEVICEVERSION}")
 # If you know both the address and version then supplying them is a lot quicker
-# d = tinytuya.Device(DEVICEID, DEVICEIP, DEVICEKEY, version=DEVICEVERSION, persist=True)
+d = tinytuya.Device(DEVICEID, DEVICEIP, DEVICEKEY, version=float(DEVICEVERSION), persist=True)
+metrics.start_metrics_server(METRICS_PORT)
+
+
+def request(command, func, *args):
+    """Blocking device request, timed as a device round-trip."""
+    with metrics.timed(metrics.DEVICE_ROUNDTRIP, DEVICE_NAME, command):
+        return func(*args)
+
+
+def count(data):
+    """Record a received payload in the metrics."""
+    if not data:
+        return
+    metrics.packet(DEVICE_NAME)
+    if 'Error' in data:
+        metrics.error(DEVICE_NAME)
+    else:
+        metrics.reading_ok(DEVICE_NAME)
+
+
+def store(data):
+    """Queue a payload for MariaDB unless the change filter drops it; adapts the status interval."""
+    if 'dps' not in data:
+        schedule.ok()
+        return
+    changed = get_change_filter().should_store(DEVICE_NAME, data, device_info)
+    schedule.observe(changed)
+    if changed:
+        with metrics.timed(metrics.DECODE):
+            readings = decode_readings(data, device_info)
+        writer.enqueue(DEVICE_NAME, data, ip=DEVICEIP, origin='polling', readings=readings)
+        logger.debug(f"Status queued for {DEVICE_NAME}")
 
 STATUS_TIMER = 30
 KEEPALIVE_TIMER = 12
+# Sin "status_timer" en devices.monitor.json solo se reciben los cambios que envía el dispositivo;
+# con él, el intervalo se adapta a lo que cambian los valores (poll_scheduler)
+status_timer = device_info.get('status_timer')
+schedule = PollSchedule.for_device(device_info, status_timer or STATUS_TIMER)
 
 
-print(f" > Monitoring Device: {DEVICE_NAME} < ")
-print(" > Send Request for Status < ")
 logger.info(f"Starting monitoring for device: {DEVICE_NAME}")
-data = d.status()
-print('Initial Status: %r' % data)
-print_dps(data, device_info, DEVICE_NAME)
-print("-" * 40)
-
-# Save initial status to DB
+data = request('status', d.status)
+if DEVICEIP != 'Auto' and data and 'Err' in data:
+    # Setting the address to 'Auto' will trigger a scan which will auto-detect both the address and version, but this can take up to 8 seconds
+    logger.warning(f"{DEVICE_NAME} no responde en {DEVICEIP}: {data.get('Error')}. Buscando en la red")
+    d.close()
+    discovery.forget(DEVICEID)
+    metrics.error(DEVICE_NAME)
+    metrics.reconnect(DEVICE_NAME)
+    d = tinytuya.Device(DEVICEID, 'Auto', DEVICEKEY, version=float(device_info.get('version', '3.3')), persist=True)
+    data = request('status', d.status)
+if data and 'Err' not in data:
+    DEVICEIP = d.address
+    discovery.update(DEVICEID, d.address, d.version)
+count(data)
+payload_log(DEVICE_NAME, data, device_info, 'Initial Status')
+
+# Save initial status to DB (write-behind: the writer thread does the INSERT)
+writer = get_writer()
 if data and 'Error' not in data:
-    try:
-        insert_status_db(DEVICE_NAME, data)
-        logger.info(f"Initial status saved for {DEVICE_NAME}")
-    except Exception as e:
-        logger.error(f"Could not save to MariaDB for {DEVICE_NAME}: {e}")
-        print("No se pudo guardar en MariaDB:", e)
+    store(data)
 
 if data and 'Err' in data:
     logger.warning(f"Status request returned an error for {DEVICE_NAME}. Version: {d.version}, Local Key: {d.local_key}")
-    print("Status request returned an error, is version %r and local key %r correct?" % (d.version, d.local_key))
-
-print(" > Begin Monitor Loop <")
-heartbeat_time = time.time() + KEEPALIVE_TIMER
-status_time =  None
-
 
-# Uncomment if you want the monitor to constantly request status - otherwise you
-# will only get updates when state changes
-#status_time = time.time() + STATUS_TIMER
+logger.debug(f"{DEVICE_NAME}: begin monitor loop")
+heartbeat_time = time.monotonic() + jittered(KEEPALIVE_TIMER)
+status_time = time.monotonic() + schedule.first_delay() if status_timer else None
 
 while(True):
-    if status_time and time.time() >= status_time:
+    now = time.monotonic()
+    if status_time and now >= status_time:
         # Uncomment if your device provides power monitoring data but it is not updating
         # Some devices require a UPDATEDPS command to force measurements of power.
         # print(" > Send DPS Update Request < ")
@@ -110,56 +139,30 @@ while(True):
         # d.send(payload)
 
         # poll for status
-        print(" > Send Request for Status < ")
         logger.debug(f"Requesting status for {DEVICE_NAME}")
-        data = d.status()
-        status_time = time.time() + STATUS_TIMER
-        heartbeat_time = time.time() + KEEPALIVE_TIMER
+        data = request('status', d.status)
+        heartbeat_time = time.monotonic() + jittered(KEEPALIVE_TIMER)
         
-        # Save status to DB
-        if data:
-            print(f'{DEVICE_NAME}: Received Payload: %r' % data)
-            print_dps(data, device_info, DEVICE_NAME)
-            print("-" * 40)
-            if 'Error' not in data:
-                try:
-                    insert_status_db(DEVICE_NAME, data, ip=DEVICEIP, origin='polling')
-                    logger.debug(f"Status saved for {DEVICE_NAME}")
-                except Exception as e:
-                    logger.error(f"Could not save to MariaDB for {DEVICE_NAME}: {e}")
-                    print("No se pudo guardar en MariaDB:", e)
-            else:        
-                logger.warning(f"Received error for {DEVICE_NAME}, retrying in 5 seconds...")
-                print(f'{DEVICE_NAME}: Received error, omitting db save to retry 5 seconds...')
-                time.sleep(5)
-    elif time.time() >= heartbeat_time:
+    elif now >= heartbeat_time:
         # send a keep-alive
-        data = d.heartbeat(nowait=False)
-        heartbeat_time = time.time() + KEEPALIVE_TIMER
+        data = request('heartbeat', d.heartbeat, False)
+        heartbeat_time = time.monotonic() + jittered(KEEPALIVE_TIMER)
     else:
         # no need to send anything, just listen for an asynchronous update
         data = d.receive()
-    
-    #if data is not None:
-    #    print(f'{DEVICE_NAME}: Received Payload: %r' % data)
-    #    Print formatted DPS data
-    #    print_dps(data, device_info, DEVICE_NAME)
-    #    print("-" * 40)
 
     if data :
-        print(f'{DEVICE_NAME}: Received Payload: %r' % data)
-        # Print formatted DPS data
-        print_dps(data, device_info, DEVICE_NAME)
-        print("-" * 40)
+        count(data)
+        payload_log(DEVICE_NAME, data, device_info)
         # No guardar si hay un Error
         if 'Error' not in data:
-            try:
-                insert_status_db(DEVICE_NAME, data, ip=DEVICEIP, origin='polling')
-                logger.debug(f"Status saved for {DEVICE_NAME}")
-            except Exception as e:
-                logger.error(f"Could not save to MariaDB for {DEVICE_NAME}: {e}")
-                print("No se pudo guardar en MariaDB:", e)
-        else:        
-            logger.warning(f"Received error for {DEVICE_NAME}, retrying in 5 seconds...")
-            print(f'{DEVICE_NAME}: Received error, omitting db save to retry 5 seconds...')
-            time.sleep(5)
+            store(data)
+        else:
+            # backoff exponencial con jitter mientras el dispositivo siga fallando
+            delay = schedule.error_delay()
+            logger.warning(f"Received error for {DEVICE_NAME}, retrying in {delay:.1f} seconds "
+                           f"(fallo {schedule.errors} seguido)...")
+            time.sleep(delay)
+    if status_time and (now >= status_time or (data and 'dps' in data)):
+        # un cambio recibido de forma asincrona tambien cuenta como lectura
+        status_time = time.monotonic() + schedule.next_delay()